@@ -1,13 +1,18 @@
 import streamlit as st
 import pandas as pd
-from sklearn.metrics import accuracy_score
 import logging
-import pickle
 
 from services.error_analysis import visualize_error_analysis
-from services.feature_importance import visualize_feature_importance, visualize_interval_importance, visualize_joint_importance, get_feature_selection_inputs
-from services.data import demo_cases, preset_target, preset_training, load_data, prepare_data, plot_target_distribution, plot_feature_profiles, plot_feature_distribution
-from services.model import train_model, evaluate_model
+from services.feature_importance import visualize_feature_importance, visualize_interval_importance, visualize_partial_dependence, visualize_joint_importance, get_feature_selection_inputs, selected_band, BINNING_METHODS
+from services.feature_groups import feature_grouping_inputs, importance_frame
+from services.data import demo_cases, SplitPlan, plot_target_distribution, plot_feature_profiles, plot_feature_distribution
+from services.workers import get_max_workers, worker_budget, parallel_context
+from services.jobs import submit_training_job, submit_comparison_jobs, collect_training_job, show_training_progress, training_config
+from services.search import submit_search_job, collect_search_job, show_search_progress
+from services.model import ENGINES, feature_importances
+from services.model_store import forest_file
+from services.feature_store import ingest_upload
+from services.registry import visualize_model_registry
 
 # configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -23,6 +28,11 @@ st.write("""
     you can download the trained model.
 """)
 
+# apply the results of finished training jobs and searches (of both models)
+for suffix in ['', '_compare']:
+    collect_training_job(suffix)
+    collect_search_job(suffix)
+
 # -----------------------------------------------------------
 # Sidebar
 # -----------------------------------------------------------
@@ -53,25 +63,49 @@ with st.sidebar.expander("**Data**", expanded=False):
     training_file = st.file_uploader("Upload Training CSV", type=["csv"])
 
     st.session_state[f'custom_target{st.session_state.suffix}'] = target_file is not None
-    if target_file is not None:
-        df_target = pd.read_csv(target_file)
-        st.session_state[f'target_data{st.session_state.suffix}'] = df_target
-        logging.info(f"Added target file {'for comparison model ' if st.session_state.train_comparison_model else ''}to session state.")
-
     st.session_state[f'custom_training{st.session_state.suffix}'] = training_file is not None
-    if training_file is not None:
-        df_training = pd.read_csv(training_file)
-        st.session_state[f'training_data{st.session_state.suffix}'] = df_training
-        logging.info(f"Added training file {'for comparison model ' if st.session_state.train_comparison_model else ''}to session state.")
+
+    # stream both files into the feature store (once per upload)
+    if target_file is not None and training_file is not None:
+        upload_ids = (target_file.file_id, training_file.file_id)
+        if st.session_state.get(f'custom_upload{st.session_state.suffix}') != upload_ids:
+            try:
+                with st.spinner('Reading the data...'):
+                    st.session_state[f'custom_dataset{st.session_state.suffix}'] = ingest_upload(target_file, training_file)
+                st.session_state[f'custom_upload{st.session_state.suffix}'] = upload_ids
+                logging.info(f"Added uploaded files {'for comparison model ' if st.session_state.train_comparison_model else ''}to feature store.")
+            except (ValueError, pd.errors.ParserError) as e:
+                st.session_state.pop(f'custom_dataset{st.session_state.suffix}', None)
+                st.session_state.pop(f'custom_upload{st.session_state.suffix}', None)
+                st.error(f"Uploaded data could not be read: {e}")
+                logging.error(f"Uploaded data could not be read: {e}")
+    elif target_file is not None or training_file is not None:
+        st.info("Please upload both target and training data.")
 
     show_data = st.checkbox('Show raw data')
 
+# sidebar for performance settings
+with st.sidebar.expander("**Performance**", expanded=False):
+
+    # number of CPU cores for training, prediction and feature importance
+    max_workers = get_max_workers()
+    requested_workers = max_workers
+    if max_workers > 1:
+        requested_workers = st.slider('Number of Workers', min_value=1, max_value=max_workers, value=max_workers)
+
+    # share the cores with other active sessions
+    st.session_state.n_jobs = worker_budget(requested_workers)
+    if st.session_state.n_jobs < requested_workers:
+        st.info(f"Using {st.session_state.n_jobs} workers as other sessions are active.")
+
 # initialize session state with default parameters
 
 defaults = {
+    'engine': 'Random Forest',
     'max_depth': 14,
     'n_estimators': 384,
     'data_percentage': 10,
+    'stratify': False,
     'normalize_cm': True,
     'min_samples_split': 2,
     'min_samples_leaf': 1,
@@ -86,6 +120,14 @@ for key, value in defaults.items():
 # sidebar for user inputs
 with st.sidebar.expander("**Model**", expanded=True):
 
+    # model engine (hyperparameters that it does not use are disabled)
+    engine = st.selectbox(
+        'Model Engine',
+        options=list(ENGINES.keys()),
+        index=list(ENGINES.keys()).index(st.session_state[f'engine{st.session_state.suffix}'])
+    )
+    engine_parameters = ENGINES[engine]['parameters']
+
     # user inputs
     max_depth = st.slider(
         'Max Depth', 
@@ -98,14 +140,16 @@ with st.sidebar.expander("**Model**", expanded=True):
         'Number of Estimators', 
         min_value=1,
         max_value=1000, 
-        value=st.session_state[f'n_estimators{st.session_state.suffix}']
+        value=st.session_state[f'n_estimators{st.session_state.suffix}'],
+        help='Number of trees of a random forest or maximum number of boosting iterations.'
     )
 
     min_samples_split = st.slider(
         'Min Samples Split', 
         min_value=2, 
         max_value=20, 
-        value=st.session_state[f'min_samples_split{st.session_state.suffix}']
+        value=st.session_state[f'min_samples_split{st.session_state.suffix}'],
+        disabled='min_samples_split' not in engine_parameters
     )
 
     min_samples_leaf = st.slider(
@@ -128,15 +172,19 @@ with st.sidebar.expander("**Model**", expanded=True):
         value=st.session_state[f'data_percentage{st.session_state.suffix}']
     )
 
-    # check if the resulting data is too small or none
-    if data_percentage != st.session_state[f'data_percentage{st.session_state.suffix}']:
-        if 'training_data' in st.session_state and 'target_data' in st.session_state:
-            df_combined = pd.concat([st.session_state['training_data'], st.session_state['target_data']], axis=1)
-            _, _, _, _, label_encoder = prepare_data(df_combined, data_percentage)
-            if label_encoder is None or len(label_encoder.classes_) == 0:
+    stratify = st.checkbox(
+        'Stratified Split', 
+        value=st.session_state[f'stratify{st.session_state.suffix}']
+    )
+
+    # check if the resulting data is too small or none (from the sizes of the split)
+    if data_percentage != st.session_state[f'data_percentage{st.session_state.suffix}'] or stratify != st.session_state[f'stratify{st.session_state.suffix}']:
+        if f'dataset{st.session_state.suffix}' in st.session_state:
+            if not SplitPlan(st.session_state[f'dataset{st.session_state.suffix}'], data_percentage, stratify).is_valid():
                 st.warning("The resulting data is too small or none. Please choose a higher percentage.")
                 logging.warning("The resulting data is too small or none. Please choose a higher percentage.")
                 data_percentage = st.session_state[f'data_percentage{st.session_state.suffix}']
+                stratify = st.session_state[f'stratify{st.session_state.suffix}']
 
     normalize_cm = st.checkbox(
         'Normalize Confusion Matrix', 
@@ -145,9 +193,11 @@ with st.sidebar.expander("**Model**", expanded=True):
 
     # check if parameters have changed
     parameters_changed = (
+        engine != st.session_state[f'engine{st.session_state.suffix}'] or
         max_depth != st.session_state[f'max_depth{st.session_state.suffix}'] or
         n_estimators != st.session_state[f'n_estimators{st.session_state.suffix}'] or
         data_percentage != st.session_state[f'data_percentage{st.session_state.suffix}'] or
+        stratify != st.session_state[f'stratify{st.session_state.suffix}'] or
         normalize_cm != st.session_state[f'normalize_cm{st.session_state.suffix}'] or
         min_samples_split != st.session_state[f'min_samples_split{st.session_state.suffix}'] or
         min_samples_leaf != st.session_state[f'min_samples_leaf{st.session_state.suffix}'] or
@@ -157,100 +207,101 @@ with st.sidebar.expander("**Model**", expanded=True):
         st.warning("Parameters have changed. New data is available. Please update.")
 
     # update session state
+    st.session_state[f'engine{st.session_state.suffix}'] = engine
     st.session_state[f'max_depth{st.session_state.suffix}'] = max_depth
     st.session_state[f'n_estimators{st.session_state.suffix}'] = n_estimators
     st.session_state[f'data_percentage{st.session_state.suffix}'] = data_percentage
+    st.session_state[f'stratify{st.session_state.suffix}'] = stratify
     st.session_state[f'normalize_cm{st.session_state.suffix}'] = normalize_cm
     st.session_state[f'min_samples_split{st.session_state.suffix}'] = min_samples_split
     st.session_state[f'min_samples_leaf{st.session_state.suffix}'] = min_samples_leaf
     st.session_state[f'max_features{st.session_state.suffix}'] = max_features
-    # update data and model
-    if st.button('Update Model'):
-
-        # spinner while loading data
-        with st.spinner('Preparing the data...'):
-
-            # load data
-            load_preset_target = f'target_data{st.session_state.suffix}' not in st.session_state
-            load_preset_training = f'training_data{st.session_state.suffix}' not in st.session_state
-            st.session_state[f'training_data{st.session_state.suffix}'], st.session_state[f'target_data{st.session_state.suffix}'], df_combined = load_data(
-                target_data=st.session_state[f'target_data{st.session_state.suffix}'] if not load_preset_target else None,
-                training_data=st.session_state[f'training_data{st.session_state.suffix}'] if not load_preset_training else None,
-                selected_demo_case=st.session_state[f'selected_demo_case{st.session_state.suffix}']
-            ) 
-
-            if df_combined is None:
-                logging.error("Data loading failed. Please adjust data settings.")
-                st.error("Data loading failed. Please adjust data settings.")
-            else:
-                logging.info("Data loaded successfully.")
-
-                # prepare data
-                X_train, st.session_state[f'X_test{st.session_state.suffix}'], y_train, st.session_state[f'y_test{st.session_state.suffix}'], st.session_state[f'label_encoder{st.session_state.suffix}'] \
-                    = prepare_data(df_combined, data_percentage)
-                logging.info("Data prepared successfully.")
-
-        # spinner while training model
-        with st.spinner('Training the model...'):
-
-            # check if data loading failed
-            try:
-                # check data is not None or long enough
-                if (X_train is None) or (y_train is None) or (st.session_state[f'X_test{st.session_state.suffix}'] is None) or (st.session_state[f'y_test{st.session_state.suffix}'] is None):
-                    logging.error("Data preparation failed. Please adjust percentage of data used.")
-                    st.session_state[f'data_error{st.session_state.suffix}'] = True
-                else:
-                    st.session_state[f'data_error{st.session_state.suffix}'] = False
-            except NameError:
-                st.session_state[f'data_error{st.session_state.suffix}'] = True
-
-            if st.session_state[f'data_error{st.session_state.suffix}']:
-                pass
-            else:
-                # train the model
-                st.session_state[f'rf_classifier{st.session_state.suffix}'] = train_model(
-                    X_train, 
-                    y_train, 
-                    max_depth, 
-                    n_estimators, 
-                    min_samples_split, 
-                    min_samples_leaf, 
-                    max_features
-                )
-                st.session_state[f'y_pred{st.session_state.suffix}'] = st.session_state[f'rf_classifier{st.session_state.suffix}'].predict(st.session_state[f'X_test{st.session_state.suffix}'])
-                logging.info("Model trained successfully.")
-
-                # spinner while evaluating
-                with st.spinner('Evaluating the model...'):
-                    st.session_state[f'accuracy{st.session_state.suffix}'], st.session_state[f'precision{st.session_state.suffix}'], st.session_state[f'recall{st.session_state.suffix}'], \
-                        st.session_state[f'f1{st.session_state.suffix}'], st.session_state[f'unique_labels{st.session_state.suffix}'], st.session_state[f'cm{st.session_state.suffix}'] = evaluate_model(
-                            st.session_state[f'y_test{st.session_state.suffix}'], 
-                            st.session_state[f'y_pred{st.session_state.suffix}'], 
-                            st.session_state[f'label_encoder{st.session_state.suffix}'], 
-                            st.session_state[f'normalize_cm{st.session_state.suffix}']
-                        )
-                
-                st.session_state[f'first_run{st.session_state.suffix}'] = False
+    # update data and model (also with the best parameters of a search)
+    if st.button('Update Model') or st.session_state.pop(f'apply_search{st.session_state.suffix}', False):
+
+        # train in the background (the previous model can still be explored meanwhile)
+        st.session_state[f'training_job{st.session_state.suffix}'] = submit_training_job(
+            config=training_config(st.session_state.suffix),
+            n_jobs=st.session_state.n_jobs
+        )
+
+    # train the main and the comparison model at the same time
+    if st.session_state.train_comparison_model and st.button('Update Both Models'):
+        submit_comparison_jobs(n_jobs=st.session_state.n_jobs)
+
+    # progress and errors of the training jobs (of both models if the comparison model is trained)
+    for suffix in ['', '_compare'] if st.session_state.train_comparison_model else ['']:
+        title = ('Main model: ' if suffix == '' else 'Comparison model: ') if st.session_state.train_comparison_model else ''
+        if f'training_job{suffix}' in st.session_state:
+            show_training_progress(st.session_state[f'training_job{suffix}'], title=title)
+        if f'training_error{suffix}' in st.session_state:
+            st.error(title + st.session_state.pop(f'training_error{suffix}'))
 
     # download model button
     if f'rf_classifier{st.session_state.suffix}' in st.session_state:
-        model_bytes = pickle.dumps(st.session_state[f'rf_classifier{st.session_state.suffix}'])
+        # read the compressed model file from the model store (instead of pickling on every run)
+        model_bytes = forest_file(st.session_state[f'rf_classifier{st.session_state.suffix}'])
         st.download_button(
             label="Download Model",
             data=model_bytes,
-            file_name=f"trained_model{st.session_state.suffix}.pkl",
+            file_name=f"trained_model{st.session_state.suffix}.joblib",
             mime="application/octet-stream"
         )
 
+# sidebar for hyperparameter search
+with st.sidebar.expander("**Hyperparameter Search**", expanded=False):
+    st.write("Search the model parameters with successive halving: many candidates are trained on a small share of the data and only the best ones on larger shares.")
+
+    num_candidates = st.slider('Number of Candidates', min_value=9, max_value=81, value=27)
+    search_percentage = st.slider(
+        'Maximum Percentage of Data', 
+        min_value=1, 
+        max_value=100, 
+        value=st.session_state[f'data_percentage{st.session_state.suffix}']
+    )
+
+    # search in the background (with the selected data and engine)
+    if f'search_job{st.session_state.suffix}' in st.session_state:
+        if st.button('Stop Search'):
+            st.session_state[f'search_job{st.session_state.suffix}'].cancelled = True
+        show_search_progress(st.session_state[f'search_job{st.session_state.suffix}'])
+    elif st.button('Start Search'):
+        st.session_state[f'search_job{st.session_state.suffix}'] = submit_search_job(
+            config=training_config(st.session_state.suffix),
+            num_candidates=num_candidates,
+            max_percentage=search_percentage,
+            n_jobs=st.session_state.n_jobs
+        )
+        st.rerun()
+
+    # errors of the last search
+    if f'search_error{st.session_state.suffix}' in st.session_state:
+        st.error(st.session_state.pop(f'search_error{st.session_state.suffix}'))
+
+    # leaderboard of the last search and training with the best parameters
+    if f'search_result{st.session_state.suffix}' in st.session_state:
+        search_result = st.session_state[f'search_result{st.session_state.suffix}']
+        st.dataframe(search_result['leaderboard'], hide_index=True)
+        st.write(f"Best parameters: {search_result['best']}")
+        if st.button('Apply Best Parameters'):
+            for key, value in search_result['best'].items():
+                st.session_state[f'{key}{st.session_state.suffix}'] = value
+            st.session_state[f'data_percentage{st.session_state.suffix}'] = search_result['data_percentage']
+            st.session_state[f'apply_search{st.session_state.suffix}'] = True
+            st.rerun()
+
+# select the class with the lowest accuracy for a model that was trained while the other one was shown
+for suffix in ['', '_compare']:
+    if f'unique_labels{suffix}' in st.session_state and st.session_state.get(f'selected_class{suffix}') not in list(st.session_state[f'unique_labels{suffix}']):
+        class_accuracies = dict(zip(st.session_state[f'unique_labels{suffix}'], st.session_state[f'metrics{suffix}']['class_accuracy']))
+        st.session_state[f'selected_class{suffix}'] = min(class_accuracies, key=class_accuracies.get)
+        st.session_state[f'selected_class_index{suffix}'] = list(st.session_state[f'unique_labels{suffix}']).index(st.session_state[f'selected_class{suffix}'])
+
 # show results
 if f'first_run{st.session_state.suffix}' in st.session_state:
 
     # find the class with the lowest accuracy
-    class_accuracies = {}
-    for i, label in enumerate(st.session_state[f'unique_labels{st.session_state.suffix}']):
-        class_y_test = (st.session_state[f'y_test{st.session_state.suffix}'] == i).astype(int)
-        class_y_pred = (st.session_state[f'y_pred{st.session_state.suffix}'] == i).astype(int)
-        class_accuracies[label] = accuracy_score(class_y_test, class_y_pred)
+    class_accuracies = dict(zip(st.session_state[f'unique_labels{st.session_state.suffix}'], st.session_state[f'metrics{st.session_state.suffix}']['class_accuracy']))
     st.session_state[f'selected_class{st.session_state.suffix}'] = min(class_accuracies, key=class_accuracies.get)
     st.session_state[f'selected_class_index{st.session_state.suffix}'] = list(st.session_state[f'unique_labels{st.session_state.suffix}']).index(st.session_state[f'selected_class{st.session_state.suffix}'])
 
@@ -265,7 +316,7 @@ if f'first_run{st.session_state.suffix}' in st.session_state:
     # update selected class index when the selected class changes
     st.session_state[f'selected_class_index{st.session_state.suffix}'] = list(st.session_state[f'unique_labels{st.session_state.suffix}']).index(st.session_state[f'selected_class{st.session_state.suffix}'])
 
-tab1, tab2, tab3 = st.tabs([ "Data Exploration", "Explorative Error Analysis", "Feature Importance"])
+tab1, tab2, tab3, tab4 = st.tabs([ "Data Exploration", "Explorative Error Analysis", "Feature Importance", "Model Comparison"])
 
 # -----------------------------------------------------------
 # Data Exploration
@@ -285,8 +336,8 @@ with tab1:
                 # show data as DataFrames
                 if show_data:
                     with st.spinner('Loading the data...'):
-                        df_target = st.session_state.get('target_data', pd.read_csv(preset_target))
-                        df_training = st.session_state.get('training_data', pd.read_csv(preset_training))
+                        df_target = st.session_state['dataset'].target_frame()
+                        df_training = st.session_state['dataset'].training_frame()
                         
                         with st.expander("**Training Data**", expanded=False):
                             st.write(df_training)
@@ -296,7 +347,7 @@ with tab1:
                         
                         logging.info("Raw data displayed successfully.")
 
-                df_combined = pd.concat([st.session_state[f'training_data'], st.session_state[f'target_data']], axis=1)
+                df_combined = st.session_state['dataset'].combined_frame()
                 st.subheader("Main Model")
                 plot_target_distribution(df_combined, suffix='')
                 plot_feature_profiles(df_combined, suffix='')
@@ -307,8 +358,8 @@ with tab1:
                 # show data as DataFrames
                 if show_data:
                     with st.spinner('Loading the data...'):
-                        df_target = st.session_state.get('target_data_compare', pd.read_csv(preset_target))
-                        df_training = st.session_state.get('training_data_compare', pd.read_csv(preset_training))
+                        df_target = st.session_state['dataset_compare'].target_frame()
+                        df_training = st.session_state['dataset_compare'].training_frame()
                         
                         with st.expander("**Training Data**", expanded=False):
                             st.write(df_training)
@@ -319,7 +370,7 @@ with tab1:
                         logging.info("Raw data displayed successfully.")
 
                 st.subheader("Comparison Model")
-                df_combined_compare = pd.concat([st.session_state[f'training_data_compare'], st.session_state[f'target_data_compare']], axis=1)
+                df_combined_compare = st.session_state['dataset_compare'].combined_frame()
                 plot_target_distribution(df_combined_compare, suffix='_compare')
                 plot_feature_profiles(df_combined_compare, suffix='_compare')
                 plot_feature_distribution(df_combined_compare, suffix='_compare')
@@ -328,8 +379,8 @@ with tab1:
             # show data as DataFrames
             if show_data:
                 with st.spinner('Loading the data...'):
-                    df_target = st.session_state.get(f'target_data{st.session_state.suffix}', pd.read_csv(preset_target))
-                    df_training = st.session_state.get(f'training_data{st.session_state.suffix}', pd.read_csv(preset_training))
+                    df_target = st.session_state[f'dataset{st.session_state.suffix}'].target_frame()
+                    df_training = st.session_state[f'dataset{st.session_state.suffix}'].training_frame()
                     
                     with st.expander("**Training Data**", expanded=False):
                         st.write(df_training)
@@ -339,7 +390,7 @@ with tab1:
                     
                     logging.info("Raw data displayed successfully.")
 
-            df_combined = pd.concat([st.session_state[f'training_data{st.session_state.suffix}'], st.session_state[f'target_data{st.session_state.suffix}']], axis=1)
+            df_combined = st.session_state[f'dataset{st.session_state.suffix}'].combined_frame()
             plot_target_distribution(df_combined, suffix='')
             plot_feature_profiles(df_combined, suffix='')
             plot_feature_distribution(df_combined, suffix='')
@@ -352,7 +403,13 @@ with tab1:
 # Explorative Error Analysis
 # -----------------------------------------------------------
 
-with tab2:
+# test data of the trained models (shared by all sessions, the session state only holds the split plan)
+test_data = {
+    suffix: st.session_state[f'split{suffix}'].X_test()
+    for suffix in ['', '_compare'] if f'split{suffix}' in st.session_state
+}
+
+with tab2, parallel_context(st.session_state.n_jobs):
 
     if f'first_run{st.session_state.suffix}' not in st.session_state or st.session_state[f'data_error{st.session_state.suffix}']:
         placeholder = st.empty()
@@ -364,6 +421,7 @@ with tab2:
 
             with col1:
                 st.subheader("Main Model")
+                st.caption(f"{st.session_state.get('trained_engine', 'Random Forest')}, trained in {st.session_state.get('train_time', 0):.2f} seconds")
                 visualize_error_analysis(
                     st.session_state.y_test, 
                     st.session_state.y_pred, 
@@ -375,12 +433,16 @@ with tab2:
                     st.session_state.get('recall', 0), 
                     st.session_state.get('f1', 0), 
                     st.session_state.cm,
-                    suffix=''
+                    st.session_state.metrics,
+                    suffix='',
+                    model=st.session_state.rf_classifier,
+                    X_test=test_data.get('')
                 )
                 logging.info("Main model results displayed successfully.")
 
             with col2:
                 st.subheader("Comparison Model")
+                st.caption(f"{st.session_state.get('trained_engine_compare', 'Random Forest')}, trained in {st.session_state.get('train_time_compare', 0):.2f} seconds")
                 visualize_error_analysis(
                     st.session_state[f'y_test_compare'], 
                     st.session_state[f'y_pred_compare'], 
@@ -392,7 +454,10 @@ with tab2:
                     st.session_state.get(f'recall_compare', 0), 
                     st.session_state.get(f'f1_compare', 0), 
                     st.session_state[f'cm_compare'],
-                    suffix='_compare'
+                    st.session_state[f'metrics_compare'],
+                    suffix='_compare',
+                    model=st.session_state.rf_classifier_compare,
+                    X_test=test_data.get('_compare')
                 )
                 logging.info(f"Comparison model results displayed successfully.")
         else:
@@ -407,7 +472,10 @@ with tab2:
                 st.session_state.get(f'recall{st.session_state.suffix}', 0), 
                 st.session_state.get(f'f1{st.session_state.suffix}', 0), 
                 st.session_state[f'cm{st.session_state.suffix}'],
-                suffix=st.session_state.suffix
+                st.session_state[f'metrics{st.session_state.suffix}'],
+                suffix=st.session_state.suffix,
+                model=st.session_state[f'rf_classifier{st.session_state.suffix}'],
+                X_test=test_data.get(st.session_state.suffix)
             )
             logging.info(f"Results displayed successfully.")
 
@@ -415,7 +483,7 @@ with tab2:
 # Feature Importance & Interactions
 # -----------------------------------------------------------
 
-with tab3:
+with tab3, parallel_context(st.session_state.n_jobs):
     if f'first_run{st.session_state.suffix}' not in st.session_state or st.session_state[f'data_error{st.session_state.suffix}']:
         st.warning("Please train the model first to view feature analysis.")
     else:
@@ -424,10 +492,17 @@ with tab3:
 
             with col1:
                 st.subheader("Main Model")
+                # group adjacent features (e.g. wavelengths of a spectrum) into bands for all analyses below
+                groups = feature_grouping_inputs(test_data[''], suffix='')
+
                 with st.expander("**Feature Importance**", expanded=True):
                     visualize_feature_importance(
                         st.session_state.rf_classifier,
-                        suffix=''
+                        suffix='',
+                        feature_names=test_data[''].columns,
+                        X_test=test_data[''],
+                        y_test=st.session_state.y_test,
+                        groups=groups
                     )
                     logging.info("Feature importance displayed successfully.")
 
@@ -435,15 +510,16 @@ with tab3:
                     st.write("""
                         Assess the impact of feature value intervals on the prediction accuracy by splitting a feature into intervals and mapping every data point to the boundaries of that interval. By comparing evaluation metrics of original data to the one with a transformed interval of our choice, we derive the importance of that interval to the prediction.
                     """)
-                    importances = st.session_state.rf_classifier.feature_importances_
-                    feature_names = st.session_state.X_test.columns
-                    feature_importance_df = pd.DataFrame({'feature': feature_names, 'importance': importances}).sort_values(by='importance', ascending=False)
+                    importances = feature_importances(st.session_state.rf_classifier)
+                    feature_names = test_data[''].columns
+                    feature_importance_df = importance_frame(importances, feature_names, groups).sort_values(by='importance', ascending=False)
                     selected_feature = st.selectbox("Select Feature", feature_importance_df['feature'], index=0, key='feature')
-                    feature_index = list(st.session_state.X_test.columns).index(selected_feature)
+                    feature_index = selected_band(feature_importance_df, feature_names, selected_feature)
                     num_intervals = st.slider('Number of Intervals', min_value=1, max_value=20, value=10, key='intervals')
+                    binning = st.selectbox('Binning', BINNING_METHODS, key='binning')
                     visualize_interval_importance(
                         st.session_state.rf_classifier, 
-                        st.session_state.X_test, 
+                        test_data[''], 
                         st.session_state.y_test, 
                         st.session_state.accuracy, 
                         st.session_state.precision, 
@@ -451,34 +527,55 @@ with tab3:
                         st.session_state.f1, 
                         feature_index, 
                         num_intervals,
-                        suffix=''
+                        suffix='',
+                        binning=binning
                     )
 
+                    # how the predicted class probabilities move with the feature (from the same interval limits)
+                    if st.toggle('Show Partial Dependence', key='partial_dependence'):
+                        visualize_partial_dependence(
+                            st.session_state.rf_classifier,
+                            test_data[''],
+                            feature_index,
+                            num_intervals,
+                            class_names=st.session_state.unique_labels,
+                            suffix='',
+                            binning=binning
+                        )
+
                 with st.expander("**Joint Interval Importance**", expanded=False):
                     st.write("""
                         Assess the impact of feature value intervals on the prediction accuracy by splitting two features into intervals and mapping every data point to the boundaries of the intervals. By comparing evaluation metrics of original data to the ones with transformed intervals of our choice, we derive the importance of the intervals to the prediction.
                     """)
-                    importances = st.session_state.rf_classifier.feature_importances_
-                    feature_names = st.session_state.X_test.columns
-                    feature_importance_df = pd.DataFrame({'feature': feature_names, 'importance': importances}).sort_values(by='importance', ascending=False)
-                    selected_feature1, selected_feature2, feature1_index, feature2_index, num_intervals1, num_intervals2 = get_feature_selection_inputs(feature_importance_df, feature_names, suffix='')
+                    importances = feature_importances(st.session_state.rf_classifier)
+                    feature_names = test_data[''].columns
+                    feature_importance_df = importance_frame(importances, feature_names, groups).sort_values(by='importance', ascending=False)
+                    selected_feature1, selected_feature2, feature1_index, feature2_index, num_intervals1, num_intervals2, binning = get_feature_selection_inputs(feature_importance_df, feature_names, suffix='')
                     visualize_joint_importance(
                         st.session_state.rf_classifier, 
-                        st.session_state.X_test, 
+                        test_data[''], 
                         st.session_state.y_test, 
                         feature1_index, 
                         feature2_index, 
                         num_intervals1, 
                         num_intervals2,
-                        suffix=''
+                        suffix='',
+                        binning=binning
                     )
 
             with col2:
                 st.subheader("Comparison Model")
+                # group adjacent features (e.g. wavelengths of a spectrum) into bands for all analyses below
+                groups = feature_grouping_inputs(test_data['_compare'], suffix='_compare')
+
                 with st.expander("**Feature Importance**", expanded=True):
                     visualize_feature_importance(
                         st.session_state[f'rf_classifier_compare'],
-                        suffix='_compare'
+                        suffix='_compare',
+                        feature_names=test_data['_compare'].columns,
+                        X_test=test_data['_compare'],
+                        y_test=st.session_state[f'y_test_compare'],
+                        groups=groups
                     )
                     logging.info("Feature importance displayed successfully.")
 
@@ -486,15 +583,16 @@ with tab3:
                     st.write("""
                         Assess the impact of feature value intervals on the prediction accuracy by splitting a feature into intervals and mapping every data point to the boundaries of that interval. By comparing evaluation metrics of original data to the one with a transformed interval of our choice, we derive the importance of that interval to the prediction.
                     """)
-                    importances = st.session_state[f'rf_classifier_compare'].feature_importances_
-                    feature_names = st.session_state[f'X_test_compare'].columns
-                    feature_importance_df = pd.DataFrame({'feature': feature_names, 'importance': importances}).sort_values(by='importance', ascending=False)
+                    importances = feature_importances(st.session_state[f'rf_classifier_compare'])
+                    feature_names = test_data['_compare'].columns
+                    feature_importance_df = importance_frame(importances, feature_names, groups).sort_values(by='importance', ascending=False)
                     selected_feature = st.selectbox("Select Feature", feature_importance_df['feature'], index=0, key='feature_compare')
-                    feature_index = list(st.session_state[f'X_test_compare'].columns).index(selected_feature)
+                    feature_index = selected_band(feature_importance_df, feature_names, selected_feature)
                     num_intervals = st.slider('Number of Intervals', min_value=1, max_value=20, value=10, key='intervals_compare')
+                    binning = st.selectbox('Binning', BINNING_METHODS, key='binning_compare')
                     visualize_interval_importance(
                         st.session_state[f'rf_classifier_compare'], 
-                        st.session_state[f'X_test_compare'], 
+                        test_data['_compare'], 
                         st.session_state[f'y_test_compare'], 
                         st.session_state[f'accuracy_compare'], 
                         st.session_state[f'precision_compare'], 
@@ -502,32 +600,53 @@ with tab3:
                         st.session_state[f'f1_compare'], 
                         feature_index, 
                         num_intervals,
-                        suffix='_compare'
+                        suffix='_compare',
+                        binning=binning
                     )
 
+                    # how the predicted class probabilities move with the feature (from the same interval limits)
+                    if st.toggle('Show Partial Dependence', key='partial_dependence_compare'):
+                        visualize_partial_dependence(
+                            st.session_state[f'rf_classifier_compare'],
+                            test_data['_compare'],
+                            feature_index,
+                            num_intervals,
+                            class_names=st.session_state[f'unique_labels_compare'],
+                            suffix='_compare',
+                            binning=binning
+                        )
+
                 with st.expander("**Joint Interval Importance**", expanded=False):
                     st.write("""
                         Assess the impact of feature value intervals on the prediction accuracy by splitting two features into intervals and mapping every data point to the boundaries of the intervals. By comparing evaluation metrics of original data to the ones with transformed intervals of our choice, we derive the importance of the intervals to the prediction.
                     """)
-                    importances = st.session_state[f'rf_classifier_compare'].feature_importances_
-                    feature_names = st.session_state[f'X_test_compare'].columns
-                    feature_importance_df = pd.DataFrame({'feature': feature_names, 'importance': importances}).sort_values(by='importance', ascending=False)
-                    selected_feature1, selected_feature2, feature1_index, feature2_index, num_intervals1, num_intervals2 = get_feature_selection_inputs(feature_importance_df, feature_names, suffix='_compare')
+                    importances = feature_importances(st.session_state[f'rf_classifier_compare'])
+                    feature_names = test_data['_compare'].columns
+                    feature_importance_df = importance_frame(importances, feature_names, groups).sort_values(by='importance', ascending=False)
+                    selected_feature1, selected_feature2, feature1_index, feature2_index, num_intervals1, num_intervals2, binning = get_feature_selection_inputs(feature_importance_df, feature_names, suffix='_compare')
                     visualize_joint_importance(
                         st.session_state[f'rf_classifier_compare'], 
-                        st.session_state[f'X_test_compare'], 
+                        test_data['_compare'], 
                         st.session_state[f'y_test_compare'], 
                         feature1_index, 
                         feature2_index, 
                         num_intervals1, 
                         num_intervals2,
-                        suffix='_compare'
+                        suffix='_compare',
+                        binning=binning
                     )
         else:
+            # group adjacent features (e.g. wavelengths of a spectrum) into bands for all analyses below
+            groups = feature_grouping_inputs(test_data[st.session_state.suffix], suffix=st.session_state.suffix)
+
             with st.expander("**Feature Importance**", expanded=True):
                 visualize_feature_importance(
                     st.session_state[f'rf_classifier{st.session_state.suffix}'],
-                    suffix=st.session_state.suffix
+                    suffix=st.session_state.suffix,
+                    feature_names=test_data[st.session_state.suffix].columns,
+                    X_test=test_data[st.session_state.suffix],
+                    y_test=st.session_state[f'y_test{st.session_state.suffix}'],
+                    groups=groups
                 )
                 logging.info("Feature importance displayed successfully.")
 
@@ -535,15 +654,16 @@ with tab3:
                 st.write("""
                     Assess the impact of feature value intervals on the prediction accuracy by splitting a feature into intervals and mapping every data point to the boundaries of that interval. By comparing evaluation metrics of original data to the one with a transformed interval of our choice, we derive the importance of that interval to the prediction.
                 """)
-                importances = st.session_state[f'rf_classifier{st.session_state.suffix}'].feature_importances_
-                feature_names = st.session_state[f'X_test{st.session_state.suffix}'].columns
-                feature_importance_df = pd.DataFrame({'feature': feature_names, 'importance': importances}).sort_values(by='importance', ascending=False)
+                importances = feature_importances(st.session_state[f'rf_classifier{st.session_state.suffix}'])
+                feature_names = test_data[st.session_state.suffix].columns
+                feature_importance_df = importance_frame(importances, feature_names, groups).sort_values(by='importance', ascending=False)
                 selected_feature = st.selectbox("Select Feature", feature_importance_df['feature'], index=0, key=f'feature{st.session_state.suffix}')
-                feature_index = list(st.session_state[f'X_test{st.session_state.suffix}'].columns).index(selected_feature)
+                feature_index = selected_band(feature_importance_df, feature_names, selected_feature)
                 num_intervals = st.slider('Number of Intervals', min_value=1, max_value=20, value=10, key=f'intervals{st.session_state.suffix}')
+                binning = st.selectbox('Binning', BINNING_METHODS, key=f'binning{st.session_state.suffix}')
                 visualize_interval_importance(
                     st.session_state[f'rf_classifier{st.session_state.suffix}'], 
-                    st.session_state[f'X_test{st.session_state.suffix}'], 
+                    test_data[st.session_state.suffix], 
                     st.session_state[f'y_test{st.session_state.suffix}'], 
                     st.session_state[f'accuracy{st.session_state.suffix}'], 
                     st.session_state[f'precision{st.session_state.suffix}'], 
@@ -551,24 +671,48 @@ with tab3:
                     st.session_state[f'f1{st.session_state.suffix}'], 
                     feature_index, 
                     num_intervals,
-                    suffix=st.session_state.suffix
+                    suffix=st.session_state.suffix,
+                    binning=binning
                 )
 
+                # how the predicted class probabilities move with the feature (from the same interval limits)
+                if st.toggle('Show Partial Dependence', key=f'partial_dependence{st.session_state.suffix}'):
+                    visualize_partial_dependence(
+                        st.session_state[f'rf_classifier{st.session_state.suffix}'],
+                        test_data[st.session_state.suffix],
+                        feature_index,
+                        num_intervals,
+                        class_names=st.session_state[f'unique_labels{st.session_state.suffix}'],
+                        suffix=st.session_state.suffix,
+                        binning=binning
+                    )
+
             with st.expander("**Joint Interval Importance**", expanded=False):
                 st.write("""
                     Assess the impact of feature value intervals on the prediction accuracy by splitting two features into intervals and mapping every data point to the boundaries of the intervals. By comparing evaluation metrics of original data to the ones with transformed intervals of our choice, we derive the importance of the intervals to the prediction.
                 """)
-                importances = st.session_state[f'rf_classifier{st.session_state.suffix}'].feature_importances_
-                feature_names = st.session_state[f'X_test{st.session_state.suffix}'].columns
-                feature_importance_df = pd.DataFrame({'feature': feature_names, 'importance': importances}).sort_values(by='importance', ascending=False)
-                selected_feature1, selected_feature2, feature1_index, feature2_index, num_intervals1, num_intervals2 = get_feature_selection_inputs(feature_importance_df, feature_names, suffix=st.session_state.suffix)
+                importances = feature_importances(st.session_state[f'rf_classifier{st.session_state.suffix}'])
+                feature_names = test_data[st.session_state.suffix].columns
+                feature_importance_df = importance_frame(importances, feature_names, groups).sort_values(by='importance', ascending=False)
+                selected_feature1, selected_feature2, feature1_index, feature2_index, num_intervals1, num_intervals2, binning = get_feature_selection_inputs(feature_importance_df, feature_names, suffix=st.session_state.suffix)
                 visualize_joint_importance(
                     st.session_state[f'rf_classifier{st.session_state.suffix}'], 
-                    st.session_state[f'X_test{st.session_state.suffix}'], 
+                    test_data[st.session_state.suffix], 
                     st.session_state[f'y_test{st.session_state.suffix}'], 
                     feature1_index, 
                     feature2_index, 
                     num_intervals1, 
                     num_intervals2,
-                    suffix=st.session_state.suffix
+                    suffix=st.session_state.suffix,
+                    binning=binning
                 )
+
+# -----------------------------------------------------------
+# Model Comparison
+# -----------------------------------------------------------
+
+with tab4:
+    st.write("""
+        Compare all models trained in this session by their quality and their costs. Models on the Pareto front are not beaten by any other model with the same or lower costs.
+    """)
+    visualize_model_registry()
@@ -1,3 +1,49 @@
+import os
+
 RED = "#ff4c4c"
 BLUE = "#007bff"
-SELECTION_COLOR = RED
\ No newline at end of file
+SELECTION_COLOR = RED
+
+# maximum number of matrix elements predicted in one batch
+MAX_BATCH_ELEMENTS = 2**24
+
+# maximum number of workers per session (0 uses all available cores)
+MAX_WORKERS = 0
+
+# seconds after which an inactive session no longer counts towards the worker budget
+SESSION_TIMEOUT = 300
+
+# number of training jobs that run in the background at the same time (across all sessions)
+JOB_WORKERS = 2
+
+# number of hyperparameter searches that run in the background at the same time (across all sessions)
+SEARCH_WORKERS = 1
+
+# number of trained models kept for comparison per session
+MAX_REGISTERED_MODELS = 10
+
+# directory of the persistent model store, its size limit in bytes and the joblib compression level
+MODEL_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.model_store')
+MODEL_STORE_MAX_BYTES = 2 * 1024**3
+MODEL_STORE_COMPRESSION = 3
+
+# directory of the feature store (binary copies of the datasets)
+FEATURE_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.feature_store')
+
+# number of values parsed per chunk when ingesting CSV files
+INGEST_CHUNK_ELEMENTS = 2**22
+
+# maximum size of the materialized dataset rows shared by all sessions (e.g. the test data)
+ROW_CACHE_BYTES = 2**30
+
+# maximum size of cached predictions (labels, probabilities and leaves of models for the test data)
+PREDICTION_CACHE_BYTES = 2**28
+
+# maximum number of rows drawn as individual conditional expectation (ICE) curves
+MAX_ICE_ROWS = 50
+
+# memory budget in bytes of the SHAP values computed at once (shared by all workers)
+SHAP_BATCH_BYTES = 2**28
+
+# maximum number of misclassified samples explained with SHAP values (a random sample of them beyond)
+MAX_EXPLAINED_ROWS = 200
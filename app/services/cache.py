@@ -0,0 +1,178 @@
+import hashlib
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# unique tokens of live model objects (never reused, unlike id())
+_model_tokens = weakref.WeakKeyDictionary()
+_model_tokens_lock = threading.Lock()
+
+# keys attached to live DataFrames (by id, DataFrames are not hashable) with the array they were attached to
+_data_keys = {}
+_data_keys_lock = threading.Lock()
+
+def model_key(model):
+    """
+    Get a unique key for a model object that is safe to use in cache keys.
+    """
+
+    with _model_tokens_lock:
+        token = _model_tokens.get(model)
+        if token is None:
+            token = uuid.uuid4().hex
+            _model_tokens[model] = token
+
+    return token
+
+def fingerprint(*data):
+    """
+    Compute a content fingerprint of arrays, DataFrames and plain values.
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+    for item in data:
+        # include column names of DataFrames
+        if isinstance(item, pd.DataFrame):
+            digest.update(repr(list(item.columns)).encode())
+            item = item.to_numpy()
+        elif isinstance(item, pd.Series):
+            item = item.to_numpy()
+
+        if isinstance(item, np.ndarray):
+            # hash object arrays (e.g. string labels) by their text
+            if item.dtype == object:
+                item = item.astype(str)
+            item = np.ascontiguousarray(item)
+            digest.update(repr((item.shape, item.dtype.str)).encode())
+            digest.update(item.reshape(-1).view(np.uint8))
+        else:
+            digest.update(repr(item).encode())
+
+    return digest.hexdigest()
+
+def _array_identity(values):
+    """
+    Get the memory location, shape and strides of an array.
+    """
+
+    return (values.__array_interface__['data'][0], values.shape, values.strides)
+
+def attach_data_key(X, key):
+    """
+    Identify the rows of a DataFrame by a key instead of a fingerprint of its data.
+
+    The key belongs to this DataFrame object (not to copies) and only while it is backed by the same array,
+    so the array should be read-only. Assigning columns replaces the array and drops the key.
+    """
+
+    def forget(reference, frame_id=id(X)):
+        with _data_keys_lock:
+            if _data_keys.get(frame_id, (None,))[0] is reference:
+                del _data_keys[frame_id]
+
+    with _data_keys_lock:
+        _data_keys[id(X)] = (weakref.ref(X, forget), _array_identity(X.to_numpy()), key)
+
+def data_key(X):
+    """
+    Get a key for the rows of X: the key attached by the split plan (see SplitPlan) or a fingerprint of the data.
+    """
+
+    if isinstance(X, pd.DataFrame):
+        with _data_keys_lock:
+            entry = _data_keys.get(id(X))
+        if entry is not None and entry[0]() is X and entry[1] == _array_identity(X.to_numpy()):
+            return entry[2]
+
+    return fingerprint(X)
+
+def nbytes(value):
+    """
+    Estimate the memory used by a (nested) cache value.
+    """
+
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage().sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage())
+    if isinstance(value, dict):
+        return sum(nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes(item) for item in value)
+    return getattr(value, 'nbytes', 0)
+
+class LRUCache:
+    """
+    Thread-safe mapping that evicts the least recently used entries beyond an entry or size limit.
+    """
+
+    def __init__(self, max_entries=32, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def size(self):
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def get(self, key, default=None):
+        """
+        Get a value and mark it as recently used.
+        """
+
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value, size=None):
+        """
+        Store a value and evict old entries if the cache is full.
+        """
+
+        size = nbytes(value) if size is None else size
+        with self._lock:
+            self._entries[key] = value
+            self._sizes[key] = size
+            self._entries.move_to_end(key)
+
+            # evict least recently used entries (but keep the new one)
+            while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries or
+                (self.max_bytes is not None and sum(self._sizes.values()) > self.max_bytes)
+            ):
+                evicted, _ = self._entries.popitem(last=False)
+                del self._sizes[evicted]
+
+        return value
+
+    def pop(self, key, default=None):
+        """
+        Remove a value from the cache.
+        """
+
+        with self._lock:
+            self._sizes.pop(key, None)
+            return self._entries.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
@@ -1,11 +1,18 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
+import sklearn
 from sklearn.preprocessing import LabelEncoder
-from sklearn.model_selection import train_test_split
 import plotly.express as px
 import logging
+import json
+import threading
 from sklearn.datasets import load_iris, load_wine, load_breast_cancer
 
+from services.cache import LRUCache, fingerprint, attach_data_key
+from services.feature_store import load_preset, load_frames, open_dataset
+from config import ROW_CACHE_BYTES
+
 # demo cases
 demo_cases = {
     'Lucas Organic Carbon (PCA)': {
@@ -30,87 +37,220 @@ demo_cases = {
     }
 }
 
-preset_target = demo_cases['Lucas Organic Carbon (PCA)']['target']
-preset_training = demo_cases['Lucas Organic Carbon (PCA)']['training']
+# materialized training and test rows of datasets (shared by all sessions)
+_row_cache = LRUCache(max_entries=8, max_bytes=ROW_CACHE_BYTES)
+
+# seeded sample orders of datasets
+_sample_orders = LRUCache(max_entries=16)
+
+# one lock per materialized sample order and rows (jobs on the same rows wait for and share them, other
+# datasets and splits are materialized concurrently)
+_materialize_locks = {}
+_materialize_locks_guard = threading.Lock()
+
+def _materialize_lock(key):
+    """
+    Get the lock of the rows (or the sample order) identified by key.
+    """
+
+    with _materialize_locks_guard:
+        return _materialize_locks.setdefault(key, threading.Lock())
 
 # load data
-@st.cache_data(show_spinner=False)
-def load_data(target_data=None, training_data=None, selected_demo_case='Lucas Organic Carbon (PCA)'):
+def load_data(selected_demo_case='Lucas Organic Carbon (PCA)', custom_dataset=None):
     """
     Load the data for training.
+
+    Returns the (memory-mapped) dataset of the feature store that is shared by all sessions, or None
+    if custom data was selected but not uploaded.
     """
     
     # load data from sklearn
     if 'sklearn_dataset' in demo_cases[selected_demo_case]:
         logging.info(f"Loading {selected_demo_case} data from sklearn.")
-        data = demo_cases[selected_demo_case]['sklearn_dataset']()
-        df = pd.DataFrame(data.data, columns=data.feature_names)
-        df['target'] = data.target
-        df_combined = df
-        df_training = df.drop(columns=['target'])
-        df_target = df[['target']]
+
+        def read_frames():
+            data = demo_cases[selected_demo_case]['sklearn_dataset']()
+            df_training = pd.DataFrame(data.data, columns=data.feature_names)
+            return df_training, pd.DataFrame({'target': data.target})
+
+        dataset = load_frames(selected_demo_case, read_frames, source=['sklearn', sklearn.__version__])
         logging.info(f"Loaded {selected_demo_case} data from sklearn.")
-        logging.info(f"Training data shape: {df_training.shape}")
-        logging.info(f"Target data shape: {df_target.shape}")
-        logging.info(f"Combined data shape: {df_combined.shape}")
 
     # load custom data
     elif 'custom' in demo_cases[selected_demo_case]:
         logging.info("Loading custom data.")
-        if st.session_state['custom_training'] and st.session_state['custom_target']:
-            df_target = target_data
-            df_training = training_data
-            logging.info("Loaded custom target and training data from uploaded files.")
-        else:
+        if custom_dataset is None:
             logging.error("Full custom data not provided. Please upload both target and training data.")
-            return None, None, None
+            return None
 
-        df_combined = pd.merge(df_training, df_target, left_index=True, right_index=True)
+        dataset = open_dataset(custom_dataset)
+        logging.info("Loaded custom target and training data from feature store.")
 
     # load data from presets or given paths
     else:
-        df_target = pd.read_csv(demo_cases[selected_demo_case]['target'])
-        logging.info("Loaded target data from preset.")
+        dataset = load_preset(demo_cases[selected_demo_case])
+        logging.info("Loaded target and training data from preset.")
 
-        df_training = pd.read_csv(demo_cases[selected_demo_case]['training'])
-        logging.info("Loaded training data from preset.")
-        
-        df_combined = pd.merge(df_training, df_target, left_index=True, right_index=True)
-        logging.info("Merged target and training data successfully.")
+    logging.info(f"Data shape: {dataset.features.shape}")
 
-    return df_training, df_target, df_combined
+    return dataset
 
-# prepare data
-@st.cache_data(show_spinner=False)
-def prepare_data(df_combined, data_percentage):
+def _sample_order(dataset, seed, test_size, stratify):
     """
-    Prepare the data for training.
+    Get the seeded order in which the rows of a dataset enter the sample and which of them are test rows.
+
+    Every sample is a prefix of this order, so a larger sample always contains a smaller one (with the
+    same training and test rows). Of the first n rows (of every class if stratified), ceil(test_size * n)
+    are test rows, as in train_test_split.
+    """
+
+    key = (dataset.directory, json.dumps(dataset.meta['source']), seed, test_size, stratify)
+    with _materialize_lock(('order',) + key):
+        order = _sample_orders.get(key)
+        if order is None:
+            permutation = np.random.RandomState(seed).permutation(len(dataset))
+
+            # rank of every row in the order (within its class if stratified)
+            if stratify:
+                codes = np.asarray(dataset.target)[permutation]
+                by_class = np.argsort(codes, kind='stable')
+                class_starts = np.cumsum(np.bincount(codes)) - np.bincount(codes)
+                ranks = np.empty(len(codes), dtype=np.int64)
+                ranks[by_class] = np.arange(len(codes)) - class_starts[codes[by_class]]
+            else:
+                ranks = np.arange(len(permutation))
+
+            # the row with rank r is a test row if it increases the number of test rows ceil(test_size * r)
+            is_test = np.ceil(test_size * (ranks + 1)) > np.ceil(test_size * ranks)
+            order = _sample_orders.put(key, {
+                'permutation': permutation,
+                'is_test': is_test,
+                'test_counts': np.concatenate([[0], np.cumsum(is_test)]),
+                'train_order': permutation[~is_test],
+                'test_order': permutation[is_test]
+            })
+
+    return order
+
+class SplitPlan:
+    """
+    Seeded row indices of a sample of a dataset and its split into training and test rows.
+
+    Samples are nested: the sample of a smaller percentage is a prefix of the sample of a larger one, so
+    the training and test data of a larger sample extend those of a smaller one. The data are only
+    materialized when a model needs them.
     """
 
-    # sample the data
-    sample_size = int(len(df_combined) * (data_percentage / 100))
-    df_sampled = df_combined.sample(n=sample_size, random_state=42)
-    predictors = df_sampled.columns[:-1]
+    def __init__(self, dataset, data_percentage, stratify=False, test_size=0.2, seed=42):
+        self.dataset = dataset
+        self.data_percentage = data_percentage
+        self.stratify = stratify
+        self.test_size = test_size
+        self.seed = seed
+
+        # sizes of the sample and its split
+        self.order = _sample_order(dataset, seed, test_size, stratify)
+        self.sample_size = int(len(dataset) * (data_percentage / 100))
+        self.num_test = int(self.order['test_counts'][self.sample_size])
+        self.num_train = self.sample_size - self.num_test
+
+    @property
+    def key(self):
+        """
+        Key of the sampled data (instead of a fingerprint of the data itself).
+        """
+
+        return fingerprint(self.dataset.directory, self.dataset.meta['source'], self.seed, self.test_size, self.stratify, self.sample_size)
+
+    def is_valid(self):
+        """
+        Check if the sample can be split (only stratified splits need to count the sampled classes).
+        """
+
+        if self.num_train < 1 or self.num_test < 1:
+            return False
 
-    # prepare the data
-    target = df_sampled.columns[-1]
-    X = df_sampled[predictors]
-    y = df_sampled[target]
+        # every class of a stratified split needs rows in both parts
+        if self.stratify:
+            class_counts = np.bincount(self.dataset.target[self.sampled_rows])
+            return class_counts[class_counts > 0].min() >= 2
 
-    # encode categorical target
-    label_encoder = LabelEncoder()
-    y = label_encoder.fit_transform(y)
+        return True
 
-    # split the data with error handling
-    try:
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-        logging.info("Data prepared successfully.")
-    except ValueError:
+    @property
+    def sampled_rows(self):
+        return self.order['permutation'][:self.sample_size]
+
+    @property
+    def train_rows(self):
+        return self.order['train_order'][:self.num_train]
+
+    @property
+    def test_rows(self):
+        return self.order['test_order'][:self.num_test]
+
+    @property
+    def labels(self):
+        """
+        Get the encoded target of the training and test rows.
+
+        The stored category codes are the encoding, so the labels of every sample are just a lookup.
+        Returns the encoded training and test labels and the label encoder.
+        """
+
+        label_encoder = LabelEncoder().fit(np.asarray(self.dataset.categories))
+
+        return self.dataset.target[self.train_rows], self.dataset.target[self.test_rows], label_encoder
+
+    def _prefix_data(self, part, num_rows):
+        """
+        Get the features of the first num_rows training or test rows (cached and shared by all sessions).
+
+        The rows are cached as one read-only C-contiguous float32 array and a cached smaller prefix is extended
+        by the missing rows only. Returns a DataFrame view of the array with an attached key of the rows.
+        """
+
+        key = (self.dataset.directory, json.dumps(self.dataset.meta['source']), self.seed, self.test_size, self.stratify, part)
+        rows = self.order[f'{part}_order']
+        with _materialize_lock(key):
+            X = _row_cache.get(key)
+            if X is None or len(X) < num_rows:
+                X_new = self.dataset.features[rows[0 if X is None else len(X):num_rows]]
+                X = np.ascontiguousarray(X_new if X is None else np.concatenate([X, X_new]))
+                X.setflags(write=False)  # shared by all sessions
+                X = _row_cache.put(key, X)
+
+        # the rows of a C-contiguous float32 array are passed to the models without conversion
+        X = pd.DataFrame(X[:num_rows], columns=self.dataset.columns, index=rows[:num_rows], copy=False)
+
+        # identify the rows by the plan (so that caches of predictions do not need to hash the data)
+        attach_data_key(X, fingerprint(self.key, part, num_rows))
+
+        return X
+
+    def X_train(self):
+        return self._prefix_data('train', self.num_train)
+
+    def X_test(self):
+        return self._prefix_data('test', self.num_test)
+
+# prepare data
+def prepare_data(dataset, data_percentage, stratify=False):
+    """
+    Plan the rows for training and testing.
+
+    Returns None if the resulting sample is too small to split.
+    """
+
+    plan = SplitPlan(dataset, data_percentage, stratify)
+    if not plan.is_valid():
         logging.error(f"Data preparation failed. Percentage of data used: {data_percentage}.")
-        # st.warning("Data preparation failed. Please adjust percentage of data used.")
-        return None, None, None, None, None
+        return None
+
+    logging.info(f"Data prepared successfully ({plan.num_train} training and {plan.num_test} test rows).")
 
-    return X_train, X_test, y_train, y_test, label_encoder
+    return plan
 
 def plot_target_distribution(df_combined, suffix):
     """
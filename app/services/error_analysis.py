@@ -1,10 +1,11 @@
 import logging
+import numpy as np
 import pandas as pd
 import streamlit as st
-from sklearn.metrics import confusion_matrix, accuracy_score, precision_score, recall_score, f1_score
 import plotly.graph_objects as go
 
-from config import SELECTION_COLOR, BLUE
+from services.tree_shap import get_shap_values
+from config import SELECTION_COLOR, BLUE, MAX_EXPLAINED_ROWS
 
 def _display_overall_metrics(accuracy, precision, recall, f1):
     """
@@ -18,14 +19,14 @@ def _display_overall_metrics(accuracy, precision, recall, f1):
     col4.metric("F1 Score", f"{f1:.2f}")
     logging.info("Overall metrics displayed successfully.")
 
-def _display_class_counts(y_test, y_pred, unique_labels, selected_class, suffix):
+def _display_class_counts(metrics, unique_labels, selected_class, suffix):
     """
     Display the class counts as a histogram.
     """
 
     # count instances of each class in the test set
-    actual_class_counts = pd.Series(y_test).value_counts().reindex(range(len(unique_labels)), fill_value=0)
-    predicted_class_counts = pd.Series(y_pred).value_counts().reindex(range(len(unique_labels)), fill_value=0)
+    actual_class_counts = pd.Series(metrics['support'])
+    predicted_class_counts = pd.Series(metrics['predicted'])
 
     # sort by count
     sorted_counts = actual_class_counts.sort_values(ascending=False)
@@ -71,26 +72,20 @@ def _display_class_counts(y_test, y_pred, unique_labels, selected_class, suffix)
     st.plotly_chart(fig, key=f"class_counts_{suffix}")
     logging.info("Class counts displayed as histogram successfully.")
 
-def _display_class_metrics(y_test, y_pred, selected_class, selected_class_index):
+def _display_class_metrics(metrics, selected_class, selected_class_index):
     """
     Display the metrics for the selected class.
     """
 
-    class_y_test = (y_test == selected_class_index).astype(int)
-    class_y_pred = (y_pred == selected_class_index).astype(int)
-    class_accuracy = accuracy_score(class_y_test, class_y_pred)
-    class_precision = precision_score(class_y_test, class_y_pred)
-    class_recall = recall_score(class_y_test, class_y_pred)
-    class_f1 = f1_score(class_y_test, class_y_pred)
-
-    # compute confusion matrix
-    cm_error = False
-    try:
-        tn, fp, fn, tp = confusion_matrix(class_y_test, class_y_pred).ravel()
-    except ValueError as e:
-        cm_error = True
-        tn, fp, fn, tp = 0, 0, 0, 0
-        logging.error(f"Error in computing confusion matrix: {e}")
+    # read one-vs-rest metrics of the selected class
+    class_accuracy = metrics['class_accuracy'][selected_class_index]
+    class_precision = metrics['class_precision'][selected_class_index]
+    class_recall = metrics['class_recall'][selected_class_index]
+    class_f1 = metrics['class_f1'][selected_class_index]
+    tp = metrics['tp'][selected_class_index]
+    tn = metrics['tn'][selected_class_index]
+    fp = metrics['fp'][selected_class_index]
+    fn = metrics['fn'][selected_class_index]
 
     # display metrics
     col1, col2, col3, col4 = st.columns(4)
@@ -106,9 +101,6 @@ def _display_class_metrics(y_test, y_pred, selected_class, selected_class_index)
     col3.metric("False Positives", fp)
     col4.metric("False Negatives", fn)
 
-    if cm_error:
-        st.error("Confusion matrix did not return enough values. Metrics may not be accurate.")
-
     logging.info(f"Metrics for class {selected_class} displayed successfully.")    
 
 def _display_confusion_matrix(cm, unique_labels, selected_class_index, suffix):
@@ -190,10 +182,89 @@ def _display_confusion_matrix(cm, unique_labels, selected_class_index, suffix):
     st.plotly_chart(fig, key=f"confusion_matrix_{suffix}")
     logging.info("Confusion matrix displayed successfully.")
 
+def _contribution_chart(feature_names, contributions, predicted_label, actual_label, num_features, key):
+    """
+    Display the features that push towards the predicted class (positive) and towards the actual class (negative).
+    """
+
+    order = np.argsort(-np.abs(contributions))[:num_features][::-1]
+    fig = go.Figure(data=go.Bar(
+        x=contributions[order],
+        y=[feature_names[i] for i in order],
+        orientation='h',
+        marker_color=[SELECTION_COLOR if value > 0 else BLUE for value in contributions[order]],
+        hovertemplate='Feature: %{y}<br>Contribution: %{x:.4f}<extra></extra>'
+    ))
+    fig.update_layout(
+        xaxis_title=f'Towards {actual_label} (negative) or {predicted_label} (positive)',
+        margin=dict(l=20, r=20, t=20, b=20),
+        height=max(300, 25 * len(order)),
+        showlegend=False
+    )
+    st.plotly_chart(fig, key=key)
+
+def _display_misclassification_explanation(model, X_test, y_test, y_pred, unique_labels, selected_class, selected_class_index, suffix):
+    """
+    Explain why samples of the selected class were misclassified with the SHAP values of the model.
+
+    The SHAP values of the predicted class minus the ones of the actual class show which features pushed a
+    sample towards the wrong class. Only the misclassified samples of the selected class are explained (at
+    most MAX_EXPLAINED_ROWS of them, as the cost grows with every sample and the size of the forest).
+    """
+
+    y_values, y_pred = np.asarray(y_test).ravel(), np.asarray(y_pred).ravel()
+    rows = np.flatnonzero(y_values == selected_class_index)
+    misclassified = rows[y_pred[rows] != selected_class_index]
+    if not len(misclassified):
+        st.success(f"All samples of class {selected_class} are classified correctly.")
+        return
+    st.write(f"{len(misclassified)} of {len(rows)} samples of class {selected_class} are misclassified.")
+
+    # explain a random (but fixed) sample of many misclassified samples
+    if len(misclassified) > MAX_EXPLAINED_ROWS:
+        st.caption(f"Explaining a random sample of {MAX_EXPLAINED_ROWS} misclassified samples.")
+        misclassified = np.sort(np.random.default_rng(0).choice(misclassified, MAX_EXPLAINED_ROWS, replace=False))
+
+    with st.spinner('Explaining the misclassified samples of the selected class...'):
+        explanation = get_shap_values(model, X_test.iloc[misclassified])
+    if explanation is None:
+        st.info("Explanations are only available for random forests.")
+        return
+    shap_values, _ = explanation
+    feature_names = list(X_test.columns)
+
+    # SHAP values of every class (classes the model has never seen contribute nothing)
+    def class_values(k, class_index):
+        columns = np.flatnonzero(model.classes_ == class_index)
+        if not len(columns):
+            return np.zeros(shap_values.shape[1])
+        return shap_values[k, :, columns[0]]
+
+    difference = np.stack([
+        class_values(k, y_pred[row]) - class_values(k, selected_class_index)
+        for k, row in enumerate(misclassified)
+    ])
+    num_features = st.slider('Number of Features', min_value=1, max_value=min(30, len(feature_names)), value=min(10, len(feature_names)), key=f'misclassification_features_{suffix}')
+
+    # features that push the misclassified samples towards wrong classes on average
+    st.write("**All Misclassified Samples**")
+    _contribution_chart(feature_names, difference.mean(axis=0), 'the wrong classes', selected_class, num_features, key=f'misclassification_all_{suffix}')
+
+    # a single misclassified sample
+    selected_sample = st.selectbox(
+        'Select Misclassified Sample',
+        range(len(misclassified)),
+        format_func=lambda k: f"Sample {X_test.index[misclassified[k]]} (predicted {unique_labels[y_pred[misclassified[k]]]})",
+        key=f'misclassified_sample_{suffix}'
+    )
+    predicted_label = unique_labels[y_pred[misclassified[selected_sample]]]
+    _contribution_chart(feature_names, difference[selected_sample], predicted_label, selected_class, num_features, key=f'misclassification_sample_{suffix}')
+    logging.info(f"Explained {len(misclassified)} misclassified samples of class {selected_class}.")
+
 # show results
-def visualize_error_analysis(y_test, y_pred, unique_labels, selected_class, selected_class_index, accuracy, precision, recall, f1, cm, suffix):
+def visualize_error_analysis(y_test, y_pred, unique_labels, selected_class, selected_class_index, accuracy, precision, recall, f1, cm, metrics, suffix, model=None, X_test=None):
     """
-    Display the error analysis results.
+    Display the error analysis results (and explanations of misclassified samples, if the model and the test data are given).
     """
 
     # display overall metrics
@@ -202,10 +273,15 @@ def visualize_error_analysis(y_test, y_pred, unique_labels, selected_class, sele
 
     # display metrics for the selected class
     with st.expander(f"**Metrics for Class: {selected_class}**", expanded=True):
-       _display_class_metrics(y_test, y_pred, selected_class, selected_class_index)
+       _display_class_metrics(metrics, selected_class, selected_class_index)
 
     with st.expander("**Class Counts**", expanded=True):
-        _display_class_counts(y_test, y_pred, unique_labels, selected_class, suffix)
+        _display_class_counts(metrics, unique_labels, selected_class, suffix)
 
     with st.expander("**Confusion Matrix**", expanded=True):
         _display_confusion_matrix(cm, unique_labels, selected_class_index, suffix)
+
+    if model is not None and X_test is not None:
+        with st.expander(f"**Why Misclassified? Class: {selected_class}**", expanded=False):
+            if st.toggle('Explain misclassified samples', key=f'explain_misclassified_{suffix}'):
+                _display_misclassification_explanation(model, X_test, y_test, y_pred, unique_labels, selected_class, selected_class_index, suffix)
@@ -0,0 +1,125 @@
+import logging
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# ways to partition the columns into contiguous bands
+GROUPING_METHODS = ['Single Features', 'Fixed Width', 'Correlation']
+
+def fixed_width_groups(num_features, width):
+    """
+    Partition the columns into contiguous bands of the given width (the last band may be narrower).
+    """
+
+    return [tuple(range(start, min(start + width, num_features))) for start in range(0, num_features, width)]
+
+def correlation_groups(X, threshold):
+    """
+    Partition the columns into contiguous bands, starting a new band wherever the absolute correlation
+    of two adjacent columns drops below threshold.
+
+    As with fixed widths, there are at least two bands (split at the weakest correlation), so that the
+    bands can still be ranked and compared.
+    """
+
+    X_values = np.asarray(X, dtype=np.float64)
+    std = X_values.std(axis=0)
+    std[std == 0] = 1
+    standardized = (X_values - X_values.mean(axis=0)) / std
+
+    # correlation of every column with its right neighbour
+    adjacent_correlation = np.mean(standardized[:, :-1] * standardized[:, 1:], axis=0)
+    breaks = np.flatnonzero(np.abs(adjacent_correlation) < threshold) + 1
+    if len(breaks) == 0 and len(adjacent_correlation) > 0:
+        breaks = [np.argmin(np.abs(adjacent_correlation)) + 1]
+    starts = np.concatenate([[0], breaks, [X_values.shape[1]]]).astype(int)
+
+    return [tuple(range(start, stop)) for start, stop in zip(starts[:-1], starts[1:])]
+
+def group_name(feature_names, band):
+    """
+    Get the name of a band (the name of its column or of its first and last column).
+    """
+
+    feature_names = list(feature_names)
+    if len(band) == 1:
+        return feature_names[band[0]]
+    return f'{feature_names[band[0]]} to {feature_names[band[-1]]}'
+
+def band_values(X_values, band, rows=None):
+    """
+    Get the value of a band for every row (the mean of its columns).
+    """
+
+    rows = slice(None) if rows is None else rows
+    if len(band) == 1:
+        return X_values[rows, band[0]]
+    return X_values[rows][:, list(band)].mean(axis=1)
+
+def band_perturbation(X_values, rows, band, values):
+    """
+    Get the columns of a band for the given rows with the band set to values.
+
+    A single column is set to the value. The columns of a wider band are shifted together so that their
+    mean equals the value (the shape of the spectrum within the band is kept).
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    if len(band) == 1:
+        return values[:, None]
+    return X_values[rows][:, list(band)] + (values - band_values(X_values, band, rows))[:, None]
+
+def as_band(feature_index):
+    """
+    Get a band from a column index or from a sequence of column indices.
+    """
+
+    if np.isscalar(feature_index):
+        return (int(feature_index),)
+    return tuple(int(index) for index in feature_index)
+
+def importance_frame(importances, feature_names, groups=None):
+    """
+    Get feature importance per band (summed over its columns) as DataFrame.
+    """
+
+    importances = np.asarray(importances)
+    if groups is None:
+        groups = fixed_width_groups(len(importances), 1)
+
+    return pd.DataFrame({
+        'feature': [group_name(feature_names, band) for band in groups],
+        'importance': [importances[list(band)].sum() for band in groups],
+        'band': groups
+    })
+
+def feature_grouping_inputs(X, suffix):
+    """
+    Create input controls for grouping the columns into contiguous bands.
+
+    Returns the bands as tuples of column indices.
+    """
+
+    col1, col2 = st.columns(2)
+    method = col1.selectbox(
+        'Feature Grouping',
+        GROUPING_METHODS,
+        key=f'feature_grouping_{suffix}',
+        help='Group adjacent columns (e.g. wavelengths of a spectrum) into bands that are analyzed as one feature.'
+    )
+
+    num_features = X.shape[1]
+    if method == 'Fixed Width':
+        width = col2.slider('Band Width', min_value=1, max_value=max(2, num_features // 2), value=min(10, max(1, num_features // 10)), key=f'band_width_{suffix}')
+        groups = fixed_width_groups(num_features, width)
+    elif method == 'Correlation':
+        threshold = col2.slider('Minimum Correlation', min_value=0.0, max_value=1.0, value=0.9, step=0.01, key=f'band_correlation_{suffix}')
+        groups = correlation_groups(X, threshold)
+    else:
+        groups = fixed_width_groups(num_features, 1)
+
+    if method != 'Single Features':
+        col2.caption(f'{len(groups)} bands of {num_features} features')
+    logging.info(f"Grouped {num_features} features into {len(groups)} bands ({method}).")
+
+    return groups
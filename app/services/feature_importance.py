@@ -3,40 +3,177 @@ import pandas as pd
 import numpy as np
 import streamlit as st
 import plotly.graph_objects as go
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
+from joblib import Parallel, delayed, effective_n_jobs
 
-from services.model import evaluate_model
-from config import BLUE
+from services.cache import LRUCache, fingerprint, model_key, data_key
+from services.metrics import confusion_counts, metrics_from_counts
+from services.forest import get_forest_index
+from services.predictions import predict
+from services.model import model_input, feature_importances
+from services.feature_groups import as_band, band_values, band_perturbation, fixed_width_groups, group_name, importance_frame
+from config import BLUE, MAX_BATCH_ELEMENTS, MAX_ICE_ROWS
 
-def _get_feature_importance(model):
+# interval and joint interval importance of recently viewed (model, data, features, intervals) combinations
+_importance_cache = LRUCache(max_entries=128)
+
+# class probabilities of the test rows with one feature mapped to an interval limit (per model, data, feature and limit),
+# shared by interval importance and partial dependence
+_limit_cache = LRUCache(max_entries=1024, max_bytes=2**27)
+
+# rows of the test data sorted by the value of a feature (per data and feature)
+_sorted_index_cache = LRUCache(max_entries=64, max_bytes=2**26)
+
+# ways to split a feature into intervals
+BINNING_METHODS = ['Uniform', 'Quantile', 'Histogram', 'Adaptive']
+
+# refinement rounds of adaptive intervals and the maximum number of intervals per requested interval
+ADAPTIVE_ROUNDS = 3
+ADAPTIVE_MAX_FACTOR = 4
+
+def _get_feature_importance(model, feature_names=None, groups=None):
     """
-    Calculate feature importance using built-in feature importance of sklearn models.
+    Calculate feature importance using built-in feature importance of sklearn models (summed per band, if given).
     """
 
-    # check if the model has feature_importances_ attribute
-    importance_values = model.feature_importances_
+    # built-in feature importance of the model engine
+    importance_values = feature_importances(model)
     logging.info(f"Feature importance values extracted successfully.")
 
     # if feature_names is not provided, get it from the model
-    feature_names = model.feature_names_in_
-    logging.info(f"Feature names extracted from the model.")
+    if feature_names is None:
+        feature_names = getattr(model, 'feature_names_in_', [f'Feature {i}' for i in range(len(importance_values))])
+        logging.info(f"Feature names extracted from the model.")
 
     # create DataFrame with feature importance
-    feature_importance = pd.DataFrame({
-        'feature': list(feature_names), 
-        'importance': importance_values
-    })
+    feature_importance = importance_frame(importance_values, feature_names, groups)
     logging.info(f"Feature importance DataFrame created successfully.")
 
     return feature_importance
 
-def visualize_feature_importance(model, suffix):
+def _permuted_predictions(model, X_test, groups, permutation):
+    """
+    Predict the test rows once for every band in groups with its columns permuted (all with the same permutation).
+
+    Random forests and boosting models only re-evaluate the trees that test the permuted band. For all other
+    bands, as many permuted copies of the rows as fit into the memory budget are stacked into one predict call.
+    Returns the predictions as array of shape (len(groups), number of rows).
+    """
+
+    X_values = model_input(X_test)
+    num_rows = len(X_values)
+    rows = np.arange(num_rows)
+    y_pred = np.empty((len(groups), num_rows), dtype=predict(model, X_test).dtype)
+
+    # permuted bands that are cheaper to predict with the forest index
+    batched = []
+    for k, band in enumerate(groups):
+        index = get_forest_index(model, X_test, list(band))
+        if index is not None:
+            y_pred[k] = index.predict_perturbed(rows, list(band), X_values[np.ix_(permutation, band)])
+        else:
+            batched.append(k)
+
+    # stack several permuted copies per predict call
+    copies_per_block = max(1, MAX_BATCH_ELEMENTS // max(1, X_values.size))
+    for start in range(0, len(batched), copies_per_block):
+        chunk = batched[start:start + copies_per_block]
+        block = np.tile(X_values, (len(chunk), 1))
+        for position, k in enumerate(chunk):
+            block[position * num_rows:(position + 1) * num_rows, list(groups[k])] = X_values[np.ix_(permutation, groups[k])]
+        y_pred[chunk] = model.predict(block).reshape(len(chunk), num_rows)
+
+    return y_pred
+
+def _permutation_importance(model, X_test, y_test, groups=None, max_repeats=10, min_repeats=3, seed=0):
+    """
+    Calculate the permutation importance (decrease in accuracy on the test data) of every feature (or band of
+    adjacent features, if groups are given).
+
+    Bands are evaluated in parallel chunks. Every repeat permutes the rows with a new seeded permutation.
+    After min_repeats, a band stops as soon as the 95% confidence interval of its importance excludes
+    zero (or all repeats gave the same result). Results are cached per model, test data, labels and bands.
+    Returns the mean and standard deviation of the importance and the number of repeats of every band.
+    """
+
+    if groups is None:
+        groups = fixed_width_groups(X_test.shape[1], 1)
+    groups = [as_band(band) for band in groups]
+
+    key = (model_key(model), data_key(X_test), fingerprint(y_test), tuple(groups), 'permutation', max_repeats, min_repeats, seed)
+    result = _importance_cache.get(key)
+    if result is not None:
+        logging.info("Permutation importance loaded from cache.")
+        return result
+
+    y_values = np.asarray(y_test).ravel()
+    base_accuracy = np.mean(predict(model, X_test) == y_values)
+    rng = np.random.RandomState(seed)
+
+    drops = np.full((len(groups), max_repeats), np.nan)
+    active = np.arange(len(groups))
+    num_chunks = max(1, min(len(active), effective_n_jobs() * 4))
+    for repeat in range(max_repeats):
+        permutation = rng.permutation(len(y_values))
+
+        # evaluate chunks of the active features in parallel
+        chunks = [chunk for chunk in np.array_split(active, num_chunks) if len(chunk)]
+        predictions = Parallel()(delayed(_permuted_predictions)(model, X_test, [groups[k] for k in chunk], permutation) for chunk in chunks)
+        drops[active, repeat] = base_accuracy - np.mean(np.concatenate(predictions) == y_values, axis=1)
+
+        # stop bands whose importance is already separated from zero
+        if repeat + 1 >= min_repeats:
+            mean = np.nanmean(drops[active], axis=1)
+            half_width = 1.96 * np.nanstd(drops[active], axis=1, ddof=1) / np.sqrt(repeat + 1)
+            active = active[(half_width > 0) & (half_width >= np.abs(mean))]
+            if not len(active):
+                break
+    logging.info(f"Permutation importance computed with {np.sum(~np.isnan(drops))} permuted bands ({len(groups)} bands, {repeat + 1} repeats).")
+
+    repeats = np.sum(~np.isnan(drops), axis=1)
+    result = (np.nanmean(drops, axis=1), np.nan_to_num(np.nanstd(drops, axis=1, ddof=1)), repeats)
+
+    return _importance_cache.put(key, result)
+
+def _get_permutation_importance(model, X_test, y_test, groups=None):
+    """
+    Calculate the permutation importance on the test data (per band, if given) as DataFrame.
+    """
+
+    if groups is None:
+        groups = fixed_width_groups(X_test.shape[1], 1)
+    importance_values, importance_std, repeats = _permutation_importance(model, X_test, y_test, groups)
+
+    return pd.DataFrame({
+        'feature': [group_name(X_test.columns, band) for band in groups],
+        'importance': importance_values,
+        'std': importance_std,
+        'repeats': repeats,
+        'band': groups
+    })
+
+def visualize_feature_importance(model, suffix, feature_names=None, X_test=None, y_test=None, groups=None):
     """
-    Visualize feature importance using built-in feature importance of sklearn models.
+    Visualize feature importance using built-in feature importance of sklearn models (or permutation importance
+    on the test data, if given). With groups, the importance of every band of adjacent features is shown.
     """
 
+    # importance measure (permutation importance needs the test data)
+    measure = 'Impurity'
+    if X_test is not None and y_test is not None:
+        measure = st.radio(
+            'Importance Measure', 
+            ['Impurity', 'Permutation'], 
+            horizontal=True, 
+            key=f'importance_measure_{suffix}',
+            help='Impurity uses the built-in importance of the model. Permutation measures the decrease in accuracy on the test data when the values of a feature are shuffled.'
+        )
+
     # get feature importance data
-    feature_importance = _get_feature_importance(model)
+    if measure == 'Permutation':
+        with st.spinner('Calculating permutation importance...'):
+            feature_importance = _get_permutation_importance(model, X_test, y_test, groups)
+    else:
+        feature_importance = _get_feature_importance(model, feature_names, groups)
 
     # sort feature importance by absolute value in descending order
     sorted_feature_importance = feature_importance.reindex(feature_importance['importance'].abs().sort_values(ascending=False).index)
@@ -44,15 +181,18 @@ def visualize_feature_importance(model, suffix):
     # assign rank based on importance
     sorted_feature_importance['rank'] = range(1, len(sorted_feature_importance) + 1)
 
-    # allow user to select range of values to show
-    num_features = st.slider('Number of Features', min_value=1, max_value=len(sorted_feature_importance), value=max(1, len(sorted_feature_importance) // 3), key=f'num_features_{suffix}')
+    # allow user to select range of values to show (a slider needs at least two values)
+    num_features = len(sorted_feature_importance)
+    if num_features > 1:
+        num_features = st.slider('Number of Features', min_value=1, max_value=num_features, value=max(1, num_features // 3), key=f'num_features_{suffix}')
     sorted_feature_importance = sorted_feature_importance.head(num_features)
     logging.info(f"Top {num_features} feature importance displayed successfully.")
 
-    # create bar chart
+    # create bar chart (with the standard deviation of permutation importance)
     fig = go.Figure(data=go.Bar(
         x=sorted_feature_importance['rank'],
         y=sorted_feature_importance['importance'],
+        error_y=dict(type='data', array=sorted_feature_importance['std']) if 'std' in sorted_feature_importance else None,
         marker_color=BLUE,
         textposition='auto',
         hovertemplate='Rank: %{x}<br>Feature: %{customdata}<br>Importance: %{y:.4f}<extra></extra>',
@@ -90,103 +230,270 @@ def visualize_feature_importance(model, suffix):
     st.plotly_chart(fig, use_container_width=True, key=f'feature_importance_{suffix}')
     logging.info("Feature importance displayed successfully.")
 
-def _define_intervals(X_test, feature_index=0, num_intervals=10):
+def _sorted_index(X_test, band):
+    """
+    Get the rows of X_test sorted by the value of a feature (or band) and the sorted values (cached).
+    """
+
+    key = (data_key(X_test), band)
+    index = _sorted_index_cache.get(key)
+    if index is None:
+        feature_values = band_values(X_test.to_numpy(), band)
+        order = np.argsort(feature_values, kind='stable')
+        index = _sorted_index_cache.put(key, (order, feature_values[order]))
+
+    return index
+
+def _define_intervals(X_test, feature_index=0, num_intervals=10, binning='Uniform'):
     """
-    Define intervals for a given feature.
+    Define intervals for a given feature (or band of features).
+
+    Uniform intervals split the range of the feature evenly, quantile intervals hold (about) equally many rows
+    and histogram intervals are uniform intervals with empty ones merged into their left neighbour. Adaptive
+    intervals start uniform and are refined by _interval_importance.
     """
 
-    min_val = X_test.iloc[:, feature_index].min()
-    max_val = X_test.iloc[:, feature_index].max()
+    _, sorted_values = _sorted_index(X_test, as_band(feature_index))
+    min_val = sorted_values[0]
+    max_val = sorted_values[-1]
     
     # add a small offset to ensure all data points are included
     epsilon = 1e-10
     min_val -= epsilon
     max_val += epsilon
-    
-    intervals = np.linspace(min_val, max_val, num_intervals+1)
+
+    if binning == 'Quantile':
+        # limits halfway between the rows that split the sorted values into equal parts (ties are not split)
+        splits = np.unique(np.round(np.arange(1, num_intervals) * len(sorted_values) / num_intervals).astype(int))
+        splits = splits[(splits > 0) & (splits < len(sorted_values))]
+        splits = splits[sorted_values[splits - 1] < sorted_values[splits]]
+        inner = (sorted_values[splits - 1] + sorted_values[splits]) / 2
+        return np.concatenate([[min_val], inner, [max_val]])
+
+    # evenly spaced limits (a limit at the same fraction of the range has the same value for every number of intervals)
+    intervals = min_val + (max_val - min_val) * (np.arange(num_intervals + 1) / num_intervals)
+    intervals[-1] = max_val
+
+    if binning == 'Histogram':
+        # rows per interval from a binary search in the sorted values (the first interval holds the minimum)
+        counts = np.diff(np.searchsorted(sorted_values, intervals))
+        intervals = np.concatenate([intervals[:1], intervals[1:-1][counts[1:] > 0], intervals[-1:]])
+
     return intervals
 
-def _interval_importance(model, X_test, y_test, original_accuracy, original_precision, original_recall, original_f1, feature_index=0, num_intervals=10):
+def _interval_rows(X_test, band, intervals):
     """
-    Use transform_left parameter to map both to the left interval limit or the right interval limit.
+    Find the rows of every interval (both limits included) with a binary search in the sorted feature values.
+
+    Returns the (interval, row) pairs sorted by interval.
     """
-    
-    # get original evaluation metrics
-    accuracy = original_accuracy
-    precision = original_precision
-    recall = original_recall
-    f1 = original_f1
 
-    # define intervals
-    intervals = _define_intervals(X_test, feature_index, num_intervals)
-    
-    # initialize arrays to store the differences in error metrics
-    accuracy_diffs = []
-    precision_diffs = []
-    recall_diffs = []
-    f1_diffs = []
-
-    # iterate over each interval
-    for i in range(len(intervals) - 1):
-        # create copies of X_test
-        X_test_transformed_left = X_test.copy()
-        X_test_transformed_right = X_test.copy()
-        
-        # transform the interval to the left and right
-        cut_series_left = pd.cut(X_test.iloc[:, feature_index], 
-                                bins=[intervals[i], intervals[i+1]], 
-                                labels=[intervals[i]], 
-                                include_lowest=True)
-        cut_series_right = pd.cut(X_test.iloc[:, feature_index], 
-                                 bins=[intervals[i], intervals[i+1]], 
-                                 labels=[intervals[i+1]], 
-                                 include_lowest=True)
-        
-        cut_series_left = cut_series_left.astype('float')
-        cut_series_right = cut_series_right.astype('float')
-        
-        cut_series_left.fillna(X_test.iloc[:,0], inplace=True)
-        cut_series_right.fillna(X_test.iloc[:,0], inplace=True)
-        
-        X_test_transformed_left.iloc[:, feature_index] = cut_series_left
-        X_test_transformed_right.iloc[:, feature_index] = cut_series_right
+    order, sorted_values = _sorted_index(X_test, band)
+    starts = np.searchsorted(sorted_values, intervals[:-1], side='left')
+    counts = np.searchsorted(sorted_values, intervals[1:], side='right') - starts
 
-        # merge the transformed dataframes
-        X_test_transformed = pd.concat([X_test_transformed_left, X_test_transformed_right], axis=0)
-        y_test_transformed = pd.concat([y_test, y_test], axis=0)
+    # expand the ranges of sorted positions of all intervals at once
+    interval_ids = np.repeat(np.arange(len(intervals) - 1), counts)
+    positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - starts, counts)
 
-        # predict and evaluate
-        y_pred_transformed = model.predict(X_test_transformed)
-        accuracy_transformed, precision_transformed, recall_transformed, f1_transformed = evaluate_model(y_test_transformed, y_pred_transformed)
-        
-        # calculate differences and ensure no zero values
-        accuracy_diff = max(abs(accuracy - accuracy_transformed), 1e-10)
-        precision_diff = max(abs(precision - precision_transformed), 1e-10)
-        recall_diff = max(abs(recall - recall_transformed), 1e-10)
-        f1_diff = max(abs(f1 - f1_transformed), 1e-10)
-        
-        # append the differences
-        accuracy_diffs.append(accuracy_diff)
-        precision_diffs.append(precision_diff)
-        recall_diffs.append(recall_diff)
-        f1_diffs.append(f1_diff)
-
-    # convert to numpy arrays and ensure no zero values
-    accuracy_diffs = np.array(accuracy_diffs)
-    precision_diffs = np.array(precision_diffs)
-    recall_diffs = np.array(recall_diffs)
-    f1_diffs = np.array(f1_diffs)
-    
-    accuracy_diffs[accuracy_diffs < 1e-10] = 1e-10
-    precision_diffs[precision_diffs < 1e-10] = 1e-10
-    recall_diffs[recall_diffs < 1e-10] = 1e-10
-    f1_diffs[f1_diffs < 1e-10] = 1e-10
-    
-    return accuracy_diffs, precision_diffs, recall_diffs, f1_diffs
+    return interval_ids, order[positions]
 
-def visualize_interval_importance(model, X_test, y_test, original_accuracy, original_precision, original_recall, original_f1, feature_index=0, num_intervals=10, suffix=''):
+def _predict_perturbed(model, X_test, rows, feature_indices, values, proba=False):
     """
-    Visualize interval importance using transform_left parameter.
+    Predict a batch of perturbed rows with a single predict call (class probabilities if proba is set).
+
+    Row k of the batch is row rows[k] of X_test with the columns in feature_indices set to values[k].
+    """
+
+    # only re-evaluate the affected subtrees of random forests
+    index = get_forest_index(model, X_test, feature_indices)
+    if index is not None:
+        if proba:
+            return index.predict_proba_perturbed(rows, feature_indices, values)
+        return index.predict_perturbed(rows, feature_indices, values)
+
+    X_values = X_test.to_numpy()
+
+    # gather all rows into one preallocated block and overwrite the perturbed columns
+    block = np.empty((len(rows), X_values.shape[1]), dtype=X_values.dtype)
+    np.take(X_values, rows, axis=0, out=block)
+    block[:, feature_indices] = values
+
+    if proba:
+        return model.predict_proba(model_input(block))
+    return model.predict(model_input(block))
+
+def _limit_probabilities(model, X_test, feature_index, intervals, limit_ids, limit_rows):
+    """
+    Predict the class probabilities of rows with the feature (or band) mapped to interval limits.
+
+    Probabilities are cached per limit value. When the intervals are refined (e.g. doubled or split adaptively),
+    the limits that coincide with earlier limits only predict rows that were not mapped to them before, and
+    interval importance and partial dependence reuse the rows predicted by each other.
+    Returns the probabilities for every (limit_ids, limit_rows) pair.
+    """
+
+    num_intervals = len(intervals) - 1
+    band = as_band(feature_index)
+    base_key = (model_key(model), data_key(X_test), band)
+
+    # cached probabilities of every limit (rows that have not been predicted yet are marked as missing)
+    cached = []
+    for k in range(num_intervals + 1):
+        key = base_key + (float(intervals[k]),)
+        limit = _limit_cache.get(key)
+        if limit is None:
+            limit = _limit_cache.put(key, {
+                'proba': np.zeros((len(X_test), len(model.classes_))),
+                'predicted': np.zeros(len(X_test), dtype=bool)
+            })
+        cached.append(limit)
+
+    # predict all missing (limit, row) pairs at once
+    missing = ~np.stack([limit['predicted'] for limit in cached])[limit_ids, limit_rows]
+    if missing.any():
+        values = band_perturbation(X_test.to_numpy(), limit_rows[missing], band, intervals[limit_ids[missing]])
+        proba_missing = _predict_perturbed(model, X_test, limit_rows[missing], list(band), values, proba=True)
+        for k in np.unique(limit_ids[missing]):
+            of_limit = limit_ids[missing] == k
+            cached[k]['proba'][limit_rows[missing][of_limit]] = proba_missing[of_limit]
+            cached[k]['predicted'][limit_rows[missing][of_limit]] = True
+    logging.info(f"Predicted {missing.sum()} of {len(limit_rows)} rows for {num_intervals} intervals in a single batch.")
+
+    return np.stack([limit['proba'] for limit in cached])[limit_ids, limit_rows]
+
+def _limit_predictions(model, X_test, feature_index, intervals, interval_ids, interval_rows):
+    """
+    Predict the rows of every interval with the feature (or band) mapped to the left and to the right limit.
+
+    Returns the predictions at the left and the right limit for every (interval_ids, interval_rows) pair.
+    """
+
+    # rows mapped to every limit: the rows of the interval to its right (left limit) and to its left (right limit)
+    limit_ids = np.concatenate([interval_ids, interval_ids + 1])
+    limit_rows = np.concatenate([interval_rows, interval_rows])
+
+    # labels of the most probable classes (as predicted by the model)
+    proba = _limit_probabilities(model, X_test, feature_index, intervals, limit_ids, limit_rows)
+    y_pred_limits = model.classes_.take(np.argmax(proba, axis=1))
+    return y_pred_limits[:len(interval_ids)], y_pred_limits[len(interval_ids):]
+
+def _partial_dependence(model, X_test, feature_index=0, num_intervals=10, max_ice_rows=MAX_ICE_ROWS, seed=0, binning='Uniform'):
+    """
+    Map all rows to every interval limit (the grid) and average their predicted class probabilities.
+
+    Shares the predictions of the limits with interval importance (adaptive binning uses its uniform starting
+    intervals). Returns the grid, the partial dependence
+    (limits x classes) and the individual conditional expectation (ICE) curves of a random sample of at most
+    max_ice_rows rows (rows x limits x classes).
+    """
+
+    band = as_band(feature_index)
+    key = (model_key(model), data_key(X_test), 'partial_dependence', band, num_intervals, max_ice_rows, seed, binning)
+    result = _importance_cache.get(key)
+    if result is not None:
+        logging.info("Partial dependence loaded from cache.")
+        return result
+
+    intervals = _define_intervals(X_test, band, num_intervals, binning)
+    num_rows = len(X_test)
+
+    # probabilities of every (limit, row) pair in one batch
+    limit_ids = np.repeat(np.arange(len(intervals)), num_rows)
+    limit_rows = np.tile(np.arange(num_rows), len(intervals))
+    proba = _limit_probabilities(model, X_test, band, intervals, limit_ids, limit_rows).reshape(len(intervals), num_rows, -1)
+
+    # keep only a bounded sample of rows as ICE curves
+    ice_rows = np.sort(np.random.default_rng(seed).choice(num_rows, min(num_rows, max_ice_rows), replace=False))
+
+    return _importance_cache.put(key, (intervals, proba.mean(axis=1), proba[:, ice_rows].transpose(1, 0, 2)))
+
+def _interval_differences(model, X_test, y_values, original_metrics, band, intervals):
+    """
+    Map the data points of every interval to its left and to its right limit and compare the resulting metrics to the original ones.
+
+    Returns the differences in accuracy, precision, recall and f1 of every interval.
+    """
+
+    # find the rows of each interval (both limits included)
+    interval_ids, interval_rows = _interval_rows(X_test, band, intervals)
+
+    # predictions at the limits of all intervals (the original predictions are cached)
+    y_pred_base = predict(model, X_test)
+    y_pred_left_limit, y_pred_right_limit = _limit_predictions(model, X_test, band, intervals, interval_ids, interval_rows)
+
+    # split the predictions back per interval (rows outside an interval keep their original prediction)
+    y_pred_left = np.tile(y_pred_base, (len(intervals) - 1, 1))
+    y_pred_right = np.tile(y_pred_base, (len(intervals) - 1, 1))
+    y_pred_left[interval_ids, interval_rows] = y_pred_left_limit
+    y_pred_right[interval_ids, interval_rows] = y_pred_right_limit
+    y_test_transformed = np.concatenate([y_values, y_values])
+
+    # evaluate the left and right transformation of every interval together
+    y_pred_transformed = np.concatenate([y_pred_left, y_pred_right], axis=1)
+    metrics = metrics_from_counts(confusion_counts(y_test_transformed, y_pred_transformed))
+
+    # calculate differences and ensure no zero values
+    return tuple(
+        np.maximum(np.abs(original - metrics[metric]), 1e-10)
+        for original, metric in zip(original_metrics, ['accuracy', 'precision', 'recall', 'f1'])
+    )
+
+def _interval_importance(model, X_test, y_test, original_accuracy, original_precision, original_recall, original_f1, feature_index=0, num_intervals=10, binning='Uniform'):
+    """
+    Map the data points of every interval to its left and to its right limit and compare the resulting metrics to the original ones.
+
+    A band of adjacent features is mapped by shifting its columns so that their mean lies at the limit. Adaptive
+    binning repeatedly splits the intervals with the largest difference in accuracy at their center, so that
+    predictions are spent where the model is sensitive to the feature.
+    Results are cached per model, test data, feature, number of intervals and binning. Returns the differences and the intervals.
+    """
+
+    band = as_band(feature_index)
+    key = (model_key(model), data_key(X_test), fingerprint(y_test), float(original_accuracy), float(original_precision), float(original_recall), float(original_f1), band, num_intervals, binning)
+    result = _importance_cache.get(key)
+    if result is not None:
+        logging.info("Interval importance loaded from cache.")
+        return result
+
+    # get original evaluation metrics
+    original_metrics = (original_accuracy, original_precision, original_recall, original_f1)
+    y_values = np.asarray(y_test).ravel()
+
+    # define intervals
+    intervals = _define_intervals(X_test, band, num_intervals, binning)
+    differences = _interval_differences(model, X_test, y_values, original_metrics, band, intervals)
+
+    if binning == 'Adaptive':
+        max_intervals = ADAPTIVE_MAX_FACTOR * num_intervals
+        for _ in range(ADAPTIVE_ROUNDS):
+            # split intervals with more than one row whose difference is at least half of the largest one
+            accuracy_diffs = differences[0]
+            counts = np.bincount(_interval_rows(X_test, band, intervals)[0], minlength=len(intervals) - 1)
+            candidates = np.flatnonzero((counts > 1) & (accuracy_diffs > 1e-10) & (accuracy_diffs >= accuracy_diffs.max() / 2))
+            candidates = candidates[np.argsort(-accuracy_diffs[candidates], kind='stable')][:max_intervals - (len(intervals) - 1)]
+            if not len(candidates):
+                break
+
+            # the rows of the split intervals are only predicted at the new limits
+            centers = (intervals[candidates] + intervals[candidates + 1]) / 2
+            refined_intervals = np.sort(np.concatenate([intervals, centers]))
+            refined = _interval_differences(model, X_test, y_values, original_metrics, band, refined_intervals)
+
+            # keep the coarser intervals if the differences only show at their scale
+            if np.all(refined[0] <= 1e-10):
+                break
+            intervals, differences = refined_intervals, refined
+        logging.info(f"Refined {num_intervals} intervals adaptively into {len(intervals) - 1} intervals.")
+
+    return _importance_cache.put(key, differences + (intervals,))
+
+def visualize_interval_importance(model, X_test, y_test, original_accuracy, original_precision, original_recall, original_f1, feature_index=0, num_intervals=10, suffix='', binning='Uniform'):
+    """
+    Visualize interval importance of a feature (or band of features).
+
+    The feature is split into num_intervals intervals with the given binning (see BINNING_METHODS). The rows of
+    every interval are mapped to its left and right limit, and the differences in the error metrics are shown per interval.
     """
 
     # ensure X_test and y_test are DataFrames
@@ -197,15 +504,12 @@ def visualize_interval_importance(model, X_test, y_test, original_accuracy, orig
         y_test = pd.DataFrame(y_test)
         logging.info(f"y_test converted to DataFrame successfully.")
 
-    # get differences in error metrics
-    accuracy_diffs, precision_diffs, recall_diffs, f1_diffs = _interval_importance(
+    # get differences in error metrics (and the intervals)
+    accuracy_diffs, precision_diffs, recall_diffs, f1_diffs, intervals = _interval_importance(
         model, X_test, y_test, original_accuracy, original_precision, original_recall, original_f1, 
-        feature_index, num_intervals
+        feature_index, num_intervals, binning
     )
     logging.info(f"Differences in error metrics calculated successfully: {accuracy_diffs}, {precision_diffs}, {recall_diffs}, {f1_diffs}")
-
-    # define intervals
-    intervals = _define_intervals(X_test, feature_index, num_intervals)
     logging.info(f"Intervals defined successfully: {intervals}")
     
     # create interval labels
@@ -304,6 +608,62 @@ def visualize_interval_importance(model, X_test, y_test, original_accuracy, orig
     st.plotly_chart(fig, use_container_width=True, key=f'interval_importance_bar_{suffix}')
     logging.info("Bar chart displayed successfully.")
 
+def visualize_partial_dependence(model, X_test, feature_index=0, num_intervals=10, class_names=None, suffix='', binning='Uniform'):
+    """
+    Visualize how the predicted probability of a class moves with the feature (partial dependence and ICE curves).
+    """
+
+    # ensure X_test is a DataFrame
+    if not isinstance(X_test, pd.DataFrame):
+        X_test = pd.DataFrame(X_test)
+        logging.info(f"X_test converted to DataFrame successfully.")
+
+    # class labels of the model outputs (the model predicts encoded labels)
+    labels = [class_names[code] if class_names is not None else code for code in model.classes_]
+    selected_label = st.selectbox('Select Class', labels, index=0, key=f'partial_dependence_class_{suffix}')
+    class_index = labels.index(selected_label)
+
+    grid, partial_dependence, ice = _partial_dependence(model, X_test, feature_index, num_intervals, binning=binning)
+    logging.info(f"Partial dependence calculated successfully for {len(grid)} grid values and {len(ice)} ICE curves.")
+
+    fig = go.Figure()
+
+    # one thin line per sampled row and the average over all rows on top
+    for k, curve in enumerate(ice[:, :, class_index]):
+        fig.add_trace(go.Scatter(
+            x=grid, y=curve, mode='lines', name='ICE',
+            line=dict(color='lightgray', width=1),
+            legendgroup='ice', showlegend=k == 0,
+            hoverinfo='skip'
+        ))
+    fig.add_trace(go.Scatter(
+        x=grid, y=partial_dependence[:, class_index], mode='lines+markers', name='Partial Dependence',
+        line=dict(color=BLUE, width=3),
+        marker=dict(size=8),
+        hovertemplate='Value: %{x:.4f}<br>Probability: %{y:.4f}<extra></extra>'
+    ))
+
+    fig.update_layout(
+        title='',
+        xaxis_title='Feature Value',
+        yaxis_title=f'Predicted Probability of {selected_label}',
+        margin=dict(l=20, r=20, t=20, b=20),
+        height=500,
+        showlegend=True
+    )
+
+    st.plotly_chart(fig, use_container_width=True, key=f'partial_dependence_{suffix}')
+    logging.info("Partial dependence displayed successfully.")
+
+def selected_band(feature_importance_df, feature_names, selected_feature):
+    """
+    Get the band (or the column index) of a feature selected from an importance DataFrame.
+    """
+
+    if 'band' in feature_importance_df:
+        return feature_importance_df.loc[feature_importance_df['feature'] == selected_feature, 'band'].iloc[0]
+    return list(feature_names).index(selected_feature)
+
 def get_feature_selection_inputs(feature_importance_df, feature_names, suffix):
     """
     Create input controls for feature selection.
@@ -322,7 +682,7 @@ def get_feature_selection_inputs(feature_importance_df, feature_names, suffix):
             index=0,
             key=f'feature_selection_feature1_{suffix}'
         )
-        feature1_index = list(feature_names).index(selected_feature1)
+        feature1_index = selected_band(feature_importance_df, feature_names, selected_feature1)
 
     with col2:
         # select second feature
@@ -333,7 +693,7 @@ def get_feature_selection_inputs(feature_importance_df, feature_names, suffix):
             index=0,
             key=f'feature_selection_feature2_{suffix}'
         )
-        feature2_index = list(feature_names).index(selected_feature2)
+        feature2_index = selected_band(feature_importance_df, feature_names, selected_feature2)
         
     # number of intervals for features
     num_intervals = st.slider(
@@ -343,98 +703,101 @@ def get_feature_selection_inputs(feature_importance_df, feature_names, suffix):
         value=10,
         key=f'feature_selection_num_intervals_{suffix}'
     )
+
+    # how the features are split into intervals
+    binning = st.selectbox(
+        'Binning',
+        BINNING_METHODS,
+        index=0,
+        key=f'feature_selection_binning_{suffix}',
+        help='Uniform intervals split the range evenly, quantile intervals hold equally many rows, histogram intervals merge empty uniform intervals and adaptive intervals split the intervals with the largest differences.'
+    )
     
-    return selected_feature1, selected_feature2, feature1_index, feature2_index, num_intervals, num_intervals
+    return selected_feature1, selected_feature2, feature1_index, feature2_index, num_intervals, num_intervals, binning
 
 def _joint_interval_importance(model, X_test, y_test, feature_1_index, feature_2_index,
-                             num_intervals1, num_intervals2):
+                             num_intervals1, num_intervals2, binning='Uniform'):
     """
-    Calculate importance for different intervals of two features.
+    Calculate importance for different intervals of two features (or bands of features).
+
+    Adaptive binning uses the intervals refined by the interval importance of every single feature.
+    Results are cached per model, test data, features, numbers of intervals and binning.
     """
 
-    # get feature values
-    feature1_values = X_test.iloc[:, feature_1_index].values
-    feature2_values = X_test.iloc[:, feature_2_index].values
-    
-    # get baseline predictions and metrics
-    base_pred = model.predict(X_test)
-    base_metrics = {
-        'accuracy': accuracy_score(y_test, base_pred),
-        'precision': precision_score(y_test, base_pred, average='weighted', zero_division=0),
-        'recall': recall_score(y_test, base_pred, average='weighted', zero_division=0),
-        'f1': f1_score(y_test, base_pred, average='weighted', zero_division=0)
-    }
-    
-    # create evenly distributed intervals
-    feature1_min, feature1_max = np.min(feature1_values), np.max(feature1_values)
-    feature2_min, feature2_max = np.min(feature2_values), np.max(feature2_values)
-    
-    # add a small offset to ensure all data points are included
-    epsilon = 1e-10
-    feature1_min -= epsilon
-    feature1_max += epsilon
-    feature2_min -= epsilon
-    feature2_max += epsilon
-    
-    intervals_1 = np.linspace(feature1_min, feature1_max, num_intervals1 + 1)
-    intervals_2 = np.linspace(feature2_min, feature2_max, num_intervals2 + 1)
-    
-    # create result matrices
-    accuracy_diffs = np.zeros((num_intervals2, num_intervals1))
-    precision_diffs = np.zeros((num_intervals2, num_intervals1))
-    recall_diffs = np.zeros((num_intervals2, num_intervals1))
-    f1_diffs = np.zeros((num_intervals2, num_intervals1))
-    
-    # calculate importance for each interval combination
-    for i in range(num_intervals2):
-        for j in range(num_intervals1):
-            X_modified = X_test.copy()
-        
-            value1 = (intervals_1[j] + intervals_1[j + 1]) / 2
-            value2 = (intervals_2[i] + intervals_2[i + 1]) / 2
-       
-            X_modified.iloc[:, feature_1_index] = value1
-            X_modified.iloc[:, feature_2_index] = value2
-            
-            # get modified predictions and metrics
-            modified_pred = model.predict(X_modified)
-            modified_metrics = {
-                'accuracy': accuracy_score(y_test, modified_pred),
-                'precision': precision_score(y_test, modified_pred, average='weighted', zero_division=0),
-                'recall': recall_score(y_test, modified_pred, average='weighted', zero_division=0),
-                'f1': f1_score(y_test, modified_pred, average='weighted', zero_division=0)
-            }
-            
-            # calculate differences and ensure no zero values
-            accuracy_diffs[i, j] = max(abs(modified_metrics['accuracy'] - base_metrics['accuracy']), 1e-10)
-            precision_diffs[i, j] = max(abs(modified_metrics['precision'] - base_metrics['precision']), 1e-10)
-            recall_diffs[i, j] = max(abs(modified_metrics['recall'] - base_metrics['recall']), 1e-10)
-            f1_diffs[i, j] = max(abs(modified_metrics['f1'] - base_metrics['f1']), 1e-10)
-    
-    # ensure no zero values in matrices
-    accuracy_diffs[accuracy_diffs < 1e-10] = 1e-10
-    precision_diffs[precision_diffs < 1e-10] = 1e-10
-    recall_diffs[recall_diffs < 1e-10] = 1e-10
-    f1_diffs[f1_diffs < 1e-10] = 1e-10
-    
-    return accuracy_diffs, precision_diffs, recall_diffs, f1_diffs, intervals_1, intervals_2
+    band_1, band_2 = as_band(feature_1_index), as_band(feature_2_index)
+    key = (model_key(model), data_key(X_test), fingerprint(y_test), band_1, band_2, num_intervals1, num_intervals2, binning)
+    result = _importance_cache.get(key)
+    if result is not None:
+        logging.info("Joint interval importance loaded from cache.")
+        return result
+
+    X_values = X_test.to_numpy()
+    y_values = np.asarray(y_test).ravel()
+    num_rows = len(y_values)
+
+    # get baseline predictions (cached) and metrics
+    base_pred = predict(model, X_test)
+    # perturbed rows can be predicted as any class of the model (labels are encoded as 0, ..., num_classes - 1)
+    num_classes = int(max(y_values.max(), base_pred.max(), model.classes_.max())) + 1
+    base_metrics = metrics_from_counts(confusion_counts(y_values, base_pred, num_classes))
+
+    # create the intervals of both features
+    if binning == 'Adaptive':
+        original_metrics = [base_metrics[metric] for metric in ['accuracy', 'precision', 'recall', 'f1']]
+        intervals_1 = _interval_importance(model, X_test, y_test, *original_metrics, band_1, num_intervals1, binning)[-1]
+        intervals_2 = _interval_importance(model, X_test, y_test, *original_metrics, band_2, num_intervals2, binning)[-1]
+    else:
+        intervals_1 = _define_intervals(X_test, band_1, num_intervals1, binning)
+        intervals_2 = _define_intervals(X_test, band_2, num_intervals2, binning)
+    num_intervals1, num_intervals2 = len(intervals_1) - 1, len(intervals_2) - 1
+
+    # every cell (i, j) of the grid maps both features to the interval centers (row-major, i over feature 2)
+    centers_1 = (intervals_1[:-1] + intervals_1[1:]) / 2
+    centers_2 = (intervals_2[:-1] + intervals_2[1:]) / 2
+    cell_values = np.column_stack([np.tile(centers_1, num_intervals2), np.repeat(centers_2, num_intervals1)])
+    num_cells = len(cell_values)
+
+    # evaluate as many cells per predict call as fit into the memory budget
+    cells_per_block = max(1, MAX_BATCH_ELEMENTS // max(1, num_rows * X_test.shape[1]))
+    counts = np.zeros((num_cells, num_classes, num_classes), dtype=np.int64)
+    for start in range(0, num_cells, cells_per_block):
+        stop = min(start + cells_per_block, num_cells)
+        rows = np.tile(np.arange(num_rows), stop - start)
+        values = np.repeat(cell_values[start:stop], num_rows, axis=0)
+        values = np.hstack([band_perturbation(X_values, rows, band_1, values[:, 0]), band_perturbation(X_values, rows, band_2, values[:, 1])])
+        modified_pred = _predict_perturbed(model, X_test, rows, list(band_1) + list(band_2), values)
+        counts[start:stop] = confusion_counts(y_values, modified_pred.reshape(stop - start, num_rows), num_classes)
+    logging.info(f"Evaluated {num_cells} cells in {-(-num_cells // cells_per_block)} blocks.")
+
+    # compute all metrics for all cells at once
+    modified_metrics = metrics_from_counts(counts)
+
+    # calculate differences and ensure no zero values
+    accuracy_diffs, precision_diffs, recall_diffs, f1_diffs = (
+        np.maximum(np.abs(modified_metrics[metric] - base_metrics[metric]), 1e-10).reshape(num_intervals2, num_intervals1)
+        for metric in ['accuracy', 'precision', 'recall', 'f1']
+    )
+
+    return _importance_cache.put(key, (accuracy_diffs, precision_diffs, recall_diffs, f1_diffs, intervals_1, intervals_2))
 
 def visualize_joint_importance(model, X_test, y_test, feature_1_index, feature_2_index,
-                             num_intervals1, num_intervals2, suffix):
+                             num_intervals1, num_intervals2, suffix, binning='Uniform'):
     """
     Visualize the joint importance of two features using heatmaps for different metrics.
     """
 
     # get feature names
-    feature_names = list(model.feature_names_in_)
-    feature1_name = feature_names[feature_1_index]
-    feature2_name = feature_names[feature_2_index]
+    feature1_name = group_name(X_test.columns, as_band(feature_1_index))
+    feature2_name = group_name(X_test.columns, as_band(feature_2_index))
     
     # get difference matrices
     accuracy_diffs, precision_diffs, recall_diffs, f1_diffs, intervals_1, intervals_2 = _joint_interval_importance(
         model, X_test, y_test, feature_1_index, feature_2_index,
-        num_intervals1, num_intervals2
+        num_intervals1, num_intervals2, binning
     )
+
+    # the binning can give fewer or more intervals than requested (the layout below follows the cells)
+    num_intervals1, num_intervals2 = len(intervals_1) - 1, len(intervals_2) - 1
     
     # create interval labels
     x_labels = [f'{intervals_1[i]:.4f}-{intervals_1[i+1]:.4f}' for i in range(len(intervals_1)-1)]
@@ -0,0 +1,302 @@
+import os
+import json
+import hashlib
+import uuid
+import shutil
+import logging
+import threading
+import numpy as np
+import pandas as pd
+
+from services.cache import fingerprint
+from config import FEATURE_STORE_DIR, INGEST_CHUNK_ELEMENTS
+
+# opened datasets by directory
+_datasets = {}
+_datasets_lock = threading.Lock()
+
+# content digests of source files by their modification times and sizes
+_digests = {}
+
+# only one conversion or ingestion at a time (identical uploads are only written once)
+_write_lock = threading.Lock()
+
+class Dataset:
+    """
+    Dataset in the feature store: float32 features in column-major order and the target as category codes
+    (of the smallest unsigned integer type).
+
+    The features are memory-mapped, so only the columns (and pages) that are actually used are read from disk.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'meta.json')) as file:
+            self.meta = json.load(file)
+        self.directory = directory
+        self.columns = self.meta['columns']
+        self.target_name = self.meta['target']
+        self.categories = self.meta['categories']
+        self.features = np.load(os.path.join(directory, 'features.npy'), mmap_mode='r')
+        self.target = np.load(os.path.join(directory, 'target.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return self.features.shape[0]
+
+    def training_frame(self, columns=None):
+        """
+        Get the features as DataFrame (only the given columns are read).
+        """
+
+        if columns is None:
+            return pd.DataFrame(self.features, columns=self.columns, copy=False)
+
+        column_indices = [self.columns.index(column) for column in columns]
+        return pd.DataFrame(self.features[:, column_indices], columns=list(columns), copy=False)
+
+    def target_frame(self):
+        """
+        Get the target as DataFrame with a categorical column.
+        """
+
+        target = pd.Categorical.from_codes(np.asarray(self.target), categories=self.categories)
+        return pd.DataFrame({self.target_name: target})
+
+    def combined_frame(self):
+        """
+        Get the features and the target (as last column) as one DataFrame.
+        """
+
+        return pd.concat([self.training_frame(), self.target_frame()], axis=1)
+
+    def take(self, rows):
+        """
+        Get the features of the given rows as DataFrame (indexed by row).
+        """
+
+        return pd.DataFrame(self.features[rows], columns=self.columns, index=rows, copy=False)
+
+    def target_values(self, rows):
+        """
+        Get the target values of the given rows.
+        """
+
+        return np.asarray(self.categories)[self.target[rows]]
+
+def _source_signature(paths):
+    """
+    Get the modification times and sizes of source files (to detect changes).
+    """
+
+    signature = []
+    for path in paths:
+        stat = os.stat(path)
+        signature.append([os.path.abspath(path), stat.st_mtime_ns, stat.st_size])
+
+    return signature
+
+def _content_digest(paths):
+    """
+    Get a digest of the content of source files (hashed only once per modification time and size).
+    """
+
+    signature = json.dumps(_source_signature(paths))
+    digest = _digests.get(signature)
+    if digest is None:
+        digest = hashlib.blake2b(digest_size=16)
+        for path in paths:
+            with open(path, 'rb') as file:
+                for block in iter(lambda: file.read(2**20), b''):
+                    digest.update(block)
+            digest.update(b'\0')
+        digest = _digests[signature] = digest.hexdigest()
+
+    return digest
+
+def _read_csv_chunks(target_source, training_source):
+    """
+    Read target and training CSV files in lockstep chunks with float32 features.
+
+    Raises a ValueError if the files do not have the same number of rows or the features are not numeric.
+    """
+
+    # rows per chunk from the number of columns
+    for source in (target_source, training_source):
+        if hasattr(source, 'seek'):
+            source.seek(0)
+    num_columns = len(pd.read_csv(training_source, nrows=0).columns)
+    if hasattr(training_source, 'seek'):
+        training_source.seek(0)
+    rows_per_chunk = max(1, INGEST_CHUNK_ELEMENTS // max(1, num_columns))
+
+    target_chunks = pd.read_csv(target_source, chunksize=rows_per_chunk)
+    training_chunks = pd.read_csv(training_source, chunksize=rows_per_chunk, dtype=np.float32)
+    num_rows = 0
+    while True:
+        try:
+            training_chunk = next(training_chunks, None)
+        except ValueError as e:
+            raise ValueError(f"Training data must be numeric (after row {num_rows}): {e}")
+        target_chunk = next(target_chunks, None)
+
+        if training_chunk is None and target_chunk is None:
+            break
+        if training_chunk is None or target_chunk is None or len(training_chunk) != len(target_chunk):
+            raise ValueError(f"Target and training data do not have the same number of rows (after row {num_rows}).")
+
+        num_rows += len(training_chunk)
+        yield training_chunk, target_chunk
+
+def write_dataset(directory, chunks, source=None):
+    """
+    Write chunks of (training, target) DataFrames to the feature store (replacing an existing dataset).
+
+    The features are first appended row by row to a raw file and then transposed into column-major order,
+    so only one chunk is held in memory at a time. Raises a ValueError if target values are missing.
+    """
+
+    # write to a temporary directory first so that readers never see partial datasets
+    temporary_directory = f'{directory}.{uuid.uuid4().hex}.tmp'
+    os.makedirs(temporary_directory)
+    try:
+        raw_path = os.path.join(temporary_directory, 'features.raw')
+        columns, target_name = None, None
+        categories = {}
+        target_codes = []
+        num_rows = 0
+        with open(raw_path, 'wb') as raw_file:
+            for df_training, df_target in chunks:
+                if columns is None:
+                    columns = [str(column) for column in df_training.columns]
+                    target_name = str(df_target.columns[0])
+
+                raw_file.write(np.ascontiguousarray(df_training.to_numpy(dtype=np.float32)).tobytes())
+
+                # encode the target of the chunk with the codes of all values seen so far
+                missing = np.flatnonzero(df_target.iloc[:, 0].isna().to_numpy())
+                if len(missing):
+                    raise ValueError(f"Target values are missing (first in data row {num_rows + 1 + missing[0]}). Please remove or label these rows.")
+                values, inverse = np.unique(df_target.iloc[:, 0].to_numpy(), return_inverse=True)
+                chunk_codes = np.array([categories.setdefault(value, len(categories)) for value in values.tolist()], dtype=np.int32)
+                target_codes.append(chunk_codes[inverse.ravel()])
+                num_rows += len(df_training)
+
+        if columns is None:
+            raise ValueError("The data is empty.")
+
+        # sort the categories (as the label encoder does)
+        sorted_categories = sorted(categories, key=lambda value: (str(type(value)), value))
+        order = np.empty(len(categories), dtype=np.int32)
+        order[[categories[value] for value in sorted_categories]] = np.arange(len(categories))
+        codes_dtype = np.min_scalar_type(max(len(categories) - 1, 0))
+        np.save(os.path.join(temporary_directory, 'target.npy'), order[np.concatenate(target_codes)].astype(codes_dtype))
+
+        # transpose the raw rows into column-major order (in chunks of rows)
+        raw = np.memmap(raw_path, dtype=np.float32, mode='r', shape=(num_rows, len(columns)))
+        features = np.lib.format.open_memmap(
+            os.path.join(temporary_directory, 'features.npy'), mode='w+', dtype=np.float32, shape=(num_rows, len(columns)), fortran_order=True
+        )
+        rows_per_chunk = max(1, INGEST_CHUNK_ELEMENTS // max(1, len(columns)))
+        for start in range(0, num_rows, rows_per_chunk):
+            features[start:start + rows_per_chunk] = raw[start:start + rows_per_chunk]
+        features.flush()
+        del raw, features
+        os.remove(raw_path)
+
+        meta = {
+            'columns': columns,
+            'target': target_name,
+            'categories': [value.item() if isinstance(value, np.generic) else value for value in sorted_categories],
+            'source': source
+        }
+        with open(os.path.join(temporary_directory, 'meta.json'), 'w') as file:
+            json.dump(meta, file)
+    except BaseException:
+        shutil.rmtree(temporary_directory, ignore_errors=True)
+        raise
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(temporary_directory, directory)
+    logging.info(f"Wrote dataset with {num_rows} rows and {len(columns)} features to feature store.")
+
+def open_dataset(directory):
+    """
+    Open a dataset of the feature store (shared by all sessions).
+    """
+
+    with _datasets_lock:
+        dataset = _datasets.get(directory)
+        if dataset is None:
+            dataset = _datasets[directory] = Dataset(directory)
+
+    return dataset
+
+def _load_dataset(directory, source, read_chunks):
+    """
+    Open a stored dataset, writing it first (from the chunks returned by read_chunks) if it is missing
+    or was written from a different source.
+    """
+
+    with _datasets_lock:
+        dataset = _datasets.get(directory)
+    if dataset is not None and dataset.meta['source'] == source:
+        return dataset
+
+    with _write_lock:
+        # check the stored dataset (possibly written by another session or process)
+        try:
+            with open(os.path.join(directory, 'meta.json')) as file:
+                up_to_date = json.load(file)['source'] == source
+        except (OSError, ValueError, KeyError):
+            up_to_date = False
+
+        if not up_to_date:
+            write_dataset(directory, read_chunks(), source=source)
+
+    with _datasets_lock:
+        dataset = _datasets[directory] = Dataset(directory)
+
+    return dataset
+
+def load_preset(case):
+    """
+    Open the dataset of a preset with CSV files (converted once and again whenever the content of a CSV
+    file changes).
+    """
+
+    directory = os.path.join(FEATURE_STORE_DIR, f"preset-{fingerprint(case['target'], case['training'])}")
+    source = _content_digest([case['target'], case['training']])
+
+    return _load_dataset(directory, source, lambda: _read_csv_chunks(case['target'], case['training']))
+
+def load_frames(name, read_frames, source):
+    """
+    Open a dataset that is created in memory by read_frames (as training and target DataFrames).
+
+    The dataset is written again whenever source (e.g. a package version) changes.
+    """
+
+    directory = os.path.join(FEATURE_STORE_DIR, f"frames-{fingerprint(name)}")
+    source = json.loads(json.dumps(source))
+
+    return _load_dataset(directory, source, lambda: [read_frames()])
+
+def ingest_upload(target_file, training_file):
+    """
+    Stream uploaded target and training CSV files into the feature store.
+
+    Files with the same content are only ingested once. Returns the directory of the dataset.
+    """
+
+    # identify the dataset by the content of the files (without copying the uploaded bytes)
+    digest = hashlib.blake2b(digest_size=16)
+    for file in (target_file, training_file):
+        digest.update(file.getbuffer() if hasattr(file, 'getbuffer') else file.read())
+        digest.update(b'\0')
+    directory = os.path.join(FEATURE_STORE_DIR, f'upload-{digest.hexdigest()}')
+
+    with _write_lock:
+        if not os.path.exists(os.path.join(directory, 'meta.json')):
+            logging.info("Ingesting uploaded CSV files into the feature store.")
+            write_dataset(directory, _read_csv_chunks(target_file, training_file), source=digest.hexdigest())
+
+    return directory
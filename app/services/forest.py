@@ -0,0 +1,303 @@
+import logging
+import numpy as np
+from joblib import effective_n_jobs
+from sklearn.ensemble import RandomForestClassifier, HistGradientBoostingClassifier
+
+from services.cache import LRUCache, model_key, data_key
+from services.predictions import apply
+from config import MAX_BATCH_ELEMENTS
+
+# forest indices of recently used (model, rows) pairs
+_index_cache = LRUCache(max_entries=8)
+
+# memory limit of the affected (row, tree) pairs cached per forest index
+AFFECTED_CACHE_BYTES = 2**26
+
+# above this share of affected (row, tree) pairs a plain (single-threaded) predict is faster
+MAX_AFFECTED_FRACTION = 0.15
+
+# cached in place of an index for rows that it cannot handle (e.g. missing values)
+_NO_INDEX = 'no index'
+
+class ForestIndex:
+    """
+    Precomputed leaf assignments of a fitted random forest for a fixed set of rows.
+
+    The path of a row through a tree is fully determined by its leaf. For a set of perturbed features,
+    every (row, tree) pair whose path never tests one of these features keeps its cached leaf. All other
+    pairs are re-evaluated starting at the first node on their path that tests a perturbed feature.
+    """
+
+    def __init__(self, model, X):
+        trees = [estimator.tree_ for estimator in model.estimators_]
+        self.classes = model.classes_
+        self.num_trees = len(trees)
+        self.X = np.ascontiguousarray(np.asarray(X), dtype=np.float32)
+
+        # concatenate the nodes of all trees into global arrays
+        sizes = np.array([tree.node_count for tree in trees])
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        self.left = np.concatenate([np.where(tree.children_left >= 0, tree.children_left + offset, -1) for tree, offset in zip(trees, offsets)])
+        self.right = np.concatenate([np.where(tree.children_right >= 0, tree.children_right + offset, -1) for tree, offset in zip(trees, offsets)])
+        self.feature = np.concatenate([tree.feature for tree in trees])
+        self.threshold = np.concatenate([tree.threshold for tree in trees])
+        self.is_leaf = self.left < 0
+
+        # children as one table (index 2 * node + go_right) and split features of internal nodes
+        self.children = np.stack([self.left, self.right], axis=1).ravel()
+        self.split_feature = np.maximum(self.feature, 0)
+
+        # class probabilities of every node (normalized as in DecisionTreeClassifier.predict_proba)
+        value = np.concatenate([tree.value[:, 0, :len(self.classes)] for tree in trees])
+        normalizer = value.sum(axis=1, keepdims=True)
+        normalizer[normalizer == 0] = 1
+        self.value = value / normalizer
+
+        # parent of every node and nodes grouped by depth
+        internal = np.flatnonzero(self.left >= 0)
+        self.parent = np.full(len(self.left), -1)
+        self.parent[self.left[internal]] = internal
+        self.parent[self.right[internal]] = internal
+        self.levels = []
+        level = offsets
+        while len(level):
+            self.levels.append(level)
+            level = level[self.left[level] >= 0]
+            level = np.concatenate([self.left[level], self.right[level]])
+
+        # leaves of every row in every tree and the summed class probabilities
+        self.leaves = apply(model, X) + offsets
+        self.proba_sum = self.value[self.leaves].sum(axis=1)
+
+        # affected pairs of recently perturbed features (one entry per feature for permutation importance)
+        self._affected = LRUCache(max_entries=1024, max_bytes=AFFECTED_CACHE_BYTES)
+        logging.info(f"Forest index created for {len(self.X)} rows and {self.num_trees} trees ({len(self.left)} nodes).")
+
+    def affected(self, feature_indices):
+        """
+        Get the (row, tree) pairs whose path tests one of the given features.
+
+        Returns the pairs sorted by row (with a row pointer), together with the first node on the
+        path that tests one of the features and the cached leaf of the pair.
+        """
+
+        key = tuple(sorted(feature_indices))
+        affected = self._affected.get(key)
+        if affected is None:
+            # first node on the path from the root that tests one of the features (-1 if none)
+            tests_feature = np.isin(self.feature, key)
+            entry = np.full(len(self.feature), -1)
+            for level in self.levels[1:]:
+                parent = self.parent[level]
+                entry[level] = np.where(entry[parent] >= 0, entry[parent], np.where(tests_feature[parent], parent, -1))
+
+            start_nodes = entry[self.leaves]
+            pair_rows, pair_trees = np.nonzero(start_nodes >= 0)
+            row_pointer = np.concatenate([[0], np.cumsum(np.bincount(pair_rows, minlength=len(self.X)))])
+            affected = self._affected.put(key, {
+                'row_pointer': row_pointer,
+                'start_node': start_nodes[pair_rows, pair_trees],
+                'leaf': self.leaves[pair_rows, pair_trees],
+                'fraction': len(pair_rows) / max(1, self.leaves.size)
+            })
+
+        return affected
+
+    def predict_proba_perturbed(self, rows, feature_indices, values):
+        """
+        Predict class probabilities for the given rows with the columns in feature_indices set to values.
+        """
+
+        rows = np.asarray(rows)
+        values = np.asarray(values, dtype=np.float32).reshape(len(rows), len(feature_indices))
+        proba_sum = self.proba_sum[rows]
+        affected = self.affected(feature_indices)
+
+        # only rows whose values actually change can change their leaves
+        changed = np.flatnonzero((self.X[rows[:, None], feature_indices] != values).any(axis=1))
+
+        # re-evaluate affected subtrees in chunks of rows
+        rows_per_chunk = max(1, MAX_BATCH_ELEMENTS // (4 * self.num_trees))
+        for start in range(0, len(changed), rows_per_chunk):
+            chunk = changed[start:start + rows_per_chunk]
+            block = self.X[rows[chunk]]
+            block[:, feature_indices] = values[chunk]
+
+            # expand the affected pairs of the underlying rows
+            first = affected['row_pointer'][rows[chunk]]
+            counts = affected['row_pointer'][rows[chunk] + 1] - first
+            if counts.sum() == 0:
+                continue
+            pair_rows = np.repeat(np.arange(len(chunk)), counts)
+            pairs = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - first, counts)
+
+            # walk down from the first affected node (keeping only pairs that have not reached a leaf)
+            new_leaves = affected['start_node'][pairs]
+            nodes = new_leaves.copy()
+            positions = np.arange(len(nodes))
+            offsets = pair_rows * block.shape[1]
+            block = block.ravel()
+            while len(nodes):
+                go_right = block[offsets + self.split_feature[nodes]] > self.threshold[nodes]
+                nodes = self.children[2 * nodes + go_right]
+                done = self.is_leaf[nodes]
+                new_leaves[positions[done]] = nodes[done]
+                nodes, positions, offsets = nodes[~done], positions[~done], offsets[~done]
+
+            # replace the probabilities of the old leaves by the new ones
+            difference = self.value[new_leaves] - self.value[affected['leaf'][pairs]]
+            for k in range(difference.shape[1]):
+                proba_sum[chunk, k] += np.bincount(pair_rows, weights=difference[:, k], minlength=len(chunk))
+
+        return proba_sum / self.num_trees
+
+    def predict_perturbed(self, rows, feature_indices, values):
+        """
+        Predict class labels for the given rows with the columns in feature_indices set to values.
+        """
+
+        proba = self.predict_proba_perturbed(rows, feature_indices, values)
+        return self.classes.take(np.argmax(proba, axis=1))
+
+class BoostingIndex:
+    """
+    Precomputed raw predictions of a fitted histogram gradient boosting model for a fixed set of rows.
+
+    Perturbing features only changes the output of trees that split on one of them. Only these trees are
+    evaluated again for the perturbed rows and their outputs replace the ones of the original rows in the
+    cached raw predictions.
+
+    The index relies on private scikit-learn internals (the fitted predictors, the bin mapper and the loss).
+    Creating it raises an AttributeError or a TypeError if they are missing or have changed.
+    """
+
+    def __init__(self, model, X):
+        self.loss = model._loss
+        self.classes = model.classes_
+        self.X = np.ascontiguousarray(np.asarray(X), dtype=np.float32)
+
+        # trees of all iterations (with the class they predict) and the features they split on
+        self.trees = [(k, predictor) for predictors in model._predictors for k, predictor in enumerate(predictors)]
+        self.num_trees = len(self.trees)
+        self.splits_on = np.zeros((self.num_trees, self.X.shape[1]), dtype=bool)
+        for tree, (_, predictor) in enumerate(self.trees):
+            self.splits_on[tree, predictor.nodes['feature_idx'][predictor.nodes['is_leaf'] == 0]] = True
+        self.known_cat_bitsets, self.f_idx_map = model._bin_mapper.make_known_categories_bitsets()
+
+        # raw predictions (sum of all tree outputs) of every row
+        self.raw = model._raw_predict(self.X)
+
+        # the trees must be evaluated the same way by predict (fails early if the signature has changed)
+        self._tree_outputs(range(self.num_trees), self.X[:1].astype(np.float64))
+
+        self._affected = LRUCache(max_entries=1024, max_bytes=AFFECTED_CACHE_BYTES)
+        logging.info(f"Boosting index created for {len(self.X)} rows and {self.num_trees} trees.")
+
+    def affected(self, feature_indices):
+        """
+        Get the trees that split on one of the given features, together with their summed raw outputs
+        for the original rows.
+        """
+
+        key = tuple(sorted(feature_indices))
+        affected = self._affected.get(key)
+        if affected is None:
+            trees = np.flatnonzero(self.splits_on[:, list(key)].any(axis=1))
+            affected = self._affected.put(key, {
+                'trees': trees,
+                'raw': self._tree_outputs(trees, self.X.astype(np.float64)),
+                'fraction': len(trees) / max(1, self.num_trees)
+            })
+
+        return affected
+
+    def _tree_outputs(self, trees, X):
+        """
+        Sum the outputs of the given trees for the rows of X (single-threaded, callers parallelize).
+        """
+
+        raw = np.zeros((len(X), self.raw.shape[1]))
+        for tree in trees:
+            k, predictor = self.trees[tree]
+            raw[:, k] += predictor.predict(X, self.known_cat_bitsets, self.f_idx_map, 1)
+
+        return raw
+
+    def raw_perturbed(self, rows, feature_indices, values):
+        """
+        Get the raw predictions for the given rows with the columns in feature_indices set to values.
+        """
+
+        rows = np.asarray(rows)
+        values = np.asarray(values, dtype=np.float32).reshape(len(rows), len(feature_indices))
+        raw = self.raw[rows]
+        affected = self.affected(feature_indices)
+
+        # only rows whose values actually change can change their outputs
+        changed = np.flatnonzero((self.X[rows[:, None], feature_indices] != values).any(axis=1))
+
+        # replace the outputs of the affected trees in chunks of rows
+        rows_per_chunk = max(1, MAX_BATCH_ELEMENTS // self.X.shape[1])
+        for start in range(0, len(changed), rows_per_chunk):
+            chunk = changed[start:start + rows_per_chunk]
+            block = self.X[rows[chunk]].astype(np.float64)
+            block[:, feature_indices] = values[chunk]
+            raw[chunk] += self._tree_outputs(affected['trees'], block) - affected['raw'][rows[chunk]]
+
+        return raw
+
+    def predict_proba_perturbed(self, rows, feature_indices, values):
+        """
+        Predict class probabilities for the given rows with the columns in feature_indices set to values.
+        """
+
+        return self.loss.predict_proba(self.raw_perturbed(rows, feature_indices, values))
+
+    def predict_perturbed(self, rows, feature_indices, values):
+        """
+        Predict class labels for the given rows with the columns in feature_indices set to values
+        (as HistGradientBoostingClassifier.predict does from the raw predictions).
+        """
+
+        raw = self.raw_perturbed(rows, feature_indices, values)
+        encoded = (raw.ravel() > 0).astype(int) if raw.shape[1] == 1 else np.argmax(raw, axis=1)
+        return self.classes.take(encoded)
+
+def get_forest_index(model, X, feature_indices=None):
+    """
+    Get the (cached) forest or boosting index of a model for the rows of X.
+
+    Returns None if the model is neither a random forest nor a histogram gradient boosting model, if the
+    index cannot be created for this scikit-learn version or for rows with missing values (forests route
+    them by the learned missing_go_to_left, which the index does not) or if perturbing feature_indices
+    would affect so many trees that a plain predict is faster.
+    """
+
+    if isinstance(model, RandomForestClassifier) and getattr(model, 'n_outputs_', 1) == 1:
+        index_class = ForestIndex
+    elif isinstance(model, HistGradientBoostingClassifier):
+        index_class = BoostingIndex
+    else:
+        return None
+
+    key = (model_key(model), data_key(X))
+    index = _index_cache.get(key)
+    if index is None:
+        if index_class is ForestIndex and np.isnan(np.asarray(X, dtype=np.float32)).any():
+            logging.info("Rows with missing values are not supported by the forest index. Using plain predict.")
+            index = _index_cache.put(key, _NO_INDEX)
+        else:
+            try:
+                index = _index_cache.put(key, index_class(model, X))
+            except (AttributeError, TypeError) as e:
+                logging.warning(f"{index_class.__name__} is not supported by this scikit-learn version ({e}). Using plain predict.")
+                return None
+    if index is _NO_INDEX:
+        return None
+
+    # a parallel predict gets faster with the number of workers, the index does not
+    if feature_indices is not None and index.affected(feature_indices)['fraction'] > MAX_AFFECTED_FRACTION / effective_n_jobs():
+        logging.info(f"Perturbing features {list(feature_indices)} affects too many trees. Using plain predict.")
+        return None
+
+    return index
@@ -0,0 +1,225 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+
+from services.cache import fingerprint
+from services.data import load_data, prepare_data
+from services.model import train_model, evaluate_model, model_input
+from services.predictions import cache_predictions
+from services.registry import register_model
+from services.workers import parallel_context
+from config import JOB_WORKERS
+
+# stages of a training job and their share of the progress bar
+STAGES = [
+    ('Loading the data', 0.05),
+    ('Preparing the data', 0.05),
+    ('Training the model', 0.85),
+    ('Evaluating the model', 0.05)
+]
+
+# settings of a model in the session state that make up the configuration of its training job
+CONFIG_KEYS = [
+    'selected_demo_case', 'data_percentage', 'stratify', 'engine', 'max_depth', 'n_estimators',
+    'min_samples_split', 'min_samples_leaf', 'max_features', 'normalize_cm'
+]
+
+# background workers shared by all sessions
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='training_job')
+
+# running jobs by configuration (identical configurations share one job)
+_running_jobs = {}
+_running_jobs_lock = threading.Lock()
+
+class TrainingJob:
+    """
+    State of a training pipeline running in the background.
+    """
+
+    def __init__(self, key, config):
+        self.key = key
+        self.config = config
+        self.stage = 'Waiting for a worker'
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.future = None
+        self.submitted = time.time()
+
+    @property
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def set_stage(self, stage_index, fraction=0.0):
+        """
+        Update the current stage and the overall progress.
+        """
+
+        self.stage = STAGES[stage_index][0]
+        self.progress = min(1.0, sum(share for _, share in STAGES[:stage_index]) + STAGES[stage_index][1] * fraction)
+
+def _run_training_job(job, n_jobs):
+    """
+    Load and prepare the data, train the model and evaluate it.
+    """
+
+    config = job.config
+    try:
+        with parallel_context(n_jobs):
+            # load data
+            job.set_stage(0)
+            dataset = load_data(
+                selected_demo_case=config['selected_demo_case'],
+                custom_dataset=config.get('custom_dataset')
+            )
+            if dataset is None:
+                job.error = "Data loading failed. Please adjust data settings."
+                job.result = {'data_error': True}
+                return
+
+            # prepare data
+            job.set_stage(1)
+            plan = prepare_data(dataset, config['data_percentage'], config.get('stratify', False))
+            if plan is None:
+                logging.error("Data preparation failed. Please adjust percentage of data used.")
+                job.result = {'data_error': True}
+                return
+            y_train, y_test, label_encoder = plan.labels
+
+            # train the model (with progress per tree)
+            job.set_stage(2)
+            train_start = time.time()
+            rf_classifier = train_model(
+                plan.X_train(),
+                y_train,
+                config['max_depth'],
+                config['n_estimators'],
+                config['min_samples_split'],
+                config['min_samples_leaf'],
+                config['max_features'],
+                _progress=lambda trees_done, trees_total: job.set_stage(2, trees_done / trees_total),
+                data_key=plan.key,
+                engine=config.get('engine', 'Random Forest')
+            )
+            train_time = time.time() - train_start
+            X_test = plan.X_test()
+            predict_start = time.time()
+            y_pred = rf_classifier.predict(model_input(X_test))
+            predict_time = time.time() - predict_start
+            cache_predictions(rf_classifier, X_test, y_pred)
+            logging.info("Model trained successfully.")
+
+            # evaluate the model
+            job.set_stage(3)
+            accuracy, precision, recall, f1, unique_labels, cm, metrics = evaluate_model(y_test, y_pred, label_encoder, config['normalize_cm'])
+
+        # only the shared dataset and the split plan (row indices) (no copies of the data) go to the session state
+        job.result = {
+            'dataset': dataset,
+            'split': plan,
+            'y_test': y_test,
+            'label_encoder': label_encoder,
+            'rf_classifier': rf_classifier,
+            'trained_engine': config.get('engine', 'Random Forest'),  # engine{suffix} is the sidebar selection
+            'train_time': train_time,
+            'predict_time': predict_time,
+            'y_pred': y_pred,
+            'accuracy': accuracy,
+            'precision': precision,
+            'recall': recall,
+            'f1': f1,
+            'unique_labels': unique_labels,
+            'cm': cm,
+            'metrics': metrics,
+            'data_error': False,
+            'first_run': False
+        }
+        logging.info(f"Training job finished in {time.time() - job.submitted:.2f} seconds.")
+    except Exception as e:
+        logging.exception("Training job failed.")
+        job.error = f"Training failed: {e}"
+        job.result = {}
+    finally:
+        job.progress = 1.0
+        with _running_jobs_lock:
+            if _running_jobs.get(job.key) is job:
+                del _running_jobs[job.key]
+
+def submit_training_job(config, n_jobs=1):
+    """
+    Start a training job in the background (or join the running job with the same configuration).
+    """
+
+    key = fingerprint(sorted(config.items()))
+    with _running_jobs_lock:
+        job = _running_jobs.get(key)
+        if job is not None:
+            logging.info("Joined running training job with the same configuration.")
+            return job
+
+        job = TrainingJob(key, config)
+        _running_jobs[key] = job
+        job.future = _executor.submit(_run_training_job, job, n_jobs)
+
+    logging.info(f"Submitted training job: {config}")
+    return job
+
+def training_config(suffix):
+    """
+    Get the configuration of a training job from the settings of a model in the session state.
+    """
+
+    config = {key: st.session_state[f'{key}{suffix}'] for key in CONFIG_KEYS}
+
+    # uploaded data (if any) is passed by its location in the feature store
+    use_custom_data = st.session_state.get(f'custom_target{suffix}', False) and st.session_state.get(f'custom_training{suffix}', False)
+    config['custom_dataset'] = st.session_state.get(f'custom_dataset{suffix}') if use_custom_data else None
+
+    return config
+
+def submit_comparison_jobs(n_jobs=1):
+    """
+    Start the training jobs of the main and the comparison model at the same time.
+
+    Both jobs share the workers of the session (and the data if both use the same dataset), so comparing
+    two models takes about as long as training the slower one.
+    """
+
+    for suffix in ['', '_compare']:
+        st.session_state[f'training_job{suffix}'] = submit_training_job(training_config(suffix), n_jobs=max(1, n_jobs // 2))
+
+def collect_training_job(suffix):
+    """
+    Move the results of a finished training job into the session state.
+
+    Returns the job if it is still running.
+    """
+
+    job = st.session_state.get(f'training_job{suffix}')
+    if job is None or not job.done:
+        return job
+
+    # apply results (the previous model stays available until then)
+    del st.session_state[f'training_job{suffix}']
+    for key, value in job.result.items():
+        st.session_state[f'{key}{suffix}'] = value
+    if job.error:
+        st.session_state[f'training_error{suffix}'] = job.error
+    elif not job.result.get('data_error', True):
+        register_model(job.key, job.config, job.result)
+    logging.info(f"Collected results of training job{' for comparison model' if suffix else ''}.")
+
+    return None
+
+@st.fragment(run_every=1)
+def show_training_progress(job, title=''):
+    """
+    Show the progress of a running training job and rerun the app once it has finished.
+    """
+
+    if job.done:
+        st.rerun()
+
+    st.progress(job.progress, text=f"{title}{job.stage}...")
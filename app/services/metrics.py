@@ -0,0 +1,84 @@
+import numpy as np
+
+def confusion_counts(y_true, y_pred, num_classes=None):
+    """
+    Build the confusion matrix (rows actual, columns predicted) with a single integer bincount.
+
+    y_pred may hold several prediction blocks of shape (num_blocks, num_rows) for the same y_true,
+    in which case one confusion matrix per block is returned.
+    """
+
+    y_true = np.asarray(y_true).ravel().astype(np.int64)
+    y_pred = np.asarray(y_pred).astype(np.int64)
+
+    # labels are encoded as 0, ..., num_classes - 1
+    if num_classes is None:
+        num_classes = int(max(y_true.max(initial=0), y_pred.max(initial=0))) + 1
+
+    # flatten (block, actual, predicted) into one index
+    blocks = y_pred.reshape(-1, len(y_true))
+    num_blocks = blocks.shape[0]
+    index = (np.arange(num_blocks)[:, None] * num_classes + y_true) * num_classes + blocks
+    counts = np.bincount(index.ravel(), minlength=num_blocks * num_classes * num_classes)
+    counts = counts.reshape(num_blocks, num_classes, num_classes)
+
+    return counts[0] if y_pred.ndim == 1 else counts
+
+def metrics_from_counts(counts):
+    """
+    Derive overall, weighted and per-class metrics from confusion counts.
+
+    Undefined ratios are set to zero (as with zero_division=0 in sklearn). Works on a single confusion
+    matrix or on a stack of them.
+    """
+
+    counts = np.asarray(counts)
+
+    # confusion counts per class (one vs. rest)
+    tp = np.diagonal(counts, axis1=-2, axis2=-1)
+    support = counts.sum(axis=-1)
+    predicted = counts.sum(axis=-2)
+    total = support.sum(axis=-1, keepdims=True)
+    fp = predicted - tp
+    fn = support - tp
+    tn = total - tp - fp - fn
+
+    # per-class metrics
+    with np.errstate(divide='ignore', invalid='ignore'):
+        class_accuracy = np.where(total > 0, (tp + tn) / total, 0.0)
+        class_precision = np.where(predicted > 0, tp / predicted, 0.0)
+        class_recall = np.where(support > 0, tp / support, 0.0)
+        class_f1 = np.where(support + predicted > 0, 2 * tp / (support + predicted), 0.0)
+
+    # overall accuracy and support-weighted averages
+    total = total[..., 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        accuracy = np.where(total > 0, tp.sum(axis=-1) / total, 0.0)
+        precision = np.where(total > 0, (class_precision * support).sum(axis=-1) / total, 0.0)
+        recall = np.where(total > 0, (class_recall * support).sum(axis=-1) / total, 0.0)
+        f1 = np.where(total > 0, (class_f1 * support).sum(axis=-1) / total, 0.0)
+
+    return {
+        'confusion_matrix': counts,
+        'accuracy': accuracy,
+        'precision': precision,
+        'recall': recall,
+        'f1': f1,
+        'class_accuracy': class_accuracy,
+        'class_precision': class_precision,
+        'class_recall': class_recall,
+        'class_f1': class_f1,
+        'tp': tp,
+        'tn': tn,
+        'fp': fp,
+        'fn': fn,
+        'support': support,
+        'predicted': predicted
+    }
+
+def compute_metrics(y_true, y_pred, num_classes=None):
+    """
+    Compute all metrics of a model in one pass over its predictions.
+    """
+
+    return metrics_from_counts(confusion_counts(y_true, y_pred, num_classes))
@@ -1,51 +1,270 @@
 import streamlit as st
 import pandas as pd
 from sklearn.preprocessing import LabelEncoder
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import confusion_matrix, accuracy_score, precision_score, recall_score, f1_score
+from sklearn.ensemble import RandomForestClassifier, HistGradientBoostingClassifier
 from sklearn.model_selection import train_test_split
 import plotly.graph_objects as go
 import logging
+import copy
+import numpy as np
+from joblib import effective_n_jobs
+from threadpoolctl import threadpool_limits
 
-# train model
-@st.cache_resource(show_spinner=False)
-def train_model(X_train, y_train, max_depth, n_estimators, min_samples_split, min_samples_leaf, max_features):
+from services.metrics import compute_metrics
+from services.cache import LRUCache, fingerprint
+from services.model_store import save_forest, load_forest, remember_forest
+
+# number of progress updates while fitting a forest
+PROGRESS_STEPS = 20
+
+# number of progress updates while fitting a gradient boosting model (every warm start predicts with all
+# trees fitted so far)
+BOOSTING_PROGRESS_STEPS = 5
+
+# largest forest trained so far per training data and hyperparameters (except the number of trees)
+# and gradient boosting models per training data and hyperparameters
+_forest_cache = LRUCache(max_entries=4)
+
+def _resize_forest(rf_classifier, n_estimators):
+    """
+    Create a shallow copy of a fitted forest that shares the first n_estimators trees.
+    """
+
+    resized = copy.copy(rf_classifier)
+    resized.estimators_ = list(rf_classifier.estimators_[:n_estimators])
+    resized.n_estimators = min(n_estimators, len(rf_classifier.estimators_))
+
+    return resized
+
+def model_input(X):
+    """
+    Convert features to the C-contiguous float32 array that the trees use internally.
+
+    Models are fitted and queried with plain arrays, so sklearn neither validates feature names nor
+    converts a DataFrame on every call (feature names are taken from the data instead).
+    """
+
+    return np.ascontiguousarray(X, dtype=np.float32)
+
+def _train_forest(X_train, y_train, params, key, _progress=None, persist=True):
     """
     Train a Random Forest Classifier model.
+
+    If a forest was already trained on the same data with the same hyperparameters (in this process or
+    in the persistent model store), its trees are reused: a smaller forest takes a prefix of the trees and
+    a larger forest only fits the additional trees.
     """
-    
-    rf_classifier = RandomForestClassifier(
-        max_depth=max_depth,
-        n_estimators=n_estimators,
-        min_samples_split=min_samples_split,
-        min_samples_leaf=min_samples_leaf,
-        max_features=max_features
-    )
-    
-    rf_classifier.fit(X_train, y_train)
-    
+
+    n_estimators = params['n_estimators']
+    key = fingerprint(key, params['max_depth'], params['min_samples_split'], params['min_samples_leaf'], params['max_features'])
+    cached_classifier = _forest_cache.get(key)
+    if cached_classifier is None:
+        cached_classifier = load_forest(key)
+        if cached_classifier is not None and persist:
+            _forest_cache.put(key, cached_classifier)
+
+    if cached_classifier is not None and len(cached_classifier.estimators_) >= n_estimators:
+        # reuse a prefix of the existing trees
+        rf_classifier = _resize_forest(cached_classifier, n_estimators)
+        remember_forest(rf_classifier, key)
+        logging.info(f"Reused {n_estimators} of {len(cached_classifier.estimators_)} cached trees.")
+        if _progress is not None:
+            _progress(n_estimators, n_estimators)
+        return rf_classifier
+
+    if cached_classifier is not None:
+        # only fit the additional trees
+        rf_classifier = _resize_forest(cached_classifier, n_estimators)
+        trees_done = len(cached_classifier.estimators_)
+    else:
+        rf_classifier = RandomForestClassifier(
+            max_depth=params['max_depth'],
+            n_estimators=n_estimators,
+            min_samples_split=params['min_samples_split'],
+            min_samples_leaf=params['min_samples_leaf'],
+            max_features=params['max_features']
+        )
+        trees_done = 0
+
+    # fit the trees in steps (large enough to keep all workers busy) to report progress
+    step = n_estimators
+    if _progress is not None:
+        step = max(n_estimators // PROGRESS_STEPS, effective_n_jobs())
+
+    rf_classifier.set_params(warm_start=True)
+    while trees_done < n_estimators:
+        trees_done = min(trees_done + step, n_estimators)
+        rf_classifier.set_params(n_estimators=trees_done)
+        rf_classifier.fit(X_train, y_train)
+        if _progress is not None:
+            _progress(trees_done, n_estimators)
+    rf_classifier.set_params(warm_start=False)
+
+    if cached_classifier is not None:
+        logging.info(f"Extended cached forest from {len(cached_classifier.estimators_)} to {n_estimators} trees.")
+
+    if persist:
+        _forest_cache.put(key, rf_classifier)
+        save_forest(rf_classifier, key)
+
     return rf_classifier
 
+def _train_boosting(X_train, y_train, params, key, _progress=None, persist=True):
+    """
+    Train a Histogram-based Gradient Boosting Classifier model.
+
+    The features are binned once and the trees are fitted with all workers (OpenMP threads). On large data,
+    boosting stops early when the score on a validation split no longer improves.
+    """
+
+    n_iterations = params['n_estimators']
+    key = fingerprint(key, params['max_depth'], n_iterations, params['min_samples_leaf'], params['max_features'])
+    hgb_classifier = _forest_cache.get(key)
+    if hgb_classifier is None:
+        hgb_classifier = load_forest(key)
+    if hgb_classifier is not None:
+        logging.info(f"Reused cached gradient boosting model with {hgb_classifier.n_iter_} iterations.")
+        if _progress is not None:
+            _progress(n_iterations, n_iterations)
+        if persist:
+            _forest_cache.put(key, hgb_classifier)
+        return hgb_classifier
+
+    # share of features per split as for the forest ('sqrt' or 'log2' of the number of features)
+    num_features = X_train.shape[1]
+    max_features = max(1, int(np.sqrt(num_features) if params['max_features'] == 'sqrt' else np.log2(num_features))) / num_features
+
+    hgb_classifier = HistGradientBoostingClassifier(
+        max_depth=params['max_depth'],
+        max_iter=n_iterations,
+        min_samples_leaf=params['min_samples_leaf'],
+        max_features=max_features,
+        early_stopping='auto',
+        warm_start=True
+    )
+
+    # fit the iterations in steps to report progress (until boosting stops early)
+    step = n_iterations if _progress is None else max(1, -(-n_iterations // BOOSTING_PROGRESS_STEPS))
+    iterations_done = 0
+    with threadpool_limits(limits=effective_n_jobs(), user_api='openmp'):
+        while iterations_done < n_iterations:
+            iterations_done = min(iterations_done + step, n_iterations)
+            hgb_classifier.set_params(max_iter=iterations_done)
+            hgb_classifier.fit(X_train, y_train)
+            if _progress is not None:
+                _progress(iterations_done, n_iterations)
+            if hgb_classifier.n_iter_ < iterations_done:
+                logging.info(f"Gradient boosting stopped early after {hgb_classifier.n_iter_} iterations.")
+                if _progress is not None:
+                    _progress(n_iterations, n_iterations)
+                break
+    hgb_classifier.set_params(max_iter=n_iterations, warm_start=False)
+
+    if persist:
+        _forest_cache.put(key, hgb_classifier)
+        save_forest(hgb_classifier, key)
+
+    return hgb_classifier
+
+def _boosting_importances(hgb_classifier):
+    """
+    Get the gain-based feature importance of a gradient boosting model (normalized to sum to 1).
+
+    sklearn does not provide feature_importances_ for these models, so the split gains are summed
+    over the nodes of all trees (as the impurity decrease of a forest).
+    """
+
+    importances = np.zeros(hgb_classifier.n_features_in_)
+    for predictors in hgb_classifier._predictors:
+        for predictor in predictors:
+            nodes = predictor.nodes[~predictor.nodes['is_leaf'].astype(bool)]
+            np.add.at(importances, nodes['feature_idx'], nodes['gain'])
+
+    total = importances.sum()
+    return importances / total if total > 0 else importances
+
+# model engines: estimator class, training function, used hyperparameters and feature importance
+ENGINES = {
+    'Random Forest': {
+        'estimator': RandomForestClassifier,
+        'train': _train_forest,
+        'parameters': ['max_depth', 'n_estimators', 'min_samples_split', 'min_samples_leaf', 'max_features'],
+        'importances': lambda model: model.feature_importances_
+    },
+    'Histogram Gradient Boosting': {
+        'estimator': HistGradientBoostingClassifier,
+        'train': _train_boosting,
+        'parameters': ['max_depth', 'n_estimators', 'min_samples_leaf', 'max_features'],
+        'importances': _boosting_importances
+    }
+}
+
+def model_engine(model):
+    """
+    Get the name of the engine of a fitted model.
+    """
+
+    for name, engine in ENGINES.items():
+        if isinstance(model, engine['estimator']):
+            return name
+
+    raise ValueError(f"Unknown model type: {type(model).__name__}")
+
+def feature_importances(model):
+    """
+    Get the built-in feature importance of a fitted model (of any engine).
+    """
+
+    return ENGINES[model_engine(model)]['importances'](model)
+
+# train model
+def train_model(X_train, y_train, max_depth, n_estimators, min_samples_split, min_samples_leaf, max_features, _progress=None, data_key=None, engine='Random Forest', persist=True):
+    """
+    Train a model with the given engine (see ENGINES).
+
+    Models trained before on the same data with the same hyperparameters are reused (in this process or
+    from the persistent model store).
+    If given, _progress is called with the number of trees (or iterations) fitted so far and the total number.
+    The training data is identified by data_key if given (and by a fingerprint of the data otherwise).
+    Unless persist is unset (e.g. for search candidates), models are kept in the in-memory cache and newly
+    fitted models are saved to the model store (so candidates never evict the forests of the user).
+    """
+
+    X_train = model_input(X_train)
+    data_key = fingerprint(X_train, y_train) if data_key is None else data_key
+    key = fingerprint(data_key, X_train.dtype.str, engine)
+    params = {
+        'max_depth': max_depth,
+        'n_estimators': n_estimators,
+        'min_samples_split': min_samples_split,
+        'min_samples_leaf': min_samples_leaf,
+        'max_features': max_features
+    }
+    logging.info(f"Training {engine} model.")
+
+    return ENGINES[engine]['train'](X_train, y_train, params, key, _progress, persist)
+
 def evaluate_model(y_test, y_pred, label_encoder=None, normalize_cm=None):
     """
-    Evaluate a Random Forest Classifier model.
+    Evaluate the predictions of a model.
     """
     
-    # compute metrics
-    accuracy = accuracy_score(y_test, y_pred)
-    precision = precision_score(y_test, y_pred, average='weighted')
-    recall = recall_score(y_test, y_pred, average='weighted')
-    f1 = f1_score(y_test, y_pred, average='weighted')
+    # compute all metrics from a single confusion matrix
+    num_classes = len(label_encoder.classes_) if label_encoder is not None else None
+    metrics = compute_metrics(y_test, y_pred, num_classes)
+    accuracy = float(metrics['accuracy'])
+    precision = float(metrics['precision'])
+    recall = float(metrics['recall'])
+    f1 = float(metrics['f1'])
 
     if label_encoder is not None:
         # actual label names (and save in session state)
         unique_labels = label_encoder.classes_
 
         # compute confusion matrix (and save in session state)
+        cm = metrics['confusion_matrix']
         if normalize_cm:
-            cm = confusion_matrix(y_test, y_pred, labels=range(len(unique_labels)), normalize='all')
-        else:
-            cm = confusion_matrix(y_test, y_pred, labels=range(len(unique_labels)))
+            cm = cm / cm.sum()
 
         logging.info("Created confusion matrix.")
     else:
@@ -56,4 +275,4 @@ def evaluate_model(y_test, y_pred, label_encoder=None, normalize_cm=None):
     if label_encoder is None:
         return accuracy, precision, recall, f1
     else:
-        return accuracy, precision, recall, f1, unique_labels, cm
+        return accuracy, precision, recall, f1, unique_labels, cm, metrics
@@ -0,0 +1,159 @@
+import io
+import os
+import glob
+import uuid
+import logging
+import threading
+import weakref
+import joblib
+
+from services.cache import model_key
+from config import MODEL_STORE_DIR, MODEL_STORE_MAX_BYTES, MODEL_STORE_COMPRESSION
+
+# store keys of forests that were saved to or loaded from the store (or are prefixes of them)
+_stored_models = weakref.WeakKeyDictionary()
+_store_lock = threading.Lock()
+
+def model_size(model):
+    """
+    Get the number of trees of a forest (or boosting iterations of a gradient boosting model).
+    """
+
+    return len(model.estimators_) if hasattr(model, 'estimators_') else model.n_iter_
+
+def _store_path(key, n_estimators):
+    """
+    Get the path of a stored forest.
+    """
+
+    return os.path.join(MODEL_STORE_DIR, f'{key}-{n_estimators}.joblib')
+
+def _stored_paths(key):
+    """
+    Get the sizes and paths of the stored forests of a key (largest number of trees first).
+    """
+
+    paths = glob.glob(os.path.join(MODEL_STORE_DIR, f'{key}-*.joblib'))
+    return sorted(((int(path.rsplit('-', 1)[1].split('.')[0]), path) for path in paths), reverse=True)
+
+def _evict(keep=None):
+    """
+    Delete the least recently used forests while the store is larger than its limit (except keep).
+    """
+
+    paths = glob.glob(os.path.join(MODEL_STORE_DIR, '*.joblib'))
+    files = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            files.append((stat.st_mtime, stat.st_size, path))
+        except FileNotFoundError:
+            continue
+
+    total_size = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total_size <= MODEL_STORE_MAX_BYTES:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            total_size -= size
+            logging.info(f"Evicted {os.path.basename(path)} from model store.")
+        except FileNotFoundError:
+            pass
+
+def remember_forest(rf_classifier, key):
+    """
+    Remember the store key of a forest (e.g. of a prefix of a stored forest).
+    """
+
+    _stored_models[rf_classifier] = key
+
+def save_forest(rf_classifier, key):
+    """
+    Store a fitted forest (or any other fitted model) under the given key.
+    """
+
+    path = _store_path(key, model_size(rf_classifier))
+    os.makedirs(MODEL_STORE_DIR, exist_ok=True)
+
+    # write to a temporary file first so that readers never see partial files
+    temporary_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    try:
+        joblib.dump(rf_classifier, temporary_path, compress=MODEL_STORE_COMPRESSION)
+        os.replace(temporary_path, path)
+    except OSError as e:
+        logging.warning(f"Could not save model to store: {e}")
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        return None
+
+    remember_forest(rf_classifier, key)
+    with _store_lock:
+        # a larger (warm-started) forest supersedes the smaller ones of the same key
+        for n_estimators, smaller_path in _stored_paths(key):
+            if n_estimators < model_size(rf_classifier):
+                try:
+                    os.remove(smaller_path)
+                except FileNotFoundError:
+                    pass
+        _evict(keep=path)
+    logging.info(f"Saved model of size {model_size(rf_classifier)} to model store.")
+
+    return path
+
+def load_forest(key):
+    """
+    Load the largest stored forest for the given key (None if there is none).
+    """
+
+    for _, path in _stored_paths(key):
+        try:
+            rf_classifier = joblib.load(path)
+            os.utime(path)  # mark as recently used
+        except Exception as e:
+            logging.warning(f"Could not load {os.path.basename(path)} from model store: {e}")
+            continue
+
+        remember_forest(rf_classifier, key)
+        logging.info(f"Loaded model of size {model_size(rf_classifier)} from model store.")
+        return rf_classifier
+
+    return None
+
+def stored_size(rf_classifier):
+    """
+    Get the size of the stored file of a forest in bytes (None if it is not stored).
+    """
+
+    key = _stored_models.get(rf_classifier)
+    if key is None:
+        return None
+
+    try:
+        return os.path.getsize(_store_path(key, model_size(rf_classifier)))
+    except OSError:
+        return None
+
+def forest_file(rf_classifier):
+    """
+    Get the stored file of a forest as bytes (the forest is stored first if needed).
+    """
+
+    key = _stored_models.get(rf_classifier, model_key(rf_classifier))
+    path = _store_path(key, model_size(rf_classifier))
+
+    for _ in range(2):
+        try:
+            with open(path, 'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            # not stored yet (or evicted in the meantime)
+            if save_forest(rf_classifier, key) is None:
+                break
+
+    # serialize in memory if the store is not writable
+    buffer = io.BytesIO()
+    joblib.dump(rf_classifier, buffer, compress=MODEL_STORE_COMPRESSION)
+    return buffer.getvalue()
@@ -0,0 +1,52 @@
+import logging
+
+from services.cache import LRUCache, model_key, data_key
+from services.model import model_input
+from config import PREDICTION_CACHE_BYTES
+
+# outputs of models for recently used rows (shared by all sessions)
+_prediction_cache = LRUCache(max_entries=64, max_bytes=PREDICTION_CACHE_BYTES)
+
+def _cached_output(model, X, method):
+    """
+    Get the output of a method of a model for the rows of X (computed once per model and rows).
+    """
+
+    key = (model_key(model), data_key(X), method)
+    output = _prediction_cache.get(key)
+    if output is None:
+        output = getattr(model, method)(model_input(X))
+        output.setflags(write=False)  # shared by all callers
+        _prediction_cache.put(key, output)
+        logging.info(f"Cached {method} of model for {len(output)} rows.")
+
+    return output
+
+def cache_predictions(model, X, y_pred):
+    """
+    Remember class labels that were predicted elsewhere (e.g. while measuring the prediction latency).
+    """
+
+    y_pred.setflags(write=False)
+    _prediction_cache.put((model_key(model), data_key(X), 'predict'), y_pred)
+
+def predict(model, X):
+    """
+    Predict the class labels of the rows of X (cached).
+    """
+
+    return _cached_output(model, X, 'predict')
+
+def predict_proba(model, X):
+    """
+    Predict the class probabilities of the rows of X (cached).
+    """
+
+    return _cached_output(model, X, 'predict_proba')
+
+def apply(model, X):
+    """
+    Get the leaf of every row of X in every tree of a forest (cached).
+    """
+
+    return _cached_output(model, X, 'apply')
@@ -0,0 +1,179 @@
+import os
+import logging
+import numpy as np
+import pandas as pd
+import streamlit as st
+import plotly.graph_objects as go
+
+from services.error_analysis import visualize_error_analysis
+from services.model_store import stored_size
+from services.data import demo_cases
+from config import BLUE, SELECTION_COLOR, MAX_REGISTERED_MODELS
+
+# quality metrics and costs of registered models (label and column of the registry)
+QUALITY_METRICS = {'Accuracy': 'accuracy', 'F1 Score': 'f1'}
+COST_METRICS = {
+    'Training Time (s)': 'train_time',
+    'Prediction Latency (ms per 1000 rows)': 'predict_latency',
+    'Model Size (MB)': 'model_size'
+}
+
+def dataset_name(config):
+    """
+    Get the name of the dataset of a training configuration (uploaded datasets are told apart by their content).
+    """
+
+    if demo_cases[config['selected_demo_case']].get('custom') and config.get('custom_dataset'):
+        return f"{config['selected_demo_case']} ({os.path.basename(config['custom_dataset']).replace('upload-', '')[:8]})"
+
+    return config['selected_demo_case']
+
+def register_model(key, config, result):
+    """
+    Add the results of a training job to the model registry of the session.
+
+    The metrics, confusion matrix and predictions computed at training time are kept, so the registry never
+    predicts again (the model itself is not kept). A model trained again with the same configuration replaces
+    its previous entry.
+    """
+
+    registry = st.session_state.setdefault('model_registry', {})
+    registry.pop(key, None)
+    registry[key] = {
+        'dataset': dataset_name(config),
+        'config': config,
+        'y_test': result['y_test'],
+        'y_pred': result['y_pred'],
+        'unique_labels': result['unique_labels'],
+        'cm': result['cm'],
+        'metrics': result['metrics'],
+        'accuracy': result['accuracy'],
+        'precision': result['precision'],
+        'recall': result['recall'],
+        'f1': result['f1'],
+        'train_time': result['train_time'],
+        'predict_latency': 1000 * 1000 * result['predict_time'] / max(1, len(result['y_test'])),
+        'model_size': (stored_size(result['rf_classifier']) or 0) / 1024**2
+    }
+
+    # forget the oldest models beyond the limit
+    while len(registry) > MAX_REGISTERED_MODELS:
+        del registry[next(iter(registry))]
+
+    logging.info(f"Registered model ({len(registry)} models in registry).")
+
+def registry_frame(registry):
+    """
+    Get the registered models as DataFrame (one row per model with its configuration, metrics and costs).
+    """
+
+    rows = []
+    for key, entry in registry.items():
+        config = entry['config']
+        rows.append({
+            'key': key,
+            'Model': f"{config.get('engine', 'Random Forest')} ({config['n_estimators']} estimators, depth {config['max_depth']}, {config['data_percentage']}% of data)",
+            'Dataset': entry['dataset'],
+            'accuracy': entry['accuracy'],
+            'f1': entry['f1'],
+            'train_time': entry['train_time'],
+            'predict_latency': entry['predict_latency'],
+            'model_size': entry['model_size']
+        })
+
+    return pd.DataFrame(rows)
+
+def pareto_front(quality, cost):
+    """
+    Get a mask of the models that no other model beats in quality at the same or a lower cost.
+    """
+
+    quality, cost = np.asarray(quality), np.asarray(cost)
+    order = np.lexsort((-quality, cost))
+    on_front = np.zeros(len(quality), dtype=bool)
+    best_quality = -np.inf
+    for i in order:
+        if quality[i] > best_quality:
+            on_front[i] = True
+            best_quality = quality[i]
+
+    return on_front
+
+def visualize_model_registry():
+    """
+    Visualize the quality of all registered models against their costs (with the Pareto front).
+    """
+
+    registry = st.session_state.get('model_registry', {})
+    if not registry:
+        st.warning("Please train a model first to compare models.")
+        return
+
+    models = registry_frame(registry)
+
+    # only models of the same dataset can be compared
+    datasets = list(models['Dataset'].unique())
+    selected_dataset = st.selectbox('Dataset', datasets, index=len(datasets) - 1, key='registry_dataset')
+    models = models[models['Dataset'] == selected_dataset].reset_index(drop=True)
+
+    col1, col2, col3 = st.columns(3)
+    quality_label = col1.selectbox('Quality', list(QUALITY_METRICS.keys()), key='registry_quality')
+    cost_label = col2.selectbox('Cost', list(COST_METRICS.keys()), key='registry_cost')
+    quality, cost = QUALITY_METRICS[quality_label], COST_METRICS[cost_label]
+    min_quality = col3.slider(f'Minimum {quality_label}', min_value=0.0, max_value=1.0, value=0.0, step=0.01, key='registry_min_quality')
+
+    # cheapest model that meets the quality bar
+    on_front = pareto_front(models[quality], models[cost])
+    candidates = models[models[quality] >= min_quality]
+    cheapest = candidates[cost].idxmin() if not candidates.empty else None
+
+    # quality against cost (Pareto front as line, cheapest model that meets the bar highlighted)
+    front = models[on_front].sort_values(cost)
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=front[cost], y=front[quality], mode='lines', line=dict(color=BLUE, dash='dash'), name='Pareto Front', hoverinfo='skip'
+    ))
+    fig.add_trace(go.Scatter(
+        x=models[cost], y=models[quality], mode='markers', name='Models',
+        marker=dict(size=12, color=[SELECTION_COLOR if i == cheapest else BLUE for i in models.index]),
+        customdata=models['Model'],
+        hovertemplate=f'%{{customdata}}<br>{cost_label}: %{{x:.3f}}<br>{quality_label}: %{{y:.4f}}<extra></extra>'
+    ))
+    if min_quality > 0:
+        fig.add_hline(y=min_quality, line=dict(color=SELECTION_COLOR, width=1))
+    fig.update_layout(xaxis_title=cost_label, yaxis_title=quality_label, margin=dict(l=20, r=20, t=20, b=20), showlegend=False)
+    st.plotly_chart(fig, key='model_registry')
+
+    if cheapest is None:
+        st.info(f"No model reaches {quality_label} of {min_quality:.2f}.")
+    else:
+        st.write(f"Cheapest model with {quality_label} of at least {min_quality:.2f}: **{models.loc[cheapest, 'Model']}**")
+
+    # all metrics and costs
+    table = models.assign(**{'Pareto Optimal': on_front}).drop(columns=['key', 'Dataset'])
+    table = table.rename(columns={value: label for label, value in {**QUALITY_METRICS, **COST_METRICS}.items()})
+    st.dataframe(table, hide_index=True)
+
+    # error analysis of a registered model (from the predictions and metrics of its training)
+    selected_model = st.selectbox(
+        'Select Model', models.index, index=int(cheapest if cheapest is not None else 0),
+        format_func=lambda i: models.loc[i, 'Model'], key='registry_model'
+    )
+    entry = registry[models.loc[selected_model, 'key']]
+    class_accuracies = dict(zip(entry['unique_labels'], entry['metrics']['class_accuracy']))
+    selected_class = min(class_accuracies, key=class_accuracies.get)
+    visualize_error_analysis(
+        entry['y_test'],
+        entry['y_pred'],
+        entry['unique_labels'],
+        selected_class,
+        list(entry['unique_labels']).index(selected_class),
+        entry['accuracy'],
+        entry['precision'],
+        entry['recall'],
+        entry['f1'],
+        entry['cm'],
+        entry['metrics'],
+        suffix='_registry'
+    )
+    logging.info("Model registry displayed successfully.")
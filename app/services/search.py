@@ -0,0 +1,219 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import streamlit as st
+from sklearn.model_selection import ParameterSampler
+
+from services.cache import fingerprint
+from services.data import load_data, prepare_data
+from services.metrics import compute_metrics
+from services.model import train_model, model_input
+from services.workers import parallel_context
+from config import SEARCH_WORKERS
+
+# hyperparameter space of the search (same ranges as the sliders)
+SEARCH_SPACE = {
+    'max_depth': list(range(2, 41, 2)),
+    'n_estimators': [32, 64, 128, 256, 384, 512],
+    'min_samples_split': list(range(2, 21)),
+    'min_samples_leaf': list(range(1, 21)),
+    'max_features': ['sqrt', 'log2']
+}
+
+# share of the training rows that validates the candidates (the test rows are never used by the search)
+VALIDATION_SIZE = 0.2
+
+# background workers for searches (across all sessions, searches beyond that wait in a queue)
+_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix='search_job')
+
+def search_budgets(num_candidates, max_percentage, eta=3, min_percentage=1):
+    """
+    Get the percentage of data and the number of candidates of every rung of successive halving.
+
+    The last rung uses max_percentage and every rung before uses 1/eta of the data of the next one, while
+    keeping at least eta candidates for the last rung.
+    """
+
+    num_rungs = 1
+    while num_candidates // eta**num_rungs >= eta and max_percentage / eta**num_rungs >= min_percentage:
+        num_rungs += 1
+
+    return [
+        (max_percentage / eta**(num_rungs - 1 - rung), max(1, num_candidates // eta**rung))
+        for rung in range(num_rungs)
+    ]
+
+class SearchJob:
+    """
+    State of a hyperparameter search running in the background.
+    """
+
+    def __init__(self, config, num_candidates, max_percentage, eta=3, seed=42):
+        self.config = config
+        self.num_candidates = num_candidates
+        self.max_percentage = max_percentage
+        self.eta = eta
+        self.seed = seed
+        self.budgets = search_budgets(num_candidates, max_percentage, eta)
+        self.stage = 'Waiting for a worker'
+        self.progress = 0.0
+        self.leaderboard = []
+        self.best = None
+        self.error = None
+        self.cancelled = False
+        self.future = None
+        self.submitted = time.time()
+
+    @property
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def leaderboard_frame(self):
+        """
+        Get the evaluated candidates as DataFrame (the largest budget and the best and fastest candidates first).
+        """
+
+        leaderboard = pd.DataFrame(self.leaderboard)
+        if leaderboard.empty:
+            return leaderboard
+
+        return leaderboard.sort_values(['Data (%)', 'Accuracy', 'Training Time (s)'], ascending=[False, False, True]).reset_index(drop=True)
+
+def _run_search(job, n_jobs):
+    """
+    Run successive halving: train all candidates on a small sample and only the best ones on larger samples.
+    """
+
+    config = job.config
+    try:
+        with parallel_context(n_jobs):
+            job.stage = 'Loading the data'
+            dataset = load_data(
+                selected_demo_case=config['selected_demo_case'],
+                custom_dataset=config.get('custom_dataset')
+            )
+            if dataset is None:
+                job.error = "Data loading failed. Please adjust data settings."
+                return
+
+            candidates = list(ParameterSampler(SEARCH_SPACE, job.num_candidates, random_state=job.seed))
+            evaluations_total = sum(num_candidates for _, num_candidates in job.budgets)
+            evaluations_done = 0
+            ranked = False
+
+            for rung, (percentage, num_candidates) in enumerate(job.budgets):
+                # only ranked candidates are pruned (the candidates of a skipped rung move on to the next rung)
+                if ranked:
+                    candidates = candidates[:num_candidates]
+                evaluations_total += len(candidates) - num_candidates
+                job.stage = f'Rung {rung + 1} of {len(job.budgets)}: {len(candidates)} candidates on {percentage:.1f}% of the data'
+
+                # split the training rows of the sample into rows for fitting and for validation
+                plan = prepare_data(dataset, percentage, config.get('stratify', False))
+                num_validation = 0 if plan is None else int(plan.num_train * VALIDATION_SIZE)
+                if plan is None or num_validation < 1:
+                    logging.warning(f"Skipped rung {rung + 1} of the search as {percentage:.1f}% of the data is too small.")
+                    evaluations_total -= len(candidates)
+                    continue
+                y_train, _, _ = plan.labels
+                X_train = plan.X_train()
+                num_fit = plan.num_train - num_validation
+                X_validation = model_input(X_train.iloc[num_fit:])
+
+                scores, train_times = [], []
+                for params in candidates:
+                    if job.cancelled:
+                        logging.info("Search cancelled.")
+                        return
+
+                    train_start = time.time()
+                    model = train_model(
+                        X_train.iloc[:num_fit],
+                        y_train[:num_fit],
+                        data_key=fingerprint(plan.key, 'search', num_fit),
+                        engine=config.get('engine', 'Random Forest'),
+                        persist=False,
+                        **params
+                    )
+                    train_time = time.time() - train_start
+                    metrics = compute_metrics(y_train[num_fit:], model.predict(X_validation), len(dataset.categories))
+                    scores.append(float(metrics['accuracy']))
+                    train_times.append(train_time)
+
+                    job.leaderboard.append({
+                        'Rung': rung + 1,
+                        'Data (%)': round(percentage, 2),
+                        'Accuracy': float(metrics['accuracy']),
+                        'F1': float(metrics['f1']),
+                        'Training Time (s)': round(train_time, 2),
+                        **params
+                    })
+                    evaluations_done += 1
+                    job.progress = evaluations_done / evaluations_total
+
+                # the best candidates (the faster one of equally good ones) advance to the next rung
+                order = sorted(range(len(candidates)), key=lambda i: (-scores[i], train_times[i]))
+                candidates = [candidates[i] for i in order]
+                ranked = True
+
+            if not ranked:
+                job.error = "The data is too small to validate the candidates. Please increase the data percentage."
+                return
+
+            job.best = candidates[0]
+            logging.info(f"Search finished in {time.time() - job.submitted:.2f} seconds. Best parameters: {job.best}")
+    except Exception as e:
+        logging.exception("Search failed.")
+        job.error = f"Search failed: {e}"
+    finally:
+        job.progress = 1.0
+
+def submit_search_job(config, num_candidates, max_percentage, n_jobs=1):
+    """
+    Start a hyperparameter search in the background.
+    """
+
+    job = SearchJob(config, num_candidates, max_percentage)
+    job.future = _executor.submit(_run_search, job, n_jobs)
+    logging.info(f"Submitted search with {num_candidates} candidates and budgets {job.budgets}: {config}")
+
+    return job
+
+def collect_search_job(suffix):
+    """
+    Move the results of a finished search into the session state.
+
+    Returns the job if it is still running.
+    """
+
+    job = st.session_state.get(f'search_job{suffix}')
+    if job is None or not job.done:
+        return job
+
+    del st.session_state[f'search_job{suffix}']
+    if job.error:
+        st.session_state[f'search_error{suffix}'] = job.error
+    if job.best is not None:
+        st.session_state[f'search_result{suffix}'] = {
+            'best': job.best,
+            'data_percentage': job.max_percentage,
+            'leaderboard': job.leaderboard_frame()
+        }
+    logging.info(f"Collected results of search{' for comparison model' if suffix else ''}.")
+
+    return None
+
+@st.fragment(run_every=1)
+def show_search_progress(job):
+    """
+    Show the progress and the leaderboard of a running search and rerun the app once it has finished.
+    """
+
+    if job.done:
+        st.rerun()
+
+    st.progress(job.progress, text=f"{job.stage}...")
+    leaderboard = job.leaderboard_frame()
+    if not leaderboard.empty:
+        st.dataframe(leaderboard, hide_index=True)
@@ -0,0 +1,79 @@
+import os
+import time
+import logging
+import threading
+import streamlit as st
+from joblib import parallel_config
+
+from config import MAX_WORKERS, SESSION_TIMEOUT
+
+# last time each session asked for workers
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def available_cores():
+    """
+    Get the number of CPU cores this process may use.
+    """
+
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def get_max_workers():
+    """
+    Get the configured maximum number of workers per session.
+
+    The default from config.py can be overridden with max_workers in the [workers] section of
+    .streamlit/secrets.toml (0 uses all available cores).
+    """
+
+    max_workers = MAX_WORKERS
+    try:
+        max_workers = int(st.secrets.get('workers', {}).get('max_workers', MAX_WORKERS))
+    except FileNotFoundError:
+        pass
+
+    cores = available_cores()
+    return cores if max_workers <= 0 else min(max_workers, cores)
+
+def _session_id():
+    """
+    Get the id of the current Streamlit session.
+    """
+
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+    except ImportError:
+        ctx = None
+
+    return ctx.session_id if ctx is not None else 'default'
+
+def worker_budget(requested_workers):
+    """
+    Cap the requested number of workers so that all active sessions share the available cores.
+    """
+
+    now = time.time()
+    with _sessions_lock:
+        _sessions[_session_id()] = now
+
+        # forget sessions that have been inactive for a while
+        for session_id, last_seen in list(_sessions.items()):
+            if now - last_seen > SESSION_TIMEOUT:
+                del _sessions[session_id]
+        active_sessions = len(_sessions)
+
+    cores = available_cores()
+    effective_workers = max(1, min(requested_workers, get_max_workers(), cores // active_sessions))
+    logging.info(f"Using {effective_workers} of {cores} cores ({active_sessions} active sessions, {requested_workers} requested).")
+
+    return effective_workers
+
+def parallel_context(n_jobs):
+    """
+    Run sklearn training and prediction inside the block with n_jobs workers.
+    """
+
+    return parallel_config(n_jobs=n_jobs, prefer='threads')
@@ -1,3 +1,4 @@
+import time
 import unittest
 from streamlit.testing.v1 import AppTest
 
@@ -27,7 +28,13 @@ class TestApp(unittest.TestCase):
         
         # simulate pressing the 'Update Model' button
         self.app_test.button[0].click().run()
-        self.app_test.run()
+
+        # wait for the background training job to finish
+        for _ in range(60):
+            self.app_test.run()
+            if 'rf_classifier' in self.app_test.session_state:
+                break
+            time.sleep(1)
         
         self.assertIn('rf_classifier', self.app_test.session_state, "Model was not saved in session state")
         self.assertIsNotNone(self.app_test.session_state.rf_classifier, "The model was not trained successfully")
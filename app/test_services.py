@@ -0,0 +1,738 @@
+import copy
+import io
+import itertools
+import math
+import os
+import tempfile
+import unittest
+from unittest import mock
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier, HistGradientBoostingClassifier
+from sklearn.metrics import confusion_matrix, accuracy_score, precision_score, recall_score, f1_score
+
+from services.metrics import compute_metrics, confusion_counts
+from services.forest import ForestIndex, BoostingIndex, get_forest_index
+from services.model import model_input, train_model, model_engine, feature_importances, _forest_cache
+from services import model_store, feature_store
+from services.data import SplitPlan, prepare_data
+from services.search import search_budgets, SearchJob
+from services import search
+from services.registry import pareto_front, register_model
+from services import registry
+from services import predictions, feature_importance
+from services.cache import data_key, fingerprint
+from services.feature_groups import fixed_width_groups, correlation_groups, importance_frame
+from services.tree_shap import TreeShap
+from services import tree_shap
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Create random labels with one class that is never predicted.
+        """
+
+        rng = np.random.default_rng(0)
+        self.y_test = rng.integers(0, 4, size=500)
+        self.y_pred = np.where(rng.random(500) < 0.7, self.y_test, rng.integers(0, 3, size=500))
+
+    def test_metrics_match_sklearn(self):
+        """
+        Test if the metrics kernel matches the sklearn metrics.
+        """
+
+        metrics = compute_metrics(self.y_test, self.y_pred, num_classes=4)
+
+        np.testing.assert_array_equal(metrics['confusion_matrix'], confusion_matrix(self.y_test, self.y_pred, labels=range(4)))
+        self.assertAlmostEqual(metrics['accuracy'], accuracy_score(self.y_test, self.y_pred))
+        self.assertAlmostEqual(metrics['precision'], precision_score(self.y_test, self.y_pred, average='weighted', zero_division=0))
+        self.assertAlmostEqual(metrics['recall'], recall_score(self.y_test, self.y_pred, average='weighted', zero_division=0))
+        self.assertAlmostEqual(metrics['f1'], f1_score(self.y_test, self.y_pred, average='weighted', zero_division=0))
+
+        # one vs. rest metrics of every class
+        for i in range(4):
+            class_y_test = (self.y_test == i).astype(int)
+            class_y_pred = (self.y_pred == i).astype(int)
+            tn, fp, fn, tp = confusion_matrix(class_y_test, class_y_pred, labels=[0, 1]).ravel()
+            self.assertEqual((metrics['tp'][i], metrics['tn'][i], metrics['fp'][i], metrics['fn'][i]), (tp, tn, fp, fn))
+            self.assertAlmostEqual(metrics['class_accuracy'][i], accuracy_score(class_y_test, class_y_pred))
+            self.assertAlmostEqual(metrics['class_precision'][i], precision_score(class_y_test, class_y_pred, zero_division=0))
+            self.assertAlmostEqual(metrics['class_f1'][i], f1_score(class_y_test, class_y_pred, zero_division=0))
+
+    def test_batched_confusion_counts(self):
+        """
+        Test if stacked predictions yield one confusion matrix per block.
+        """
+
+        blocks = np.stack([self.y_pred, self.y_test, np.zeros_like(self.y_pred)])
+        counts = confusion_counts(self.y_test, blocks, num_classes=4)
+
+        self.assertEqual(counts.shape, (3, 4, 4))
+        for block, block_counts in zip(blocks, counts):
+            np.testing.assert_array_equal(block_counts, confusion_matrix(self.y_test, block, labels=range(4)))
+
+class TestForestIndex(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Train a small random forest on random data.
+        """
+
+        rng = np.random.default_rng(0)
+        self.X = pd.DataFrame(rng.normal(size=(300, 12)), columns=[f'feature_{i}' for i in range(12)])
+        y = (self.X['feature_0'] + self.X['feature_1'] > 0).astype(int) + (self.X['feature_2'] > 1)
+        self.model = RandomForestClassifier(n_estimators=20, max_depth=6, random_state=0).fit(model_input(self.X[:200]), y[:200])
+        self.X_test = self.X[200:].reset_index(drop=True)
+
+    def test_perturbed_predictions(self):
+        """
+        Test if re-evaluating only affected subtrees matches a full prediction of the perturbed rows.
+        """
+
+        index = ForestIndex(self.model, self.X_test)
+        rng = np.random.default_rng(1)
+        rows = rng.integers(0, len(self.X_test), size=500)
+        values = rng.normal(size=(500, 2)) * 2
+
+        perturbed = self.X_test.to_numpy()[rows]
+        perturbed[:, [0, 5]] = values
+        expected = self.model.predict_proba(model_input(perturbed))
+
+        np.testing.assert_allclose(index.predict_proba_perturbed(rows, [0, 5], values), expected)
+        np.testing.assert_array_equal(index.predict_perturbed(rows, [0, 5], values), expected.argmax(axis=1))
+
+    def test_boosting_perturbed_predictions(self):
+        """
+        Test if re-evaluating only the boosting trees that split on perturbed features matches a full prediction.
+        """
+
+        model = HistGradientBoostingClassifier(max_iter=15, max_features=0.5, random_state=0).fit(model_input(self.X[:200]), self.model.predict(model_input(self.X[:200])))
+        index = BoostingIndex(model, self.X_test)
+        rng = np.random.default_rng(1)
+        rows = rng.integers(0, len(self.X_test), size=500)
+        values = rng.normal(size=(500, 1)) * 2
+
+        perturbed = self.X_test.to_numpy()[rows]
+        perturbed[:, [3]] = values
+
+        self.assertLess(len(index.affected([3])['trees']), index.num_trees)
+        np.testing.assert_allclose(index.predict_proba_perturbed(rows, [3], values), model.predict_proba(model_input(perturbed)))
+        np.testing.assert_array_equal(index.predict_perturbed(rows, [3], values), model.predict(model_input(perturbed)))
+
+        # without the scikit-learn internals the index falls back to a plain predict
+        with mock.patch.object(BoostingIndex, '_tree_outputs', side_effect=TypeError('changed signature')):
+            self.assertIsNone(get_forest_index(model, self.X_test.iloc[:50]))
+        unsupported = copy.copy(model)
+        del unsupported._predictors
+        self.assertIsNone(get_forest_index(unsupported, self.X_test))
+
+    def test_missing_values(self):
+        """
+        Test if rows with missing values are predicted without the forest index.
+        """
+
+        X = self.X.copy()
+        X.iloc[::7, 0] = np.nan
+        y = (X['feature_1'] > 0).astype(int)
+        model = RandomForestClassifier(n_estimators=10, max_depth=6, random_state=0).fit(model_input(X[:200]), y[:200])
+
+        self.assertIsNone(get_forest_index(model, X[200:]))
+        self.assertIsNotNone(get_forest_index(model, X[200:].dropna()))
+
+    def test_cached_predictions(self):
+        """
+        Test if predictions are computed once per model and rows (identified by content without a key).
+        """
+
+        with mock.patch.object(self.model, 'predict', wraps=self.model.predict) as predict:
+            y_pred = predictions.predict(self.model, self.X_test)
+            np.testing.assert_array_equal(predictions.predict(self.model, self.X_test.copy()), y_pred)
+            predictions.predict(self.model, self.X_test.iloc[:50])
+
+        self.assertEqual(predict.call_count, 2)
+        np.testing.assert_array_equal(y_pred, self.model.predict(model_input(self.X_test)))
+
+    def test_refined_interval_importance(self):
+        """
+        Test if refining the intervals only predicts rows at new limits and matches a computation from scratch.
+        """
+
+        y_test = self.model.predict(model_input(self.X_test))
+        y_test[::7] = 0
+        metrics = compute_metrics(y_test, self.model.predict(model_input(self.X_test)))
+        original = [metrics[name] for name in ['accuracy', 'precision', 'recall', 'f1']]
+
+        with mock.patch.object(feature_importance, '_predict_perturbed', wraps=feature_importance._predict_perturbed) as predict_perturbed:
+            feature_importance._interval_importance(self.model, self.X_test, y_test, *original, 0, 5)
+            refined = feature_importance._interval_importance(self.model, self.X_test, y_test, *original, 0, 10)
+            feature_importance._interval_importance(self.model, self.X_test, y_test, *original, 0, 10)
+
+        # every row is predicted at both limits of its interval, rows at old limits only once
+        self.assertEqual(predict_perturbed.call_count, 2)
+        self.assertEqual(len(predict_perturbed.call_args_list[0].args[2]), 2 * len(self.X_test))
+        self.assertLess(len(predict_perturbed.call_args_list[1].args[2]), 2 * len(self.X_test))
+
+        feature_importance._limit_cache.clear()
+        feature_importance._importance_cache.clear()
+        for cached, expected in zip(refined, feature_importance._interval_importance(self.model, self.X_test, y_test, *original, 0, 10)):
+            np.testing.assert_allclose(cached, expected)
+
+    def test_partial_dependence(self):
+        """
+        Test if partial dependence matches a full prediction at every grid value and reuses the interval importance predictions.
+        """
+
+        y_test = self.model.predict(model_input(self.X_test))
+        metrics = compute_metrics(y_test, y_test)
+        original = [metrics[name] for name in ['accuracy', 'precision', 'recall', 'f1']]
+        feature_importance._limit_cache.clear()
+        feature_importance._importance_cache.clear()
+
+        with mock.patch.object(feature_importance, '_predict_perturbed', wraps=feature_importance._predict_perturbed) as predict_perturbed:
+            feature_importance._interval_importance(self.model, self.X_test, y_test, *original, 1, 4)
+            grid, partial_dependence, ice = feature_importance._partial_dependence(self.model, self.X_test, 1, 4, max_ice_rows=10)
+
+        # every row was predicted at the limits of its interval before, only the other limits are new
+        self.assertEqual(len(predict_perturbed.call_args_list[1].args[2]), 5 * len(self.X_test) - 2 * len(self.X_test))
+
+        X_values = self.X_test.to_numpy()
+        expected = []
+        for value in grid:
+            perturbed = X_values.copy()
+            perturbed[:, 1] = value
+            expected.append(self.model.predict_proba(model_input(perturbed)))
+        expected = np.stack(expected)
+
+        np.testing.assert_allclose(partial_dependence, expected.mean(axis=1))
+        self.assertEqual(ice.shape, (10, len(grid), len(self.model.classes_)))
+        for curve in ice:
+            self.assertTrue(any(np.allclose(curve, expected[:, row]) for row in range(len(self.X_test))))
+
+    def test_interval_binning(self):
+        """
+        Test if quantile intervals hold equally many rows, histogram intervals are never empty, the binary search
+        finds the rows of every interval and adaptive intervals only split intervals with large differences.
+        """
+
+        X_test = self.X_test.copy()
+        X_test['feature_1'] = np.exp(2 * X_test['feature_1'])  # skewed
+        values = X_test['feature_1'].to_numpy()
+
+        quantile = feature_importance._define_intervals(X_test, 1, 4, 'Quantile')
+        self.assertEqual(len(quantile), 5)
+        np.testing.assert_array_equal(np.histogram(values, quantile)[0], [25, 25, 25, 25])
+
+        uniform = feature_importance._define_intervals(X_test, 1, 20, 'Uniform')
+        histogram = feature_importance._define_intervals(X_test, 1, 20, 'Histogram')
+        self.assertTrue(set(histogram) <= set(uniform))
+        self.assertLess(len(histogram), len(uniform))
+        self.assertTrue(np.all(np.histogram(values, histogram)[0] > 0))
+
+        interval_ids, interval_rows = feature_importance._interval_rows(X_test, (1,), uniform)
+        expected_ids, expected_rows = np.nonzero((values >= uniform[:-1, None]) & (values <= uniform[1:, None]))
+        self.assertEqual(set(zip(interval_ids, interval_rows)), set(zip(expected_ids, expected_rows)))
+
+        y_test = self.model.predict(model_input(X_test))
+        metrics = compute_metrics(y_test, y_test)
+        original = [metrics[name] for name in ['accuracy', 'precision', 'recall', 'f1']]
+        start = feature_importance._interval_importance(self.model, X_test, y_test, *original, 1, 4, 'Uniform')
+        adaptive = feature_importance._interval_importance(self.model, X_test, y_test, *original, 1, 4, 'Adaptive')
+
+        # the uniform starting limits are kept and the most sensitive interval is split
+        self.assertTrue(set(start[-1]) <= set(adaptive[-1]))
+        self.assertGreater(len(adaptive[-1]), len(start[-1]))
+        most_sensitive = np.argmax(start[0])
+        self.assertTrue(np.any((adaptive[-1] > start[-1][most_sensitive]) & (adaptive[-1] < start[-1][most_sensitive + 1])))
+
+    def test_joint_importance_unseen_class(self):
+        """
+        Test if joint interval importance counts a class that is only predicted for perturbed rows.
+        """
+
+        rng = np.random.default_rng(0)
+        X = pd.DataFrame(rng.uniform(-2, 2, size=(600, 2)), columns=['a', 'b'])
+        y = np.where((X['a'] > 1) & (X['b'] > 1), 2, (X['a'] > 0).astype(int))
+        model = RandomForestClassifier(n_estimators=10, random_state=0).fit(model_input(X), y)
+
+        # the test rows are never (predicted as) class 2, the joint grid reaches the region of class 2
+        X_test = X[(y != 2) & ((X['a'] < 0.5) | (X['b'] < 0.5))].reset_index(drop=True)
+        y_test = model.predict(model_input(X_test))
+        self.assertEqual(y_test.max(), 1)
+
+        accuracy_diffs = feature_importance._joint_interval_importance(model, X_test, y_test, 0, 1, 4, 4)[0]
+        self.assertEqual(accuracy_diffs.shape, (4, 4))
+        self.assertGreater(accuracy_diffs[-1, -1], 0.5)
+
+    def test_permutation_importance(self):
+        """
+        Test if permutation importance ranks the informative features first, stops uninformative features
+        early and gives the same result with the forest index and with batched plain predictions.
+        """
+
+        y_test = self.model.predict(model_input(self.X_test))
+        feature_importance._importance_cache.clear()
+        importance, std, repeats = feature_importance._permutation_importance(self.model, self.X_test, y_test, max_repeats=6)
+
+        self.assertEqual(set(np.argsort(-importance)[:3]), {0, 1, 2})
+        self.assertTrue(np.all(repeats >= 3))
+        self.assertTrue(np.all(repeats[importance == 0] == 3))
+
+        feature_importance._importance_cache.clear()
+        with mock.patch.object(feature_importance, 'get_forest_index', return_value=None):
+            batched = feature_importance._permutation_importance(self.model, self.X_test, y_test, max_repeats=6)
+        for expected, actual in zip((importance, std, repeats), batched):
+            np.testing.assert_allclose(actual, expected)
+
+    def test_band_interval_importance(self):
+        """
+        Test if shifting a band of features to both limits of its intervals matches a full prediction of the shifted rows.
+        """
+
+        y_test = self.model.predict(model_input(self.X_test))
+        y_test[::5] = 0
+        metrics = compute_metrics(y_test, self.model.predict(model_input(self.X_test)))
+        original = [metrics[name] for name in ['accuracy', 'precision', 'recall', 'f1']]
+        accuracy_diffs, _, _, _, intervals = feature_importance._interval_importance(self.model, self.X_test, y_test, *original, (0, 1, 2), 4)
+
+        X_values = self.X_test.to_numpy()
+        band_mean = X_values[:, :3].mean(axis=1)
+        for i in range(4):
+            in_interval = (band_mean >= intervals[i]) & (band_mean <= intervals[i + 1])
+            correct = []
+            for limit in intervals[i:i + 2]:
+                shifted = X_values.copy()
+                shifted[in_interval, :3] += (limit - band_mean[in_interval])[:, None]
+                correct.append(self.model.predict(model_input(shifted)) == y_test)
+            expected = abs(metrics['accuracy'] - np.mean(correct))
+            self.assertAlmostEqual(accuracy_diffs[i], max(expected, 1e-10))
+
+class TestFeatureGroups(unittest.TestCase):
+
+    def test_groups(self):
+        """
+        Test if the columns are partitioned into contiguous bands of a fixed width or of correlated neighbours.
+        """
+
+        self.assertEqual(fixed_width_groups(7, 3), [(0, 1, 2), (3, 4, 5), (6,)])
+
+        rng = np.random.default_rng(0)
+        base = rng.normal(size=(200, 1))
+        X = np.hstack([base, base + rng.normal(scale=0.1, size=(200, 2)), rng.normal(size=(200, 2))])
+        self.assertEqual(correlation_groups(X, 0.9), [(0, 1, 2), (3,), (4,)])
+
+        # a threshold that merges all columns still leaves two bands
+        groups = correlation_groups(X, 0.0)
+        self.assertEqual(len(groups), 2)
+        self.assertEqual(sum(groups, ()), tuple(range(5)))
+
+        importance = importance_frame([0.1, 0.2, 0.3, 0.4], ['a', 'b', 'c', 'd'], [(0, 1, 2), (3,)])
+        self.assertEqual(list(importance['feature']), ['a to c', 'd'])
+        np.testing.assert_allclose(importance['importance'], [0.6, 0.4])
+
+class TestTreeShap(unittest.TestCase):
+
+    def conditional_expectation(self, tree, x, known, node=0):
+        """
+        Expected class probabilities of a tree if only the features in known are set (path-dependent).
+        """
+
+        left, right = tree.children_left[node], tree.children_right[node]
+        if left < 0:
+            return tree.value[node, 0] / tree.value[node, 0].sum()
+        if tree.feature[node] in known:
+            return self.conditional_expectation(tree, x, known, left if x[tree.feature[node]] <= tree.threshold[node] else right)
+        cover = tree.weighted_n_node_samples
+        return (cover[left] * self.conditional_expectation(tree, x, known, left) + cover[right] * self.conditional_expectation(tree, x, known, right)) / cover[node]
+
+    def test_shap_values(self):
+        """
+        Test if the SHAP values match the Shapley values of all feature subsets and add up to the predictions.
+        """
+
+        rng = np.random.default_rng(0)
+        X = rng.normal(size=(300, 5)).astype(np.float32)
+        y = (X[:, 0] + X[:, 1] * X[:, 2] > 0).astype(int) + (X[:, 3] > 1)
+        model = RandomForestClassifier(n_estimators=5, max_depth=7, random_state=0).fit(X, y)
+        explainer = TreeShap(model)
+        shap_values = explainer.shap_values(X[:4])
+
+        np.testing.assert_allclose(shap_values.sum(axis=1) + explainer.expected_value, model.predict_proba(X[:4]), atol=1e-10)
+
+        for x, values in zip(X[:4], shap_values):
+            expected = np.zeros_like(values)
+            for i in range(5):
+                others = [j for j in range(5) if j != i]
+                for size in range(5):
+                    for subset in itertools.combinations(others, size):
+                        weight = math.factorial(size) * math.factorial(4 - size) / math.factorial(5)
+                        for estimator in model.estimators_:
+                            gain = self.conditional_expectation(estimator.tree_, x, set(subset) | {i}) - self.conditional_expectation(estimator.tree_, x, set(subset))
+                            expected[i] += weight * gain / len(model.estimators_)
+            np.testing.assert_allclose(values, expected, atol=1e-10)
+
+    def test_batch_budget(self):
+        """
+        Test if the rows are explained in batches that fit into the memory budget (with the same SHAP values).
+        """
+
+        rng = np.random.default_rng(0)
+        X = rng.normal(size=(100, 5)).astype(np.float32)
+        model = RandomForestClassifier(n_estimators=5, max_depth=5, random_state=0).fit(X, (X[:, 0] > 0).astype(int))
+        explainer = TreeShap(model)
+        expected = explainer.shap_values(X[:10])
+
+        with mock.patch.object(tree_shap, 'SHAP_BATCH_BYTES', 3 * explainer.bytes_per_row()), \
+             mock.patch.object(explainer, '_explain_batch', wraps=explainer._explain_batch) as explain_batch:
+            np.testing.assert_allclose(explainer.shap_values(X[:10]), expected)
+        self.assertEqual([len(call.args[0]) for call in explain_batch.call_args_list], [3, 3, 3, 1])
+
+class TestModelStore(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Use a temporary directory as model store.
+        """
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.patch = mock.patch.object(model_store, 'MODEL_STORE_DIR', self.directory.name)
+        self.patch.start()
+
+        rng = np.random.default_rng(0)
+        X, y = rng.normal(size=(100, 4)), rng.integers(0, 2, size=100)
+        self.models = [RandomForestClassifier(n_estimators=n, random_state=0).fit(X, y) for n in (5, 10)]
+
+    def tearDown(self):
+        self.patch.stop()
+        self.directory.cleanup()
+
+    def test_load_largest_forest(self):
+        """
+        Test if the largest stored forest of a key is loaded.
+        """
+
+        self.assertIsNone(model_store.load_forest('key'))
+        for model in self.models:
+            model_store.save_forest(model, 'key')
+
+        loaded = model_store.load_forest('key')
+        self.assertEqual(len(loaded.estimators_), 10)
+        np.testing.assert_array_equal(loaded.estimators_[0].tree_.threshold, self.models[1].estimators_[0].tree_.threshold)
+
+        # the smaller forest is superseded by the larger one (but not the other way round)
+        self.assertEqual(os.listdir(self.directory.name), ['key-10.joblib'])
+        model_store.save_forest(self.models[0], 'key')
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ['key-10.joblib', 'key-5.joblib'])
+
+    def test_forest_file(self):
+        """
+        Test if the downloadable file is the stored forest.
+        """
+
+        data = model_store.forest_file(self.models[0])
+        with open(os.path.join(self.directory.name, 'forest.joblib'), 'wb') as file:
+            file.write(data)
+        loaded = joblib.load(os.path.join(self.directory.name, 'forest.joblib'))
+        self.assertEqual(len(loaded.estimators_), 5)
+
+    def test_eviction(self):
+        """
+        Test if the least recently used forests are evicted beyond the size limit.
+        """
+
+        path = model_store.save_forest(self.models[0], 'old')
+        os.utime(path, (0, 0))
+        with mock.patch.object(model_store, 'MODEL_STORE_MAX_BYTES', os.path.getsize(path)):
+            model_store.save_forest(self.models[1], 'new')
+
+        self.assertIsNone(model_store.load_forest('old'))
+        self.assertIsNotNone(model_store.load_forest('new'))
+
+    def test_boosting_engine(self):
+        """
+        Test if a gradient boosting model is trained, stored and reused and has a feature importance.
+        """
+
+        rng = np.random.default_rng(0)
+        X = rng.normal(size=(200, 4))
+        y = (X[:, 1] > 0).astype(int)
+        model = train_model(X, y, 3, 20, 2, 1, 'sqrt', engine='Histogram Gradient Boosting')
+
+        self.assertEqual(model_engine(model), 'Histogram Gradient Boosting')
+        self.assertEqual(np.argmax(feature_importances(model)), 1)
+        self.assertAlmostEqual(feature_importances(model).sum(), 1)
+        self.assertEqual(model_store.model_size(model_store.load_forest(model_store._stored_models[model])), model.n_iter_)
+
+    def test_unpersisted_model(self):
+        """
+        Test if a model trained without persisting (e.g. a search candidate) is not written to the store.
+        """
+
+        rng = np.random.default_rng(1)
+        X = rng.normal(size=(100, 4))
+        y = (X[:, 0] > 0).astype(int)
+        for engine in ['Random Forest', 'Histogram Gradient Boosting']:
+            train_model(X, y, 3, 10, 2, 1, 'sqrt', engine=engine, persist=False)
+
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+class TestFeatureStore(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Write a small preset as CSV files and use a temporary directory as feature store.
+        """
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.patch = mock.patch.object(feature_store, 'FEATURE_STORE_DIR', self.directory.name)
+        self.patch.start()
+
+        rng = np.random.default_rng(0)
+        self.df_training = pd.DataFrame(rng.normal(size=(50, 6)), columns=[f'feature_{i}' for i in range(6)])
+        self.df_target = pd.DataFrame({'x': rng.choice(['low', 'high', 'moderate'], size=50)})
+        self.case = {
+            'target': os.path.join(self.directory.name, 'target.csv'),
+            'training': os.path.join(self.directory.name, 'training.csv')
+        }
+        self.df_target.to_csv(self.case['target'], index=False)
+        self.df_training.to_csv(self.case['training'], index=False)
+
+    def tearDown(self):
+        self.patch.stop()
+        self.directory.cleanup()
+
+    def test_load_preset(self):
+        """
+        Test if a converted preset matches the CSV files (also with column projection).
+        """
+
+        dataset = feature_store.load_preset(self.case)
+
+        np.testing.assert_allclose(dataset.training_frame().to_numpy(), self.df_training.to_numpy(), rtol=1e-6)
+        np.testing.assert_array_equal(dataset.target_frame()['x'].astype(str), self.df_target['x'])
+        pd.testing.assert_frame_equal(dataset.training_frame(['feature_4', 'feature_1']), dataset.training_frame()[['feature_4', 'feature_1']])
+        self.assertEqual(dataset.target.dtype, np.uint8)
+
+    def test_changed_csv(self):
+        """
+        Test if a preset is converted again when its CSV files change.
+        """
+
+        feature_store.load_preset(self.case)
+        self.df_training.iloc[:10].to_csv(self.case['training'], index=False)
+        self.df_target.iloc[:10].to_csv(self.case['target'], index=False)
+
+        self.assertEqual(len(feature_store.load_preset(self.case)), 10)
+
+    def test_touched_csv(self):
+        """
+        Test if a preset is not converted again (and keeps its source) when only the CSV file times change.
+        """
+
+        source = feature_store.load_preset(self.case).meta['source']
+        os.utime(self.case['training'], ns=(0, 0))
+
+        with mock.patch.object(feature_store, 'write_dataset', wraps=feature_store.write_dataset) as write_dataset:
+            self.assertEqual(feature_store.load_preset(self.case).meta['source'], source)
+        write_dataset.assert_not_called()
+
+    def test_nested_samples(self):
+        """
+        Test if smaller samples are prefixes of larger ones and the data matches the planned rows.
+        """
+
+        dataset = feature_store.load_preset(self.case)
+        plans = [prepare_data(dataset, data_percentage) for data_percentage in (20, 60, 100)]
+
+        for plan, larger_plan in zip(plans, plans[1:]):
+            np.testing.assert_array_equal(larger_plan.train_rows[:plan.num_train], plan.train_rows)
+            np.testing.assert_array_equal(larger_plan.test_rows[:plan.num_test], plan.test_rows)
+
+        for plan in plans:
+            self.assertEqual(plan.num_test, int(np.ceil(0.2 * plan.sample_size)))
+            self.assertEqual(len(np.intersect1d(plan.train_rows, plan.test_rows)), 0)
+            np.testing.assert_array_equal(np.sort(np.concatenate([plan.train_rows, plan.test_rows])), np.sort(plan.sampled_rows))
+
+            # data and labels of the planned rows (also when extending a cached smaller sample)
+            y_train, y_test, label_encoder = plan.labels
+            np.testing.assert_allclose(plan.X_train().to_numpy(), self.df_training.iloc[plan.train_rows].to_numpy(), rtol=1e-6)
+            np.testing.assert_allclose(plan.X_test().to_numpy(), self.df_training.iloc[plan.test_rows].to_numpy(), rtol=1e-6)
+            self.assertTrue(plan.X_test().to_numpy().flags['C_CONTIGUOUS'])
+            np.testing.assert_array_equal(label_encoder.inverse_transform(y_test), self.df_target['x'].iloc[plan.test_rows])
+
+    def test_modified_data_key(self):
+        """
+        Test if the key attached to the planned rows is dropped for copies and modified frames.
+        """
+
+        dataset = feature_store.load_preset(self.case)
+        plan = prepare_data(dataset, 100)
+        X_test = plan.X_test()
+        y_test = plan.labels[1]
+        model = RandomForestClassifier(n_estimators=5, random_state=0).fit(model_input(X_test), y_test)
+
+        self.assertEqual(data_key(X_test), data_key(plan.X_test()))
+        self.assertNotEqual(data_key(X_test), fingerprint(X_test))
+        with self.assertRaises(ValueError):
+            X_test.iloc[0, 0] = 1  # the rows are shared by all sessions
+
+        modified = X_test.copy()
+        modified['feature_0'] = 1 - modified['feature_0']
+        self.assertEqual(data_key(modified), fingerprint(modified))
+        np.testing.assert_array_equal(predictions.predict(model, modified), model.predict(model_input(modified)))
+
+        X_test['feature_0'] = 1 - X_test['feature_0']
+        self.assertEqual(data_key(X_test), fingerprint(X_test))
+
+    def test_stratified_split(self):
+        """
+        Test if a stratified split puts a share of every class into the test rows.
+        """
+
+        dataset = feature_store.load_preset(self.case)
+        plan = SplitPlan(dataset, 100, stratify=True)
+        class_counts = np.bincount(dataset.target)
+        test_counts = np.bincount(dataset.target[plan.test_rows], minlength=len(class_counts))
+
+        self.assertTrue(plan.is_valid())
+        np.testing.assert_array_equal(test_counts, np.ceil(0.2 * class_counts))
+        self.assertFalse(SplitPlan(dataset, 4, stratify=True).is_valid())
+
+    def test_ingest_upload(self):
+        """
+        Test if uploaded files are streamed in chunks into the same dataset as a single read.
+        """
+
+        target_file = io.BytesIO(self.df_target.to_csv(index=False).encode())
+        training_file = io.BytesIO(self.df_training.to_csv(index=False).encode())
+        with mock.patch.object(feature_store, 'INGEST_CHUNK_ELEMENTS', 42):
+            dataset = feature_store.open_dataset(feature_store.ingest_upload(target_file, training_file))
+
+        np.testing.assert_allclose(dataset.training_frame().to_numpy(), self.df_training.to_numpy(), rtol=1e-6)
+        np.testing.assert_array_equal(dataset.target_frame()['x'].astype(str), self.df_target['x'])
+        self.assertEqual(dataset.categories, ['high', 'low', 'moderate'])
+
+    def test_ingest_misaligned_upload(self):
+        """
+        Test if uploads with a different number of rows are rejected.
+        """
+
+        target_file = io.BytesIO(self.df_target.iloc[:-1].to_csv(index=False).encode())
+        training_file = io.BytesIO(self.df_training.to_csv(index=False).encode())
+        with self.assertRaises(ValueError):
+            feature_store.ingest_upload(target_file, training_file)
+        self.assertFalse(any(name.startswith('upload-') for name in os.listdir(self.directory.name)))
+
+    def test_ingest_missing_target(self):
+        """
+        Test if uploads with missing target values are rejected (also mixed with strings).
+        """
+
+        for values in (self.df_target['x'], np.ones(50)):
+            df_target = pd.DataFrame({'x': values}).astype(object)
+            df_target.loc[30, 'x'] = np.nan
+            target_file = io.BytesIO(df_target.to_csv(index=False).encode())
+            training_file = io.BytesIO(self.df_training.to_csv(index=False).encode())
+            with mock.patch.object(feature_store, 'INGEST_CHUNK_ELEMENTS', 42), self.assertRaisesRegex(ValueError, 'row 31'):
+                feature_store.ingest_upload(target_file, training_file)
+        self.assertFalse(any(name.startswith('upload-') for name in os.listdir(self.directory.name)))
+
+
+class TestSearch(unittest.TestCase):
+
+    def test_search_budgets(self):
+        """
+        Test if every rung of successive halving uses 1/eta of the data of the next one with eta times the candidates.
+        """
+
+        budgets = search_budgets(27, 90, eta=3)
+        self.assertEqual([num_candidates for _, num_candidates in budgets], [27, 9, 3])
+        np.testing.assert_allclose([percentage for percentage, _ in budgets], [10, 30, 90])
+
+        # no rungs below the minimum percentage of data
+        self.assertEqual(search_budgets(27, 2, eta=3), [(2, 27)])
+
+    def test_skipped_rung(self):
+        """
+        Test if the candidates of a rung that is skipped (too little data) are not pruned unranked.
+        """
+
+        y = np.arange(100) % 2
+        plan = mock.Mock(num_train=100, labels=(y, None, None), key='plan')
+        plan.X_train.return_value = pd.DataFrame(np.zeros((100, 2)))
+
+        # deeper candidates predict more validation rows correctly
+        def train(X_train, y_train, max_depth, **kwargs):
+            model = mock.Mock()
+            model.predict.side_effect = lambda X: np.where(np.arange(len(X)) < max_depth // 2, y[80:], 1 - y[80:])
+            return model
+
+        job = SearchJob({'selected_demo_case': 'demo'}, num_candidates=9, max_percentage=9)
+        with mock.patch.object(search, 'load_data', return_value=mock.Mock(categories=[0, 1])), \
+             mock.patch.object(search, 'prepare_data', side_effect=lambda dataset, percentage, stratify: plan if percentage > 5 else None), \
+             mock.patch.object(search, 'train_model', side_effect=train):
+            search._run_search(job, 1)
+
+        # all candidates are evaluated on the next rung and the best one wins
+        self.assertEqual(len(job.leaderboard), 9)
+        self.assertEqual(job.best['max_depth'], max(entry['max_depth'] for entry in job.leaderboard))
+        self.assertEqual(job.progress, 1.0)
+
+    def test_cached_forests(self):
+        """
+        Test if a search neither evicts the cached forests nor writes its candidates to the model store.
+        """
+
+        rng = np.random.default_rng(0)
+        X = pd.DataFrame(rng.normal(size=(200, 4)))
+        y = (X[0] > 0).astype(int).to_numpy()
+        plan = mock.Mock(num_train=200, labels=(y, None, None), key='plan')
+        plan.X_train.return_value = X
+
+        _forest_cache.put('cached', 'forest')
+        job = SearchJob({'selected_demo_case': 'demo'}, num_candidates=6, max_percentage=90)
+        with tempfile.TemporaryDirectory() as directory, \
+             mock.patch.object(model_store, 'MODEL_STORE_DIR', directory), \
+             mock.patch.object(search, 'load_data', return_value=mock.Mock(categories=[0, 1])), \
+             mock.patch.object(search, 'prepare_data', return_value=plan):
+            search._run_search(job, 1)
+            self.assertEqual(os.listdir(directory), [])
+
+        self.assertIsNone(job.error)
+        self.assertEqual(_forest_cache.get('cached'), 'forest')
+
+class TestRegistry(unittest.TestCase):
+
+    def test_pareto_front(self):
+        """
+        Test if only models that no cheaper (or equally expensive) model beats in quality are on the Pareto front.
+        """
+
+        quality = [0.8, 0.9, 0.85, 0.9, 0.7]
+        cost = [1.0, 3.0, 2.0, 4.0, 1.0]
+
+        np.testing.assert_array_equal(pareto_front(quality, cost), [True, True, True, False, False])
+
+    def test_register_model(self):
+        """
+        Test if registered models keep their results but not the model and uploads are told apart.
+        """
+
+        result = {
+            'rf_classifier': RandomForestClassifier(n_estimators=2).fit([[0], [1]], [0, 1]),
+            'y_test': np.array([0, 1]), 'y_pred': np.array([0, 1]), 'unique_labels': np.array(['a', 'b']),
+            'cm': np.eye(2), 'metrics': {}, 'accuracy': 1.0, 'precision': 1.0, 'recall': 1.0, 'f1': 1.0,
+            'train_time': 0.1, 'predict_time': 0.01
+        }
+        with mock.patch.object(registry.st, 'session_state', {}):
+            for key, upload in enumerate(['/store/upload-0123456789', '/store/upload-abcdef0123', None]):
+                register_model(key, {'selected_demo_case': 'Custom Data', 'custom_dataset': upload}, result)
+            register_model(3, {'selected_demo_case': 'Wine Dataset', 'custom_dataset': '/store/upload-0123456789'}, result)
+            entries = registry.st.session_state['model_registry']
+
+            self.assertTrue(all('rf_classifier' not in entry for entry in entries.values()))
+            self.assertEqual([entry['dataset'] for entry in entries.values()], ['Custom Data (01234567)', 'Custom Data (abcdef01)', 'Custom Data', 'Wine Dataset'])
+
+if __name__ == '__main__':
+    unittest.main()